@@ -0,0 +1,101 @@
+# coding: utf-8
+# vim: set ts=4 sw=4 et:
+
+import random
+import socket
+import threading
+import time
+
+from utils import log
+
+__author__ = 'Logentries'
+
+__all__ = ['DnsCache']
+
+
+class CachedName(object):
+
+    """Addresses of a name in the order they are tried."""
+
+    def __init__(self, addresses, expires):
+        self.addresses = addresses
+        self.expires = expires
+        # Addresses which failed since the last successful connection
+        self.failed = set()
+
+
+class DnsCache(object):
+
+    """Keeps addresses of names resolved for a while, so reconnects do not
+    wait for DNS. Names resolving to several addresses fail over: an address
+    which failed to connect is moved to the end and the next one is used.
+    If a name cannot be resolved again, its addresses are kept."""
+
+    def __init__(self, ttl):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        # (name, port) -> CachedName
+        self._names = {}
+
+    def _resolve(self, name, port):
+        addresses = []
+        for info in socket.getaddrinfo(name, port, socket.AF_INET, socket.SOCK_STREAM):
+            if info[4][0] not in addresses:
+                addresses.append(info[4][0])
+        # Agents spread over all addresses
+        random.shuffle(addresses)
+        return addresses
+
+    def address(self, name, port):
+        """Returns the address to connect to. Raises socket.error if the name
+        cannot be resolved and no address is known."""
+        key = (name, port)
+        with self._lock:
+            cached = self._names.get(key)
+        if not cached or cached.expires <= time.time():
+            try:
+                addresses = self._resolve(name, port)
+            except socket.error, e:
+                if not cached:
+                    raise
+                log.warning("Cannot resolve %s, using addresses resolved before: %s", name, e)
+                addresses = None
+            with self._lock:
+                if addresses:
+                    if cached:
+                        # Keep the current address first if still valid
+                        current = cached.addresses[0]
+                        if current in addresses:
+                            addresses.remove(current)
+                            addresses.insert(0, current)
+                        failed = cached.failed & set(addresses)
+                    else:
+                        failed = set()
+                    cached = CachedName(addresses, 0)
+                    cached.failed = failed
+                    self._names[key] = cached
+                cached.expires = time.time() + self._ttl
+        return cached.addresses[0]
+
+    def failed(self, name, port, address):
+        """Moves the address which failed to connect to the end. Returns True
+        if there is another address which has not failed yet, False once all
+        have failed."""
+        with self._lock:
+            cached = self._names.get((name, port))
+            if not cached or address not in cached.addresses:
+                return False
+            cached.addresses.remove(address)
+            cached.addresses.append(address)
+            cached.failed.add(address)
+            if len(cached.failed) >= len(cached.addresses):
+                cached.failed.clear()
+                return False
+            return True
+
+    def connected(self, name, port):
+        """Notes a successful connection to the name."""
+        with self._lock:
+            cached = self._names.get((name, port))
+            if cached:
+                cached.failed.clear()
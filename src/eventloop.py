@@ -0,0 +1,229 @@
+# coding: utf-8
+# vim: set ts=4 sw=4 et:
+
+import collections
+import errno
+import fcntl
+import heapq
+import itertools
+import os
+import select
+import threading
+import time
+
+from utils import log
+
+__author__ = 'Logentries'
+
+__all__ = ['EventLoop', 'start_timer']
+
+# Event loop of the agent running in the event loop mode, None otherwise
+current = None
+
+if hasattr(select, 'poll'):
+    POLL_READ = select.POLLIN | select.POLLPRI | select.POLLERR | select.POLLHUP
+    POLL_WRITE = select.POLLOUT | select.POLLERR | select.POLLHUP
+
+
+class Timer(object):
+
+    """Callback scheduled by `EventLoop.call_later'. Has the interface of
+    threading.Timer used by the agent."""
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def join(self, timeout=None):
+        pass
+
+
+class EventLoop(object):
+
+    """Calls callbacks when file descriptors become ready and when timers
+    expire, all in the thread running the loop. Other threads hand over
+    callbacks with `call_soon'."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._readers = {}
+        self._writers = {}
+        self._timers = []
+        self._timer_seq = itertools.count()
+        self._soon = collections.deque()
+        self._running = False
+        self._thread = None
+        if hasattr(select, 'poll'):
+            self._poll = select.poll()
+        else:
+            self._poll = None
+        self._wake_r, self._wake_w = os.pipe()
+        for fd in (self._wake_r, self._wake_w):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self.add_reader(self._wake_r, self._drain_wake)
+
+    def _update(self, fd):
+        if self._poll is None:
+            return
+        mask = (POLL_READ if fd in self._readers else 0) | \
+            (POLL_WRITE if fd in self._writers else 0)
+        if mask:
+            self._poll.register(fd, mask)
+        else:
+            try:
+                self._poll.unregister(fd)
+            except KeyError:
+                pass
+
+    def add_reader(self, fd, callback):
+        """Calls the callback whenever the descriptor is readable."""
+        self._readers[fd] = callback
+        self._update(fd)
+
+    def remove_reader(self, fd):
+        if self._readers.pop(fd, None):
+            self._update(fd)
+
+    def add_writer(self, fd, callback):
+        """Calls the callback whenever the descriptor is writable."""
+        self._writers[fd] = callback
+        self._update(fd)
+
+    def remove_writer(self, fd):
+        if self._writers.pop(fd, None):
+            self._update(fd)
+
+    def call_later(self, delay, callback, *args):
+        """Calls the callback after delay seconds. Returns the timer which
+        can be cancelled."""
+        timer = Timer(time.time() + delay, callback, args)
+        with self._lock:
+            heapq.heappush(self._timers, (timer.when, self._timer_seq.next(), timer))
+        if not self.in_loop():
+            self._wake()
+        return timer
+
+    def call_soon(self, callback, *args):
+        """Calls the callback in the next iteration of the loop. Can be
+        called from any thread."""
+        with self._lock:
+            self._soon.append((callback, args))
+        if not self.in_loop():
+            self._wake()
+
+    def in_loop(self):
+        """Returns True if called from the thread running the loop."""
+        return self._thread is threading.current_thread()
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, '.')
+        except OSError:
+            pass
+
+    def _drain_wake(self):
+        try:
+            os.read(self._wake_r, 4096)
+        except OSError:
+            pass
+
+    def _wait(self, timeout):
+        """Returns (handlers, descriptor) pairs of descriptors ready within
+        timeout seconds."""
+        ready = []
+        try:
+            if self._poll is not None:
+                if timeout is not None:
+                    timeout = int(timeout * 1000 + 1)
+                for fd, mask in self._poll.poll(timeout):
+                    if mask & POLL_READ:
+                        ready.append((self._readers, fd))
+                    if mask & POLL_WRITE:
+                        ready.append((self._writers, fd))
+            else:
+                readable, writable, _ = select.select(
+                    self._readers.keys(), self._writers.keys(), [], timeout)
+                ready = [(self._readers, fd) for fd in readable] + \
+                    [(self._writers, fd) for fd in writable]
+        except (select.error, OSError), e:
+            if e.args[0] != errno.EINTR:
+                raise
+        return ready
+
+    def run(self):
+        """Runs the loop until `stop' is called."""
+        self._thread = threading.current_thread()
+        self._running = True
+        while self._running:
+            with self._lock:
+                soon = self._soon
+                self._soon = collections.deque()
+            for callback, args in soon:
+                self._call(callback, args)
+
+            timeout = None
+            with self._lock:
+                if self._soon:
+                    timeout = 0
+                elif self._timers:
+                    timeout = max(0, self._timers[0][0] - time.time())
+            for handlers, fd in self._wait(timeout):
+                # Handlers may be removed by callbacks called before
+                callback = handlers.get(fd)
+                if callback:
+                    self._call(callback, ())
+
+            expired = []
+            with self._lock:
+                now = time.time()
+                while self._timers and self._timers[0][0] <= now:
+                    expired.append(heapq.heappop(self._timers)[2])
+            for timer in expired:
+                if not timer.cancelled:
+                    self._call(timer.callback, timer.args)
+
+    def run_until(self, condition, deadline, interval=0.05):
+        """Runs the loop until the condition returns True or the deadline
+        passes. The condition is checked every interval seconds."""
+        def check():
+            if condition() or time.time() >= deadline:
+                self.stop()
+            else:
+                self.call_later(interval, check)
+        self.call_soon(check)
+        self.run()
+
+    def _call(self, callback, args):
+        try:
+            callback(*args)
+        except Exception, e:
+            log.error("Caught unknown error %s in event loop", e, exc_info=True)
+
+    def stop(self):
+        self._running = False
+        self._wake()
+
+
+def start_timer(delay, callback):
+    """Calls the callback after delay seconds in the event loop if the agent
+    runs one, in a separate thread otherwise. Returns the timer."""
+    if current:
+        return current.call_later(delay, callback)
+    timer = threading.Timer(delay, callback, ())
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+def stop_timer(timer):
+    """Cancels the timer returned by `start_timer'. Waits for the callback to
+    finish if it runs in a separate thread, so that no timer thread outlives
+    the agent."""
+    timer.cancel()
+    if isinstance(timer, threading.Thread) and timer is not threading.current_thread():
+        timer.join()
@@ -10,6 +10,20 @@ __all__ = ['FormatPlain', 'FormatSyslog']
 import datetime
 import socket
 
+
+def _prefix_lines(block, prefix):
+    """Prepends each non-empty line of the block with the prefix given. The
+    result is newline terminated, empty string for blocks with no lines."""
+    if '\n\n' in block or block.startswith('\n'):
+        # Drop empty lines
+        block = '\n'.join(filter(None, block.split('\n')))
+    if not block:
+        return ''
+    if block.endswith('\n'):
+        return prefix + block.replace('\n', '\n' + prefix, block.count('\n') - 1)
+    return prefix + block.replace('\n', '\n' + prefix) + '\n'
+
+
 class FormatPlain(object):
 
     """Formats lines as plain text, prepends each line with token."""
@@ -18,10 +32,7 @@ class FormatPlain(object):
         self._token = token
 
     def format_line(self, line):
-        lines = []
-        for l in filter(None, line.split("\n")):
-            lines.append(self._token + l)
-        return (''.join(x+"\n" for x in lines))
+        return _prefix_lines(line, self._token)
 
 
 class FormatSyslog(object):
@@ -40,12 +51,10 @@ class FormatSyslog(object):
     def format_line(self, line, msgid='-', token=''):
         if not token:
             token = self._token
-        lines = []
-        for l in filter(None, line.split("\n")):
-            lines.append(
-                '{token}<14>1 {dt}Z {hostname} {appname} - {msgid} - hostname={hostname} appname={appname} {line}'.format(
-                    token=token, dt=datetime.datetime.utcnow().isoformat('T'),
-                    hostname=self._hostname, appname=self._appname,
-                    msgid=msgid, line=l)
-            )
-        return (''.join(x+"\n" for x in lines))
+        if line.count('\n') == len(line):
+            return ''
+        # Lines of a block share the header
+        header = '{token}<14>1 {dt}Z {hostname} {appname} - {msgid} - hostname={hostname} appname={appname} '.format(
+            token=token, dt=datetime.datetime.utcnow().isoformat('T'),
+            hostname=self._hostname, appname=self._appname, msgid=msgid)
+        return _prefix_lines(line, header)
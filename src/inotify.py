@@ -0,0 +1,199 @@
+# coding: utf-8
+# vim: set ts=4 sw=4 et:
+
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+
+__author__ = 'Logentries'
+
+__all__ = ['Watcher', 'WatchError', 'create_watcher',
+           'IN_MODIFY', 'IN_ATTRIB', 'IN_MOVED_FROM', 'IN_MOVED_TO',
+           'IN_CREATE', 'IN_DELETE', 'IN_DELETE_SELF', 'IN_MOVE_SELF',
+           'IN_IGNORED', 'FILE_EVENTS', 'DIR_EVENTS']
+
+# Try to get access to libc, inotify is available on Linux only
+try:
+    import ctypes
+    import ctypes.util
+    ctypes_available = True
+except ImportError:
+    ctypes_available = False
+
+# Event masks, see inotify(7)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_MASK_ADD = 0x20000000
+
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+# Events we are interested in for followed files
+FILE_EVENTS = IN_MODIFY | IN_ATTRIB | IN_MOVE_SELF | IN_DELETE_SELF
+# Events we are interested in for directories of followed files
+DIR_EVENTS = IN_CREATE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE
+
+# struct inotify_event without the trailing name
+EVENT_HEADER = struct.Struct('iIII')
+
+# Time in seconds between checks of the shutdown flag
+SELECT_TIMEOUT = 1
+
+
+class WatchError(Exception):
+
+    """Raised when inotify is not available or a watch cannot be set."""
+    pass
+
+
+class Watcher(object):
+
+    """Watches files and directories with Linux inotify. All watches share
+    a single inotify descriptor serviced by one background thread which
+    dispatches events to registered callbacks. Callbacks are called with the
+    event mask and the name of the affected entry (empty for files). If
+    threaded is not set, the owner calls `read_events' when the descriptor
+    is readable instead."""
+
+    def __init__(self, threaded=True):
+        if not ctypes_available or not sys.platform.startswith('linux'):
+            raise WatchError('inotify is not supported on this platform')
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                                     use_errno=True)
+            self._add_watch = self._libc.inotify_add_watch
+            self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+            self._rm_watch = self._libc.inotify_rm_watch
+            self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        except (OSError, AttributeError), e:
+            raise WatchError('inotify is not available: %s' % e)
+
+        try:
+            fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except AttributeError:
+            fd = self._libc.inotify_init()
+        if fd < 0:
+            raise WatchError('Cannot initialize inotify: %s' %
+                             os.strerror(ctypes.get_errno()))
+        self._fd = fd
+
+        self._lock = threading.Lock()
+        # Watch descriptor -> list of [mask, callback]
+        self._watches = {}
+        self._shutdown = False
+        self._worker = None
+        if threaded:
+            self._worker = threading.Thread(target=self.run, name='inotify')
+            self._worker.daemon = True
+            self._worker.start()
+
+    def add(self, path, mask, callback):
+        """Registers the callback for events of the path given. Returns a
+        handle for `remove'. Raises WatchError if the watch cannot be set."""
+        if isinstance(path, unicode):
+            path = path.encode(sys.getfilesystemencoding() or 'utf-8')
+        with self._lock:
+            wd = self._add_watch(self._fd, path, mask | IN_MASK_ADD)
+            if wd < 0:
+                raise WatchError('Cannot watch %s: %s' %
+                                 (path, os.strerror(ctypes.get_errno())))
+            entry = [mask, callback]
+            self._watches.setdefault(wd, []).append(entry)
+            return (wd, entry)
+
+    def remove(self, handle):
+        """Unregisters the callback registered by `add'."""
+        wd, entry = handle
+        with self._lock:
+            entries = self._watches.get(wd, [])
+            for index, item in enumerate(entries):
+                if item is entry:
+                    del entries[index]
+                    break
+            else:
+                # Already dropped by the kernel
+                return
+            if not entries:
+                del self._watches[wd]
+                self._rm_watch(self._fd, wd)
+
+    def fileno(self):
+        return self._fd
+
+    def close(self):
+        self._shutdown = True
+        if self._worker:
+            self._worker.join(SELECT_TIMEOUT + 0.5)
+        try:
+            os.close(self._fd)
+        except OSError:
+            pass
+
+    def _dispatch(self, buff):
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(buff):
+            wd, mask, _, name_len = EVENT_HEADER.unpack_from(buff, offset)
+            offset += EVENT_HEADER.size
+            name = buff[offset:offset + name_len].rstrip('\0')
+            offset += name_len
+
+            with self._lock:
+                if mask & IN_Q_OVERFLOW:
+                    # Events have been lost, notify everybody
+                    entries = [entry for item in self._watches.values()
+                               for entry in item]
+                else:
+                    entries = list(self._watches.get(wd, []))
+                if mask & IN_IGNORED:
+                    # The kernel dropped the watch (file deleted or unmounted)
+                    self._watches.pop(wd, None)
+            for entry_mask, callback in entries:
+                if mask & (entry_mask | IN_IGNORED | IN_Q_OVERFLOW):
+                    callback(mask, name)
+
+    def read_events(self):
+        """Reads pending events and dispatches them to callbacks."""
+        try:
+            buff = os.read(self._fd, 65536)
+        except OSError, e:
+            if e.args[0] in (errno.EINTR, errno.EAGAIN):
+                return
+            raise
+        self._dispatch(buff)
+
+    def run(self):
+        """Collects inotify events and dispatches them to callbacks."""
+        while not self._shutdown:
+            try:
+                ready = select.select([self._fd], [], [], SELECT_TIMEOUT)[0]
+                if not ready:
+                    continue
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            self.read_events()
+
+
+def create_watcher(loop=None):
+    """Returns an inotify watcher or None if inotify is not available. Callers
+    fall back to polling in that case. If the event loop is given, events
+    are read by the loop."""
+    try:
+        watcher = Watcher(loop is None)
+    except WatchError:
+        return None
+    if loop:
+        loop.add_reader(watcher.fileno(), watcher.read_events)
+    return watcher
@@ -42,12 +42,38 @@ SUPPRESS_SSL_PARAM = 'suppress_ssl'
 USE_CA_PROVIDED_PARAM = 'use_ca_provided'
 FORCE_DOMAIN_PARAM = 'force_domain'
 DATAHUB_PARAM = 'datahub'
+DATAHUB_COMPRESSION_PARAM = 'datahub-compression'
 SYSSTAT_TOKEN_PARAM = 'system-stat-token'
 HOSTNAME_PARAM = 'hostname'
 TOKEN_PARAM = 'token'
 PATH_PARAM = 'path'
 DESTINATION_PARAM = 'destination'
 PULL_SERVER_SIDE_CONFIG_PARAM = 'pull-server-side-config'
+FOLLOWER_THREADS_PARAM = 'follower-threads'
+MAX_CATCH_UP_PARAM = 'max-catch-up'
+SEND_MAX_BYTES_PARAM = 'send-max-bytes'
+SEND_MAX_LINGER_PARAM = 'send-max-linger'
+SPOOL_SIZE_PARAM = 'spool-size'
+QUEUE_SIZE_PARAM = 'queue-size'
+QUEUE_OVERFLOW_PARAM = 'queue-overflow'
+MEMORY_BUDGET_PARAM = 'memory-budget'
+POOL_WORKERS_PARAM = 'pool-workers'
+POOL_CONNECTIONS_PARAM = 'pool-connections'
+DATA_CONNECTIONS_PARAM = 'data-connections'
+RUNTIME_PARAM = 'runtime'
+BACKFILL_PARAM = 'backfill'
+MULTILINE_PARAM = 'multiline'
+MULTILINE_TIMEOUT_PARAM = 'multiline-timeout'
+PRIORITY_PARAM = 'priority'
+SHARE_PARAM = 'share'
+RATE_LIMIT_LINES_PARAM = 'rate-limit-lines'
+RATE_LIMIT_BYTES_PARAM = 'rate-limit-bytes'
+RATE_LIMIT_MODE_PARAM = 'rate-limit-mode'
+SHUTDOWN_TIMEOUT_PARAM = 'shutdown-timeout'
+PARTIAL_LINE_TIMEOUT_PARAM = 'partial-line-timeout'
+LONG_LINES_PARAM = 'long-lines'
+MAX_OPEN_FILES_PARAM = 'max-open-files'
+IDLE_FILE_TIMEOUT_PARAM = 'idle-file-timeout'
 KEY_LEN = 36
 ACCOUNT_KEYS_API = '/agent/account-keys/'
 ID_LOGS_API = '/agent/id-logs/'
@@ -56,8 +82,50 @@ PROXY_TYPE_PARAM = "proxy-type"
 PROXY_URL_PARAM = "proxy-url"
 PROXY_PORT_PARAM = "proxy-port"
 
-# Maximal queue size for events sent
-SEND_QUEUE_SIZE = 32000
+# Maximal size in bytes of events queued by a transport
+SEND_QUEUE_SIZE = 16 * 1024 * 1024
+# Maximal size in bytes of events queued by all transports together
+MEMORY_BUDGET = 64 * 1024 * 1024
+# Time in seconds between reports of events dropped by a transport
+QUEUE_DROP_REPORT_INTERVAL = 10  # Seconds
+
+# Number of connections of the default transport, logs are spread over them
+DATA_CONNECTIONS = 1
+
+# Number of threads sending events of logs identified by key
+POOL_WORKERS = 2
+# Maximal number of connections open for logs identified by key
+POOL_CONNECTIONS = 16
+# Minimal time a log keeps its pooled connection before another log can take it
+POOL_CONNECTION_HOLD = 2  # Seconds
+
+# How the agent runs its tasks: each in its own thread or all in a single
+# event loop
+RUNTIME_THREADS = 'threads'
+RUNTIME_EVENT_LOOP = 'event-loop'
+RUNTIMES = [RUNTIME_THREADS, RUNTIME_EVENT_LOOP]
+
+# Number of batches an event loop transport writes before others get a turn
+ASYNC_MAX_BATCHES = 16
+
+# Time in seconds the agent sends events queued before it exits
+SHUTDOWN_TIMEOUT = 10  # Seconds
+# Time in seconds between checks whether all events queued have been sent
+SHUTDOWN_POLL = 0.05  # Seconds
+
+# Maximal number of bytes of queued entries coalesced into one write
+SEND_MAX_BYTES = 256 * 1024
+# Time in seconds the transport waits for more entries before it writes
+# a batch smaller than SEND_MAX_BYTES
+SEND_MAX_LINGER = 0  # Seconds
+# Time in seconds after which a connection without writes is checked for
+# having been closed by the remote side before the next write
+SEND_IDLE_CHECK = 1  # Seconds
+
+# Name of the directory with spools of transports, stored in the cache directory
+SPOOL_NAME = 'spool'
+# Maximal size of a spool segment file
+SPOOL_SEGMENT_SIZE = 16 * 1024 * 1024
 
 # Logentries server details
 LE_SERVER_API = '/'
@@ -91,6 +159,18 @@ LOG_ROOT = '/var/log'
 SRV_RECON_TIMEOUT = 10  # in seconds
 SRV_RECON_TO_MIN = 1   # in seconds
 SRV_RECON_TO_MAX = 10  # in seconds
+# Time in seconds resolved addresses of endpoints are used before they are
+# resolved again
+DNS_CACHE_TTL = 300  # Seconds
+# Compression of the data stream sent to the data hub
+COMPRESSION_NONE = 'none'
+COMPRESSION_DEFLATE = 'deflate'
+COMPRESSIONS = [COMPRESSION_NONE, COMPRESSION_DEFLATE]
+# zlib compression level of the data stream
+COMPRESSION_LEVEL = 6
+
+# Ciphers of data connections
+SSL_CIPHERS = "HIGH:-aNULL:-eNULL:-PSK:RC4-SHA:RC4-MD5"
 
 # Timeout after invalid server response. Might be a version mishmash or
 # temporary server/network failure
@@ -105,19 +185,113 @@ MAX_LINES_SENT = 10
 # Time in seconds spend between log re-checks
 TAIL_RECHECK = 0.2  # Seconds
 
-# Number of attemps to read a file, until the name is recheck
-NAME_CHECK = 4  # TAIL_RECHECK cycles
+# Time in seconds between checks of the name of files which are not watched
+NAME_CHECK = 4 * TAIL_RECHECK  # Seconds
 
-# Number of read line false attemps between are-you-alive packets
-IAA_INTERVAL = 100
+# Longest time in seconds between re-checks of idle files which are not
+# watched; re-checks back off from TAIL_RECHECK while there is nothing to read
+IDLE_RECHECK = 1  # Seconds
+
+# Time in seconds between safety re-checks of files followed via inotify,
+# they catch modifications which have not been reported
+WATCH_RECHECK = 5  # Seconds
+
+# Number of threads servicing all followers
+FOLLOWER_THREADS = 1
+
+# Number of blocks read from a file before other files get their turn
+MAX_BLOCKS_SERVICED = 16
+
+# Time in seconds after which files nothing has been read from are closed,
+# they are reopened once they change
+IDLE_FILE_TIMEOUT = 300  # Seconds
+
+# Files this many bytes behind are read in longer turns until they catch up
+CATCH_UP_LAG = 1024 * 1024
+# Number of blocks read from such files before other files get their turn
+CATCH_UP_BLOCKS_SERVICED = 64
+
+# Time in seconds a rotated file is followed while its replacement is empty,
+# writers may still append to the rotated file until they reopen their logs
+ROTATION_GRACE = 5  # Seconds
+
+# Number of bytes from the beginning of a file used to detect truncation
+FINGERPRINT_SIZE = 256
+
+# Time in seconds entries of directories which cannot be watched are cached
+INDEX_TTL = 1  # Seconds
+
+# Time in seconds between scans for new files matching a glob pattern
+GLOB_RECHECK = 5  # Seconds
+# The same if the directory is watched via inotify
+GLOB_WATCH_RECHECK = 60  # Seconds
+
+# Time in seconds between are-you-alive checks of idle files, whether they
+# are watched or polled: the name is checked for rotation and the file for
+# truncation even if no change has been reported
+IAA_INTERVAL = 20  # Seconds
 IAA_TOKEN = "###LE-IAA###\n"
 
 # Maximal size of a block of events
 MAX_EVENTS = 65536
 
+# Time in seconds after which the last line of a file is sent even though it
+# does not end by newline, if nothing is appended to it
+PARTIAL_LINE_TIMEOUT = 1  # Seconds
+
+# What happens with lines longer than MAX_EVENTS
+LONG_LINES_SPLIT = 'split'
+LONG_LINES_TRUNCATE = 'truncate'
+LONG_LINES = [LONG_LINES_SPLIT, LONG_LINES_TRUNCATE]
+# Marks where a long line has been split or truncated (UTF-8 encoded ellipsis)
+LONG_LINE_MARKER = u'\u2026'.encode('utf-8')
+
 # Interval between attampts to open a file
 REOPEN_INT = 1  # Seconds
 
+# Name of the file with offsets of followed files, stored in the cache directory
+OFFSETS_NAME = 'offsets'
+# Interval between saves of the offsets
+OFFSETS_SAVE_INTERVAL = 2  # Seconds
+# Offsets of files which are gone are forgotten if not updated for this long
+OFFSETS_RETENTION = 24 * 3600  # Seconds
+# Interval between checks for offsets to forget
+OFFSETS_PRUNE_INTERVAL = 60  # Seconds
+# Maximal number of bytes read on restart from the last saved offset
+MAX_CATCH_UP = 16 * 1024 * 1024
+
+# Name of the file with the status of the agent, stored in the cache directory
+STATUS_NAME = 'status'
+# Interval between saves of the status
+STATUS_SAVE_INTERVAL = 10  # Seconds
+
+# Backfill start points: whole files, tails of given size, lines since time
+BACKFILL_START = 'start'
+BACKFILL_TAIL = 'tail'
+BACKFILL_SINCE = 'since'
+# Size of blocks read from files being backfilled
+BACKFILL_BLOCK = 1024 * 1024
+# Number of blocks read in backfill before other files get their turn
+BACKFILL_BLOCKS_SERVICED = 4
+# Size in bytes of entries in the transport queue backfill waits for
+BACKFILL_MAX_QUEUED = 4 * 1024 * 1024
+# Time in seconds backfill waits for the transport to send queued entries
+BACKFILL_WAIT = 0.05  # Seconds
+# Time in seconds between backfill progress reports
+BACKFILL_REPORT_INTERVAL = 10  # Seconds
+
+# Time in seconds after which a multiline event is sent if no line is added
+MULTILINE_TIMEOUT = 1  # Seconds
+
+# Number of characters at the beginning of a line searched for timestamp
+LINE_TIMESTAMP_SIZE = 64
+# Maximal number of words of a timestamp at the beginning of a line
+LINE_TIMESTAMP_WORDS = 6
+# Number of lines at the beginning of a file used to find timestamp format
+LINE_TIMESTAMP_SAMPLES = 16
+# Maximal number of bytes skipped looking for a line with timestamp
+LINE_TIMESTAMP_SCAN = 1024 * 1024
+
 # Linux block devices
 SYS_BLOCK_DEV = '/sys/block/'
 # Linux CPU stat file
@@ -193,6 +367,9 @@ Where parameters are:
                           the format is address:port with port being optional
   --system-stat-token=    set the token for system stats log (beta)
   --pull-server-side-config=False do not use server-side config for following files
+  --backfill=             send existing content of followed files seen for the first time,
+                          either from start, the given size of their tail, e.g. 500M,
+                          or lines since the given time, e.g. 03:00 or "last 2h"
 """
 
 
@@ -218,33 +395,51 @@ except ImportError:
 import string
 import re
 import Queue
-import random
 import ConfigParser
 import fileinput
+import fnmatch
 import getopt
 import glob
+import heapq
+import io
+import itertools
 import logging
 import os
 import os.path
 import platform
+import resource
+import select
+import signal
 import socket
+import stat
 import subprocess
 import traceback
 import sys
 import threading
 import time
 import datetime
+import errno
+import struct
 import urllib
+import zlib
 import httplib
 import getpass
 import atexit
+import collections
 import logging.handlers
 from backports import CertificateError, match_hostname
 from functools import partial
 
+import dnscache
+import eventloop
 import formatters
+import inotify
 import metrics
+import multiline
+import ratelimit
 import socks
+import sendqueue
+import spool
 
 #
 # Start logging
@@ -367,6 +562,71 @@ def uniq(arr):
     return list(set(arr))
 
 
+def parse_size(text):
+    """
+    Parses size in bytes with an optional K, M, or G suffix. Returns None if
+    the text is not a valid size.
+    """
+    m = re.match(r'^\s*(\d+)\s*([kmg]?)b?\s*$', text.lower())
+    if not m:
+        return None
+    return int(m.group(1)) * {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}[m.group(2)]
+
+
+def parse_rate_limit_lines(text):
+    """
+    Parses the limit of lines per second. Returns None if the text is not a
+    positive number.
+    """
+    try:
+        lines = float(text)
+    except ValueError:
+        return None
+    if lines <= 0:
+        return None
+    return lines
+
+
+def parse_count(text):
+    """
+    Parses a count of threads or connections. Returns None if the text is not
+    a whole number of at least one.
+    """
+    try:
+        count = int(text)
+    except ValueError:
+        return None
+    if count < 1:
+        return None
+    return count
+
+
+def parse_backfill(text):
+    """
+    Parses backfill start point, either `start', size of the tail of files to
+    send, or the time since when lines are sent. Returns a pair [kind, value]
+    or None if the text is not valid. Sizes need a unit, a bare number could
+    be a year as well.
+    """
+    text = text.strip()
+    if text.lower() == BACKFILL_START:
+        return [BACKFILL_START, 0]
+    if text.isdigit():
+        return None
+    size = parse_size(text)
+    if size is not None:
+        return [BACKFILL_TAIL, size]
+    if text in ['t', 'today', 'y', 'yesterday']:
+        return [BACKFILL_SINCE, parse_timestamp_range(text)[0]]
+    since = timestamp_range(text)
+    if since != -1:
+        return [BACKFILL_SINCE, int(time.time() * 1000) - since]
+    group = match_timestamp(text, True)
+    if group:
+        return [BACKFILL_SINCE, group[0]]
+    return None
+
+
 def _lock_pid_file_name():
     """
     Returns path to a file for protecting critical section
@@ -677,8 +937,9 @@ def time_patterns(c_cols):
     yield ['%I%p', HOUR, []]
 
 
-def datetime_patterns(c_cols):
-    """Generates combinations of date and time patterns.
+def datetime_patterns(c_cols, extended=False):
+    """Generates combinations of date and time patterns. Extended patterns
+    include the year after the time, as in ctime().
     """
     # Generate dates only
     for date_pattern in date_patterns():
@@ -686,53 +947,123 @@ def datetime_patterns(c_cols):
 
     # Generate combinations
     for t in time_patterns(c_cols):
+        if extended:
+            for mon in ['%b', '%B']:
+                yield ['%%d %s %s %%Y' % (mon, t[0]), t[1], []]
+                yield ['%s %%d %s %%Y' % (mon, t[0]), t[1], []]
         for d in date_patterns():
             yield ['%s %s' % (d[0], t[0]), t[1], d[2]]
             yield ['%s %s' % (t[0], d[0]), t[1], d[2]]
         yield [t[0], t[1], [YEAR, MON, DAY]]
 
 
-def timestamp_patterns(sample):
+def timestamp_patterns(sample, extended=False):
     """Generates all timestamp patterns we can handle. It is constructed by
     generating all possible combinations of date, time, day name and zone. The
     pattern is [day_name? date<->time zone?] plus simple date and time.
+    Extended patterns, used for timestamps of log lines, also match month
+    names without day name and ctime() timestamps.
     """
     # All timestamps variations
     day_name = ''
     if len(sample) > 0:
         if sample[0] in string.ascii_letters:
             day_name = '%a '
+    day_names = [day_name]
+    if extended and day_name:
+        # Month names start with a letter as well
+        day_names.append('')
     c_cols = sample.count(':')
-    for zone in ['', ' %Z', ' %z']:
-        for dt in datetime_patterns(c_cols):
-            yield ['%s%s%s' % (day_name, dt[0], zone), dt[1], dt[2]]
+    for day_name in day_names:
+        for zone in ['', ' %Z', ' %z']:
+            for dt in datetime_patterns(c_cols, extended):
+                yield ['%s%s%s' % (day_name, dt[0], zone), dt[1], dt[2]]
 
 
-def timestamp_group(text):
+def fill_timestamp(start_tuple, filling):
+    """Completes parts of the time tuple given which are missing in the
+    timestamp with today's date. Returns timestamp in milliseconds.
+    """
+    today = datetime.date.today()
+    start_list = list(start_tuple)
+    if YEAR in filling:
+        start_list[0] = today.year
+    if MON in filling:
+        start_list[1] = today.month
+    if DAY in filling:
+        start_list[2] = today.day
+    # Let mktime figure out daylight saving time
+    start_list[8] = -1
+    return int(time.mktime(start_list)) * 1000
+
+
+def match_timestamp(text, extended=False):
     """Returns a tuple [timestamp, range] which corresponds to the date and
-    time given. Exists on parse error.
+    time given. Returns None on parse error. See `timestamp_patterns' for
+    extended patterns.
     """
     timep = re.sub(r' +', ' ', re.sub(r'[-,./]', ' ', text)).strip()
-    start_tuple = None
-    for p in timestamp_patterns(timep):
-        pattern, resolution, filling = p
+    for pattern, resolution, filling in timestamp_patterns(timep, extended):
         try:
-            start_tuple = time.strptime(timep, p[0])
-            break
+            start_tuple = time.strptime(timep, pattern)
         except ValueError:
-            pass
-    if not start_tuple:
+            continue
+        return [fill_timestamp(start_tuple, filling), resolution]
+    return None
+
+
+def timestamp_group(text):
+    """Returns a tuple [timestamp, range] which corresponds to the date and
+    time given. Exists on parse error.
+    """
+    group = match_timestamp(text)
+    if not group:
         die("Error: Date '%s' not recognized" % text)
+    return group
 
-    today = datetime.date.today()
-    # Complete filling
-    if YEAR in filling:
-        start_tuple.rm_year = today.year
-    if MON in filling:
-        start_tuple.rm_month = today.month
-    if DAY in filling:
-        start_tuple.rm_day = today.day
-    return [int(time.mktime(start_tuple)) * 1000, resolution]
+
+def line_timestamp(line, line_format=None):
+    """Parses the timestamp at the beginning of the line given. Returns a pair
+    [timestamp, format] or None if the line does not start with a timestamp.
+    The format can be passed in to parse following lines of the same file
+    much faster.
+    """
+    text = line[:LINE_TIMESTAMP_SIZE].lstrip('[')
+    # ISO 8601 date and time separator and UTC zone
+    text = re.sub(r'(?<=\d)T(?=\d)|(?<=\d)Z\b', ' ', text)
+    words = re.sub(r'[-,./\]]', ' ', text).split()
+
+    if line_format:
+        count, pattern, filling = line_format
+        if len(words) < count:
+            return None
+        try:
+            start_tuple = time.strptime(' '.join(words[:count]), pattern)
+        except ValueError:
+            return None
+        return [fill_timestamp(start_tuple, filling), line_format]
+
+    # Timestamps consist of numbers, times, and names of months, days and
+    # zones. Find the longest prefix which is a timestamp.
+    count = 0
+    for word in words[:LINE_TIMESTAMP_WORDS]:
+        if not re.match(r'^(\d[\d:+]*([ap]m)?|[a-z]{3,9})$', word, re.I):
+            break
+        count += 1
+    for count in xrange(count, 0, -1):
+        timep = ' '.join(words[:count])
+        if not re.search(r'\d', timep):
+            break
+        for pattern, resolution, filling in timestamp_patterns(timep, True):
+            # Directives do not match spaces, skip patterns which cannot match
+            if pattern.count(' ') != count - 1:
+                continue
+            try:
+                start_tuple = time.strptime(timep, pattern)
+            except ValueError:
+                continue
+            return [fill_timestamp(start_tuple, filling), (count, pattern, filling)]
+    return None
 
 
 def timestamp_range(text):
@@ -886,6 +1217,7 @@ class Stats(object):
     """
 
     def __init__(self):
+        self.lock = threading.Lock()
         self.timer = None
         self.to_remove = False
         self.first = True
@@ -1224,10 +1556,11 @@ class Stats(object):
             pass
 
     def schedule(self, next_step):
-        if not self.to_remove:
-            self.timer = threading.Timer(next_step, self.send_stats, ())
-            self.timer.daemon = True
-            self.timer.start()
+        with self.lock:
+            if not self.to_remove:
+                self.timer = threading.Timer(next_step, self.send_stats, ())
+                self.timer.daemon = True
+                self.timer.start()
 
     def start(self):
         self.schedule(1)
@@ -1255,118 +1588,851 @@ class Stats(object):
         self.schedule(next_step)
 
     def cancel(self):
-        self.to_remove = True
-        if self.timer:
-            self.timer.cancel()
+        with self.lock:
+            self.to_remove = True
+            timer = self.timer
+        if timer:
+            eventloop.stop_timer(timer)
 
 
-class Follower(object):
+class IndexedDirectory(object):
 
-    """
-    The follower keeps an eye on the file specified and sends new events to the
-    logentries infrastructure.  """
+    """Cached entries and subscribers of a directory in the index."""
 
-    def __init__(self, name, event_filter, event_formatter, transport):
-        """ Initializes the follower. """
+    def __init__(self, name):
         self.name = name
-        self.flush = True
-        self.event_filter = event_filter
-        self.event_formatter = event_formatter
-        self.transport = transport
+        self.watch = None
+        # Entry name (None for all entries) -> list of callbacks
+        self.subscribers = {}
+        # Entry name -> (device, inode), None for missing entries
+        self.entries = {}
+        # Names of all entries, None if not listed yet
+        self.names = None
+        # Cached entries of directories which are not watched expire
+        self.expires = 0
+        # Incremented on every change, results of stat() and listdir() called
+        # outside the lock are not cached if they might be stale
+        self.generation = 0
+
+
+class DirectoryIndex(object):
+
+    """Shared index of directories containing followed files. Every directory
+    is watched once for all followers. Entries are answered from memory until
+    the watcher reports their change, subscribers are notified of changes of
+    entries they are interested in only. Directories which cannot be watched
+    are re-read at most once per INDEX_TTL seconds."""
+
+    def __init__(self, watcher):
+        self._watcher = watcher
+        self._lock = threading.Lock()
+        # Directory name -> IndexedDirectory
+        self._dirs = {}
+
+    def subscribe(self, dir_name, name, callback):
+        """Registers the callback for changes of the entry given, or of all
+        entries if the name is None. Returns a handle for `unsubscribe'."""
+        with self._lock:
+            directory = self._dirs.get(dir_name)
+            if not directory:
+                directory = IndexedDirectory(dir_name)
+                self._dirs[dir_name] = directory
+            directory.subscribers.setdefault(name, []).append(callback)
+            if not directory.watch and self._watcher:
+                try:
+                    directory.watch = self._watcher.add(
+                        dir_name, inotify.DIR_EVENTS, partial(self._changed, directory))
+                    directory.entries.clear()
+                    directory.names = None
+                    directory.generation += 1
+                except inotify.WatchError, e:
+                    log.debug("%s, polling %s instead", e, dir_name)
+        return (directory, name, callback)
+
+    def unsubscribe(self, handle):
+        """Unregisters the callback registered by `subscribe'. The directory
+        is forgotten when it has no subscribers left."""
+        directory, name, callback = handle
+        with self._lock:
+            callbacks = directory.subscribers.get(name, [])
+            for index, item in enumerate(callbacks):
+                if item is callback:
+                    del callbacks[index]
+                    break
+            if not callbacks:
+                directory.subscribers.pop(name, None)
+            if directory.subscribers or self._dirs.get(directory.name) is not directory:
+                return
+            del self._dirs[directory.name]
+            if directory.watch:
+                self._watcher.remove(directory.watch)
+                directory.watch = None
+
+    def watched(self, dir_name):
+        """Returns True if changes of the directory are reported."""
+        with self._lock:
+            directory = self._dirs.get(dir_name)
+            return bool(directory and directory.watch)
+
+    def _changed(self, directory, mask, name):
+        """Called by the watcher when an entry of the directory changes."""
+        with self._lock:
+            directory.generation += 1
+            if name:
+                directory.entries.pop(name, None)
+                if directory.names is not None:
+                    if mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO):
+                        directory.names.add(name)
+                    else:
+                        directory.names.discard(name)
+                callbacks = directory.subscribers.get(name, []) + \
+                    directory.subscribers.get(None, [])
+            else:
+                # Events have been lost or the directory has gone
+                directory.entries.clear()
+                directory.names = None
+                if mask & inotify.IN_IGNORED:
+                    directory.watch = None
+                callbacks = [callback for item in directory.subscribers.values()
+                             for callback in item]
+        for callback in callbacks:
+            callback(mask, name)
+
+    def _cached(self, directory):
+        """Returns True if cached entries of the directory are valid. Must be
+        called with the lock held."""
+        if directory.watch:
+            return True
+        now = time.time()
+        if now < directory.expires:
+            return True
+        directory.entries.clear()
+        directory.names = None
+        directory.expires = now + INDEX_TTL
+        directory.generation += 1
+        return False
 
-        self._file = None
-        self._shutdown = False
-        self._read_file_rest = ""
-        self._worker = threading.Thread(
-            target=self.monitorlogs, name=self.name)
-        self._worker.daemon = True
-        self._worker.start()
+    def lookup(self, path):
+        """Returns device and inode of the regular file given, None if there
+        is no such file."""
+        dir_name, name = os.path.split(path)
+        with self._lock:
+            directory = self._dirs.get(dir_name)
+            if directory:
+                if self._cached(directory) and name in directory.entries:
+                    return directory.entries[name]
+                generation = directory.generation
 
-    def _file_candidate(self):
-        """
-        Returns list of file names which corresponds to the specified template.
-        """
         try:
-            candidates = glob.glob(self.name)
+            info = os.stat(path)
+            file_id = None
+            if stat.S_ISREG(info.st_mode):
+                file_id = (info.st_dev, info.st_ino)
+        except os.error:
+            file_id = None
+
+        if directory:
+            with self._lock:
+                if directory.generation == generation:
+                    directory.entries[name] = file_id
+        return file_id
+
+    def find(self, dir_name, file_id):
+        """Returns the path of the regular file with the device and inode
+        given in the directory, None if there is no such file. Entries already
+        known are matched from memory, only entries not seen since their last
+        change are examined."""
+        with self._lock:
+            directory = self._dirs.get(dir_name)
+            known = {}
+            if directory and self._cached(directory):
+                known = dict(directory.entries)
+        for name, entry_id in known.iteritems():
+            if entry_id == file_id:
+                path = os.path.join(dir_name, name)
+                if self.lookup(path) == file_id:
+                    return path
+        for name in self.names(dir_name):
+            if name in known:
+                continue
+            path = os.path.join(dir_name, name)
+            if self.lookup(path) == file_id:
+                return path
+        return None
 
-            if len(candidates) == 0:
-                return None
+    def names(self, dir_name):
+        """Returns names of entries of the directory given."""
+        with self._lock:
+            directory = self._dirs.get(dir_name)
+            if directory:
+                if self._cached(directory) and directory.names is not None:
+                    return list(directory.names)
+                generation = directory.generation
 
-            candidate_times = [[os.path.getmtime(name), name]
-                               for name in candidates]
-            candidate_times.sort()
-            candidate_times.reverse()
-            return candidate_times[0][1]
+        try:
+            names = os.listdir(dir_name)
         except os.error:
+            names = []
+
+        if directory:
+            with self._lock:
+                if directory.generation == generation:
+                    directory.names = set(names)
+        return names
+
+
+class OffsetRegistry(object):
+
+    """Keeps offsets of data handed to transports for all followed files,
+    identified by device, inode and path. Offsets are periodically saved so
+    that the agent resumes where it stopped after restart. Offsets of files
+    removed or replaced are dropped once not updated for `retention' seconds."""
+
+    def __init__(self, filename, interval, retention=OFFSETS_RETENTION):
+        self._filename = filename
+        self._interval = interval
+        self._retention = retention
+        self._lock = threading.Lock()
+        # Path -> [device, inode, offset, time of the last update]
+        self._offsets = {}
+        self._dirty = False
+        self._pruned = time.time()
+        self._timer = None
+        self._shutdown = False
+        self._load()
+
+    def _load(self):
+        try:
+            if os.path.exists(self._filename):
+                f = open(self._filename, 'r')
+                content = f.read()
+                f.close()
+                now = time.time()
+                for item in json_loads(content)['offsets']:
+                    self._offsets[item['path']] = [item['dev'], item['ino'], item['offset'],
+                                                   item.get('updated', now)]
+        except (ValueError, KeyError, TypeError):
+            log.warn("Could not read offsets from %s, ignoring", self._filename)
+        except IOError:
+            log.warn("Error while reading offsets from %s, ignoring", self._filename)
+
+    def lookup(self, path, file_id):
+        """Returns the saved offset of the file given. If the path is known but
+        refers to a different file now, the file has been replaced while the
+        agent was not running and 0 is returned. Returns None for unknown
+        paths."""
+        with self._lock:
+            item = self._offsets.get(path)
+        if not item:
             return None
+        if tuple(item[:2]) != file_id:
+            return 0
+        return item[2]
+
+    def update(self, path, file_id, offset):
+        """Records the offset of data handed to the transport."""
+        with self._lock:
+            self._offsets[path] = [file_id[0], file_id[1], offset, time.time()]
+            self._dirty = True
+
+    def prune(self):
+        """Drops offsets of files which have not been updated within the
+        retention period and whose path no longer refers to the same file."""
+        expired = time.time() - self._retention
+        with self._lock:
+            stale = [(path, tuple(item[:2])) for path, item in self._offsets.iteritems()
+                     if item[3] < expired]
+        for path, file_id in stale:
+            try:
+                st = os.stat(path)
+                if (st.st_dev, st.st_ino) == file_id:
+                    continue
+            except OSError:
+                pass
+            with self._lock:
+                item = self._offsets.get(path)
+                if item and item[3] < expired:
+                    del self._offsets[path]
+                    self._dirty = True
 
-    def _open_log(self):
-        """Keeps trying to re-open the log file. Returns when the file has been
-        opened or when requested to remove.  """
-        error_info = True
+    def save(self):
+        """Saves offsets atomically, if changed."""
+        if time.time() - self._pruned >= OFFSETS_PRUNE_INTERVAL:
+            self._pruned = time.time()
+            self.prune()
+        with self._lock:
+            if not self._dirty:
+                return
+            offsets = [{'path': path, 'dev': item[0], 'ino': item[1], 'offset': item[2],
+                        'updated': item[3]}
+                       for path, item in self._offsets.iteritems()]
+            self._dirty = False
+        tmp_filename = self._filename + '.tmp'
+        try:
+            f = open(tmp_filename, 'w')
+            f.write(json_dumps({'offsets': offsets}))
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+            os.rename(tmp_filename, self._filename)
+        except (IOError, OSError), e:
+            log.warning("Cannot save offsets to %s: %s", self._filename, e)
+
+    def _schedule(self):
+        with self._lock:
+            if not self._shutdown:
+                self._timer = eventloop.start_timer(self._interval, self._save_offsets)
+
+    def _save_offsets(self):
+        self.save()
+        self._schedule()
+
+    def start(self):
+        self._schedule()
+
+    def cancel(self):
+        """Stops periodic saves and saves the offsets for the last time."""
+        with self._lock:
+            self._shutdown = True
+            timer = self._timer
+        if timer:
+            eventloop.stop_timer(timer)
+        self.save()
+
+
+class AgentStatus(object):
+
+    """Collects counters of transports and followed files. The status is
+    periodically saved in JSON so that it can be inspected while the agent
+    runs, and is sent as agent metrics if configured."""
+
+    def __init__(self, filename, interval):
+        self._filename = filename
+        self._interval = interval
+        self._started = time.time()
+        self._transports = []
+        self._default_transport = None
+        self._reactor = None
+        self._lock = threading.Lock()
+        self._timer = None
+        self._shutdown = False
+
+    def watch(self, transports, default_transport, reactor):
+        """Sets the transports and the reactor of the followers reported.
+        Transports of the default transport are reported as they are created."""
+        self._transports = list(transports)
+        self._default_transport = default_transport
+        self._reactor = reactor
+
+    def snapshot(self):
+        """Returns the current status, see `Transport.stats' and
+        `Follower.stats'."""
+        files = []
+        open_files = 0
+        if self._reactor:
+            files = self._reactor.stats()
+            open_files = self._reactor.open_files.count()
+        transports = self._transports
+        if self._default_transport:
+            transports = transports + self._default_transport.transports()
+        return {'version': __version__, 'pid': os.getpid(), 'time': time.time(),
+                'uptime': time.time() - self._started,
+                'transports': [transport.stats() for transport in transports],
+                'open_files': open_files,
+                'files': files}
+
+    def save(self):
+        """Saves the status atomically."""
+        tmp_filename = self._filename + '.tmp'
+        try:
+            f = open(tmp_filename, 'w')
+            f.write(json_dumps(self.snapshot()))
+            f.close()
+            os.rename(tmp_filename, self._filename)
+        except (IOError, OSError), e:
+            log.warning("Cannot save status to %s: %s", self._filename, e)
+
+    def _schedule(self):
+        with self._lock:
+            if not self._shutdown:
+                self._timer = eventloop.start_timer(self._interval, self._save_status)
+
+    def _save_status(self):
+        self.save()
+        self._schedule()
+
+    def start(self):
+        if self._filename:
+            self._schedule()
+
+    def cancel(self):
+        """Stops periodic saves and removes the status file."""
+        with self._lock:
+            self._shutdown = True
+            timer = self._timer
+        if timer:
+            eventloop.stop_timer(timer)
+        if self._filename:
+            try:
+                os.remove(self._filename)
+            except OSError:
+                pass
+
+
+def get_max_open_files():
+    """Returns the number of files followers may keep open, by default half
+    of the limit of file descriptors of the process.
+    """
+    if config.max_open_files != NOT_SET:
+        return config.max_open_files
+    limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    if limit == resource.RLIM_INFINITY or limit <= 0:
+        limit = 1024
+    return max(limit / 2, 1)
+
+
+class OpenFiles(object):
+
+    """Keeps the number of files held open by followers within the limit.
+    Followers report use of their files. Once there are more open files than
+    allowed, followers of the least recently used ones are asked to close
+    them; they do so once they have read to the end."""
+
+    def __init__(self, limit):
+        self._limit = limit
+        self._lock = threading.Lock()
+        # Followers with open files, the least recently used first
+        self._followers = collections.OrderedDict()
+        self._closing = 0
+
+    def used(self, follower):
+        """Notes that the follower opened or read its file."""
+        closing = []
+        with self._lock:
+            self._followers.pop(follower, None)
+            self._followers[follower] = True
+            excess = len(self._followers) - self._limit - self._closing
+            if excess > 0:
+                for candidate in self._followers:
+                    if len(closing) == excess:
+                        break
+                    if candidate is not follower and not candidate._evict:
+                        candidate._evict = True
+                        closing.append(candidate)
+                self._closing += len(closing)
+        for candidate in closing:
+            candidate._reactor.notify(candidate, 0)
+
+    def closed(self, follower):
+        """Notes that the follower closed its file."""
+        with self._lock:
+            if self._followers.pop(follower, None) and follower._evict:
+                self._closing -= 1
+            follower._evict = False
+
+    def count(self):
+        """Returns the number of files open."""
+        with self._lock:
+            return len(self._followers)
+
+
+class Follower(object):
+
+    """
+    The follower keeps an eye on the file specified and sends new events to the
+    logentries infrastructure. Followers do not own threads, they are serviced
+    by the reactor whenever their file changes or a re-check is due.  """
+
+    def __init__(self, name, event_filter, event_formatter, transport, reactor,
+                 owner=None, from_start=False, backfill=None, multiline_event=None,
+                 rate_limit=None):
+        """ Initializes the follower and registers it with the reactor. Files
+        matched by a glob pattern have the glob follower as their owner, such
+        followers retire once their file is deleted. New files are followed
+        from start. Backfill is the start point for files seen for the first
+        time as returned by `parse_backfill'. Multiline event is a pair
+        [start pattern, timeout] of the multiline assembler. Rate limit, if
+        given, is the `ratelimit.RateLimit' of lines sent. """
+        self.name = name
+        self.flush = True
+        self.event_filter = event_filter
+        self.event_formatter = event_formatter
+        self.transport = transport
         self.real_name = None
 
-        while not self._shutdown:
-            candidate = self._file_candidate()
+        self._file = None
+        self._file_id = None
+        self._fingerprint = ""
+        self._rotating = False
+        # Read buffer, allocated while the file is being read; the partial
+        # line at its end is kept in place between reads
+        self._buffer = None
+        self._buffer_view = None
+        self._rest_start = 0
+        self._rest_end = 0
+        # Last time the partial line grew, see `_partial_line_delay'
+        self._rest_updated = 0
+        # Set while the rest of a line longer than MAX_EVENTS is being read
+        self._long_line = False
+        self._long_lines = 0
+        # Set once the partial line has been sent, the rest of it is marked
+        # like the rest of a split line
+        self._continues = False
+        # Position of the last block read in the buffer, and bytes added to
+        # it at its beginning and end, see `MultilineAssembler.feed'
+        self._block_start = 0
+        self._block_head = 0
+        self._block_tail = 0
+        self._partial_line_timeout = config.partial_line_timeout
+        if self._partial_line_timeout == NOT_SET:
+            self._partial_line_timeout = PARTIAL_LINE_TIMEOUT
+        self._long_lines_mode = config.long_lines
+        if self._long_lines_mode == NOT_SET:
+            self._long_lines_mode = LONG_LINES_SPLIT
+        self._reactor = reactor
+        self._open_files = reactor.open_files
+        # Position in the file closed while idle, see `_park'
+        self._parked = None
+        self._parked_mtime = None
+        self._evict = False
+        self._active = time.time()
+        self._idle_file_timeout = config.idle_file_timeout
+        if self._idle_file_timeout == NOT_SET:
+            self._idle_file_timeout = IDLE_FILE_TIMEOUT
+        self._watcher = reactor.watcher
+        self._index = reactor.index
+        self._registry = reactor.registry
+        self._file_watch = None
+        self._dir_watch = None
+        self._checked = time.time()
+        self._idle_delay = TAIL_RECHECK
+        self._open_error_reported = False
+        self._owner = owner
+        self._from_start = from_start
+        self._backfill = backfill
+        self._backfilling = False
+        self._backfill_offset = 0
+        self._backfill_size = 0
+        self._backfill_started = 0
+        self._backfill_reported = 0
+        self._line_format = None
+        self._assembler = None
+        if multiline_event:
+            self._assembler = multiline.MultilineAssembler(
+                multiline_event[0], multiline_event[1], MAX_EVENTS)
+        self._rate_limit = rate_limit
+        # Offset of data sent, size of the file and the last time the
+        # follower read to its end, see `stats'
+        self._offset = 0
+        self._size = 0
+        self._caught_up = time.time()
+
+        # Scheduling state, maintained by the reactor
+        self._events = 0
+        self._queued = False
+        self._running = False
+        self._due = None
+        self._closed = False
+
+        reactor.add(self)
 
-            if candidate:
-                self.real_name = candidate
-                try:
-                    self._close_log()
-                    self._file = open(self.real_name)
-                    break
-                except IOError:
-                    pass
+    def _open_log(self):
+        """Tries to (re-)open the log file. Returns True if the file has been
+        opened, the reactor re-tries later otherwise."""
+        self._watch_dir()
 
-            if error_info:
-                log.info("Cannot open file '%s', re-trying in %ss intervals",
-                         self.name, REOPEN_INT)
-                error_info = False
-            time.sleep(REOPEN_TRY_INTERVAL)
+        if self._index.lookup(self.name):
+            try:
+                self._close_log()
+                self._file = io.open(self.name, 'rb', buffering=0)
+                stat = os.fstat(self._file.fileno())
+                self._file_id = (stat.st_dev, stat.st_ino)
+                self._fingerprint = ""
+                self._continues = False
+                self._rotating = False
+                self.real_name = self.name
+                if self._owner:
+                    self._owner.opened(self._file_id)
+                self._watch_log()
+                self._open_error_reported = False
+                self._parked = None
+                self._active = time.time()
+                self._open_files.used(self)
+                return True
+            except IOError:
+                pass
+
+        if not self._open_error_reported:
+            log.info("Cannot open file '%s', re-trying in %ss intervals",
+                     self.name, REOPEN_INT)
+            self._open_error_reported = True
+        return False
 
     def _close_log(self):
+        self._unwatch(self._file_watch)
+        self._file_watch = None
+        self._parked = None
         if self._file:
             try:
                 self._file.close()
             except IOError:
                 pass
             self._file = None
+            self._open_files.closed(self)
 
-    def _log_rename(self):
-        """Detects file rename."""
-
-        # Get file candidates
-        candidate = self._file_candidate()
-        if not candidate:
+    def _idle(self):
+        """Returns True if the file should be closed until it changes: it has
+        been read to the end, nothing is held back and nothing has been read
+        for a while or the number of open files is over the limit."""
+        if self._rotating or self._backfilling or self._rest_start != self._rest_end:
             return False
-
+        if self._assembler and self._assembler.pending_size():
+            return False
+        return self._evict or (self._idle_file_timeout and
+                               time.time() - self._active >= self._idle_file_timeout)
+
+    def _park(self):
+        """Closes the idle file, keeps its identity, position and watch so
+        that it can be reopened once it changes. The beginning of the file is
+        kept as well to detect truncation meanwhile."""
+        stat = os.fstat(self._file.fileno())
+        if self._truncated(stat.st_size):
+            # Recovered by the next check of the file
+            return
+        self._checkpoint()
+        self._release_buffer()
+        self._parked = self._get_file_position()
+        self._parked_mtime = stat.st_mtime
         try:
-            ctime1 = os.fstat(self._file.fileno()).st_mtime
-            ctime_new = os.path.getmtime(candidate)
-            ctime2 = os.fstat(self._file.fileno()).st_mtime
-        except os.error:
+            self._file.close()
+        except IOError:
             pass
+        self._file = None
+        self._open_files.closed(self)
 
-        if ctime1 == ctime2 and ctime1 != ctime_new:
-            # We have a name change according to the time
+    def _changed(self):
+        """Returns True if the closed file may have changed: it has been
+        modified or the name refers to a different file now."""
+        try:
+            stat = os.stat(self.name)
+        except os.error:
             return True
+        return (stat.st_dev, stat.st_ino) != self._file_id or \
+            stat.st_size != self._parked or stat.st_mtime != self._parked_mtime
+
+    def _find_renamed(self):
+        """Returns the name of the closed file if it has been renamed within
+        its directory, None if it cannot be found."""
+        return self._index.find(os.path.dirname(self.name), self._file_id)
+
+    def _unpark(self):
+        """Reopens the file closed while idle and continues where it stopped.
+        A file renamed by rotation meanwhile is read to the end before the
+        follower switches to the new one. Returns False if the file cannot be
+        found."""
+        position = self._parked
+        self._parked = None
+        name = self.name
+        if self._index.lookup(name) != self._file_id:
+            name = self._find_renamed()
+            if not name:
+                return False
+            self._rotating = True
+        try:
+            self._file = io.open(name, 'rb', buffering=0)
+            stat = os.fstat(self._file.fileno())
+        except (IOError, OSError):
+            self._file = None
+            return False
+        if (stat.st_dev, stat.st_ino) != self._file_id:
+            self._file.close()
+            self._file = None
+            return False
+        self._active = time.time()
+        self._open_files.used(self)
+        self._set_file_position(position)
+        if self._truncated(stat.st_size):
+            # Follow the file from its new beginning
+            self._set_file_position(0)
+            self._fingerprint = ""
+            self._continues = False
+            self._checkpoint()
+        return True
 
+    def _wake(self, mask, name):
+        """Called by the watcher when the file or its directory entry
+        changes."""
+        self._reactor.notify(self, mask)
+
+    def _unwatch(self, handle):
+        if handle:
+            self._watcher.remove(handle)
+
+    def _watch_dir(self):
+        """Subscribes for changes of the directory entry of the file. It
+        detects rotations and creation of the file."""
+        if not self._dir_watch:
+            self._dir_watch = self._index.subscribe(
+                os.path.dirname(self.name), os.path.basename(self.name), self._wake)
+
+    def _watch_log(self):
+        """Registers inotify watch for the file opened. If it cannot be set
+        the follower falls back to polling."""
+        if not self._watcher:
+            return
+        try:
+            self._file_watch = self._watcher.add(
+                self.real_name, inotify.FILE_EVENTS, self._wake)
+        except inotify.WatchError, e:
+            log.debug("%s, polling %s instead", e, self.name)
+
+    def _is_watched(self):
+        return self._file_watch is not None and \
+            self._index.watched(os.path.dirname(self.name))
+
+    def _rotated_candidate(self, stat):
+        """Detects rename-style rotation. Returns the name of the file which
+        replaced the followed one, None if the file has not been rotated or
+        if the follower should stay with the rotated file for a while."""
+        file_id = self._index.lookup(self.name)
+        if not file_id:
+            return None
+        if file_id == self._file_id:
+            self._rotating = False
+            return None
+
+        # Writers keep appending to the rotated file until they reopen their
+        # logs, switch once they write to the new file or become quiet
+        self._rotating = True
+        if time.time() - stat.st_mtime < ROTATION_GRACE:
+            try:
+                if os.stat(self.name).st_size == 0:
+                    return None
+            except os.error:
+                return None
+        return self.name
+
+    def _read_head(self, size):
+        """Returns the first bytes of the file, keeps the file position."""
+        position = self._get_file_position()
+        try:
+            self._set_file_position(0)
+            return self._file.read(size)
+        finally:
+            self._set_file_position(position)
+
+    def _truncated(self, size):
+        """Detects copytruncate-style rotation. The file is truncated if it
+        is shorter than the part we have read, or if its beginning differs
+        from what we have seen as it has been written again since."""
+        position = self._get_file_position()
+        if size < position:
+            return True
+        if position == 0:
+            return False
+        head = self._read_head(min(position, FINGERPRINT_SIZE))
+        if not head.startswith(self._fingerprint):
+            return True
+        self._fingerprint = head
         return False
 
     def _read_log_line(self):
-        """ Reads a line from the log. Checks maximal line size. """
-        buff = self._file.read(MAX_EVENTS - len(self._read_file_rest))
-        buff_list = buff.split("\n")
-        if len(buff_list) == 1: # in case there is no "\n" in the buff.
-            tmp_read_file_rest = self._read_file_rest
-            self._read_file_rest = ""
-            return (tmp_read_file_rest + buff)
-        else:
-            tmp_read_file_rest = buff_list[-1]
-            # drop the last line if it is not ending by \n. prepend the previous _read_file_rest
-            ret = self._read_file_rest + (''.join(x+'\n' for x in buff_list[:-1]));
-            self._read_file_rest = tmp_read_file_rest;
-            return ret
+        """ Reads a block of lines from the log. Checks maximal line size.
+        Data is read into the reusable buffer after the partial line left by
+        the previous read, so every byte is copied once into the block
+        returned. Returns an empty string if there is no complete line. """
+        if not self._buffer:
+            self._buffer = bytearray(2 * MAX_EVENTS)
+            self._buffer_view = memoryview(self._buffer)
+        while True:
+            rest = self._rest_end - self._rest_start
+            if self._rest_end + MAX_EVENTS - rest > len(self._buffer):
+                # Move the partial line to the beginning of the buffer
+                self._buffer[:rest] = self._buffer[self._rest_start:self._rest_end]
+                self._rest_start, self._rest_end = 0, rest
+            start = self._rest_start
+            read_start = self._rest_end
+            end = read_start + self._file.readinto(
+                self._buffer_view[read_start:start + MAX_EVENTS])
+            if end > read_start:
+                self._rest_updated = time.time()
+            # Keep the last line for the next read if it is not ending by \n.
+            # Lines kept back by the rate limit precede the partial line.
+            nl = self._buffer.rfind('\n', start, end)
+            if nl != -1:
+                self._rest_start, self._rest_end = nl + 1, end
+                if self._long_line and self._long_lines_mode == LONG_LINES_TRUNCATE:
+                    # Skip the rest of the truncated line
+                    start = self._buffer.find('\n', start, end) + 1
+                    self._long_line = False
+                    if start == nl + 1:
+                        continue
+                self._block_start = start
+                return self._continued(self._buffer_view[start:nl + 1].tobytes())
+            self._rest_start, self._rest_end = start, end
+            if end - start < MAX_EVENTS:
+                if self._long_line and self._long_lines_mode == LONG_LINES_TRUNCATE:
+                    self._rest_start = self._rest_end = 0
+                    if end > read_start:
+                        continue
+                return ''
+            # The line does not fit into a block
+            self._rest_start = self._rest_end = end
+            self._block_start = start
+            if not self._long_line:
+                self._long_lines += 1
+                if self._long_lines == 1:
+                    log.warning("Lines of %s longer than %d bytes are %s", self.real_name,
+                                MAX_EVENTS, self._long_lines_mode == LONG_LINES_SPLIT and 'split' or 'truncated')
+            elif self._long_lines_mode == LONG_LINES_TRUNCATE:
+                continue
+            block = self._continued(self._buffer_view[start:end].tobytes())
+            self._long_line = True
+            self._block_tail = len(LONG_LINE_MARKER) + 1
+            return block + LONG_LINE_MARKER + '\n'
+
+    def _continued(self, block):
+        """Marks the rest of a split or partially sent line at the beginning
+        of the block."""
+        self._block_tail = 0
+        if self._long_line or self._continues:
+            self._long_line = False
+            self._continues = False
+            self._block_head = len(LONG_LINE_MARKER)
+            return LONG_LINE_MARKER + block
+        self._block_head = 0
+        return block
+
+    def _unread(self, end):
+        """Gives back the last block read from `end' on, so that it is read
+        again. The end is in bytes of the block, which may begin with the
+        marker of a continued line not present in the file."""
+        if end > self._block_head:
+            self._rest_start = self._block_start + end - self._block_head
+            self._long_line = False
+            return
+        # Nothing of the block is sent, it is read and marked again as it was
+        self._rest_start = self._block_start
+        if self._block_tail and not self._block_head:
+            # Counted again once split again
+            self._long_lines -= 1
+        self._long_line = False
+        self._continues = self._block_head > 0
+
+    def _partial_line_delay(self):
+        """Returns time in seconds after which the partial line at the end
+        of the file should be sent, None if there is no such line."""
+        if self._rest_start == self._rest_end or \
+                self._buffer.find('\n', self._rest_start, self._rest_end) != -1:
+            return None
+        return max(0, self._rest_updated + self._partial_line_timeout - time.time())
+
+    def _release_buffer(self):
+        """Drops the read buffer unless it holds a partial line."""
+        if self._rest_start == self._rest_end:
+            self._buffer = None
+            self._buffer_view = None
+            self._rest_start = self._rest_end = 0
 
     def _set_file_position(self, offset, start=FILE_BEGIN):
         """ Move the position of filepointers."""
@@ -1377,57 +2443,308 @@ class Follower(object):
         pos = self._file.tell()
         return pos
 
-    def _get_line(self):
-        """
-        Returns a block of newly detected line from the log. Returns None in case of timeout.
-        """
-        # Moves at the end of the log file
-        if self.flush:
-            self._set_file_position(0, FILE_END)
-            self.flush = False
-
-        # TODO: investigate select-like approach?
-        idle_cnt = 0
-        iaa_cnt = 0
-        line = None
-        while iaa_cnt != IAA_INTERVAL and not self._shutdown:
-            # Collect line
-            line = self._read_log_line()
-            if len(line) != 0:
+    def _line_start(self, offset):
+        """Returns offset of the first line which starts at or after the
+        offset given."""
+        if offset == 0:
+            return 0
+        self._set_file_position(offset - 1)
+        nl = self._file.read(MAX_EVENTS).find('\n')
+        if nl != -1:
+            return offset + nl
+        return offset
+
+    def _initial_position(self):
+        """Returns the position the file is followed from. It is the offset
+        saved in the previous run, or the backfill start point or the end of
+        the file for files seen for the first time."""
+        size = os.fstat(self._file.fileno()).st_size
+        offset = None
+        if self._registry:
+            offset = self._registry.lookup(self.real_name, self._file_id)
+        if offset is None:
+            if self._backfill:
+                offset = self._backfill_start(size)
+            elif not self._from_start:
+                return size
+            else:
+                offset = 0
+        if offset > size:
+            # Truncated while we were not running
+            offset = 0
+
+        if self._backfill:
+            # Backfill (possibly resumed) is not limited
+            if offset < size:
+                self._start_backfill(offset, size)
+            return offset
+
+        max_catch_up = config.max_catch_up
+        if max_catch_up == NOT_SET:
+            max_catch_up = MAX_CATCH_UP
+        if size - offset <= max_catch_up:
+            return offset
+
+        # Skip to the first line boundary within the catch-up limit
+        start = self._line_start(size - max_catch_up)
+        log.warning("Skipping %d bytes of %s, more than %d bytes to catch up",
+                    start - offset, self.real_name, max_catch_up)
+        return start
+
+    def _backfill_start(self, size):
+        """Returns offset of the first line to backfill."""
+        kind, value = self._backfill
+        if kind == BACKFILL_TAIL:
+            return self._line_start(max(0, size - value))
+        if kind == BACKFILL_SINCE:
+            return self._seek_time(value, size)
+        return 0
+
+    def _stamped_line(self, offset, end):
+        """Returns a pair [offset, timestamp] of the first line with timestamp
+        which starts at or after the offset given and before the end. Returns
+        [None, None] if there is no such line nearby."""
+        start = self._line_start(offset)
+        continued = False
+        while start < end and start - offset <= LINE_TIMESTAMP_SCAN:
+            self._set_file_position(start)
+            buff = self._file.read(MAX_EVENTS)
+            if not buff:
                 break
+            position = 0
+            if continued:
+                # Skip the rest of a long line
+                nl = buff.find('\n')
+                if nl == -1:
+                    start += len(buff)
+                    continue
+                position = nl + 1
+                continued = False
+            while position < len(buff) and start + position < end:
+                if position and len(buff) == MAX_EVENTS and \
+                        position + LINE_TIMESTAMP_SIZE > len(buff):
+                    # Read the beginning of the line again with the next block
+                    break
+                stamp = line_timestamp(buff[position:position + LINE_TIMESTAMP_SIZE],
+                                       self._line_format)
+                if stamp:
+                    return [start + position, stamp[0]]
+                nl = buff.find('\n', position)
+                if nl == -1:
+                    position = len(buff)
+                    continued = True
+                    break
+                position = nl + 1
+            start += position
+        return [None, None]
+
+    def _seek_time(self, when, size):
+        """Returns offset of the first line stamped at or after the time
+        given. Lines are expected to be ordered by time, lines without
+        timestamp belong to the preceding one. Timestamps of lines are binary
+        searched, the file is not read sequentially."""
+        # Find format of timestamps in the file
+        self._set_file_position(0)
+        for line in self._file.read(MAX_EVENTS).split('\n')[:LINE_TIMESTAMP_SAMPLES]:
+            stamp = line_timestamp(line)
+            if stamp:
+                self._line_format = stamp[1]
+                break
+        else:
+            log.warning("Cannot find timestamps in %s, following from the end", self.real_name)
+            self._backfill = None
+            return size
 
-            # No line, wait
-            time.sleep(TAIL_RECHECK)
-
-            # Log rename check
-            idle_cnt += 1
-            if idle_cnt == NAME_CHECK:
-                if self._log_rename():
-                    self._open_log()
-                    iaa_cnt = 0
-                else:
-                    # Recover from external file modification
-                    position = self._get_file_position()
-                    self._set_file_position(0, FILE_END)
-                    file_size = self._get_file_position()
-                    if file_size < position:
-                        # File has been externaly modified
-                        position = file_size
-                    self._set_file_position(position)
-                idle_cnt = 0
+        # Lines before `lo' are older, the line at `found' is the first one
+        # stamped at or after the time if it is not the end of the file
+        lo, hi, found = 0, size, size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start, stamp = self._stamped_line(mid, hi)
+            if start is None:
+                hi = mid
+            elif stamp >= when:
+                found = start
+                hi = mid
             else:
-                # To reset end-of-line error
-                self._set_file_position(self._get_file_position())
-            iaa_cnt += 1
+                lo = start + 1
+        return found
+
+    def _start_backfill(self, offset, size):
+        log.info("Backfilling %s, %d bytes to send", self.real_name, size - offset)
+        self._backfilling = True
+        self._backfill_offset = offset
+        self._backfill_size = size
+        self._backfill_started = self._backfill_reported = time.time()
+
+    def _report_backfill(self, finished=False):
+        """Logs progress and throughput of backfill."""
+        now = time.time()
+        sent = self._get_file_position() - self._backfill_offset
+        rate = sent / max(now - self._backfill_started, 0.001) / (1024 * 1024)
+        if finished:
+            log.info("Backfilled %s, %d bytes in %.1fs, %.1f MB/s", self.real_name,
+                     sent, now - self._backfill_started, rate)
+        else:
+            done = 100 * sent / max(self._backfill_size - self._backfill_offset, 1)
+            log.info("Backfilling %s, %d%% done, %.1f MB/s", self.real_name,
+                     min(done, 100), rate)
+        self._backfill_reported = now
+
+    def _read_backfill(self):
+        """Reads and sends large blocks of whole lines as long as the transport
+        keeps up. Backfill finishes once the end of the file is reached.
+        Returns delay in seconds of the next service."""
+        # Rate limited logs take small blocks to keep bursts short
+        block_size = BACKFILL_BLOCK
+        if self._rate_limit:
+            block_size = MAX_EVENTS
+        for _ in xrange(BACKFILL_BLOCKS_SERVICED):
+            if self.transport.queued() >= BACKFILL_MAX_QUEUED:
+                return BACKFILL_WAIT
+            delay = self._throttle()
+            if delay:
+                return delay
+            block = self._file.read(block_size)
+            finished = len(block) < block_size
+            if not finished:
+                # Lines split by the block boundary are read with the next
+                # block again
+                nl = block.rfind('\n')
+                if nl != -1 and nl != len(block) - 1:
+                    self._set_file_position(nl + 1 - len(block), FILE_CURRENT)
+                    block = block[:nl + 1]
+            if block and self._rate_limit:
+                end = self._rate_limit.allowance(block)
+                if end < len(block):
+                    self._set_file_position(end - len(block), FILE_CURRENT)
+                    block = block[:end]
+                    finished = False
+            if block:
+                self._process_line(block)
+                if not self._file:
+                    return REOPEN_TRY_INTERVAL
+                self._checkpoint()
+            if finished:
+                self._backfilling = False
+                self._report_backfill(True)
+                break
+        if self._backfilling and \
+                time.time() - self._backfill_reported >= BACKFILL_REPORT_INTERVAL:
+            self._report_backfill()
+        return 0
+
+    def _throttle(self):
+        """Returns seconds to wait before reading more lines if the log is
+        over its rate limit, zero otherwise."""
+        if not self._rate_limit:
+            return 0
+        return self._rate_limit.wait()
+
+    def _checkpoint(self):
+        """Records the offset of data handed to the transport."""
+        offset = self._get_file_position() - (self._rest_end - self._rest_start)
+        if self._assembler:
+            offset -= self._assembler.pending_size()
+        self._offset = offset
+        self._size = os.fstat(self._file.fileno()).st_size
+        if self._registry:
+            self._registry.update(self.real_name, self._file_id, offset)
+
+    def _lag(self):
+        """Returns the number of bytes behind the end of the file as of the
+        last checkpoint."""
+        return max(self._size - self._offset, 0)
+
+    def _at_end(self):
+        """Returns True if there is nothing new to read, checked without
+        reading. Lines held back by the rate limit are still to be read."""
+        if self._rest_start != self._rest_end and \
+                self._buffer.find('\n', self._rest_start, self._rest_end) != -1:
+            return False
+        return os.fstat(self._file.fileno()).st_size == self._get_file_position()
 
-        return line
+    def stats(self):
+        """Returns the offset of data sent, the size of the file and the lag,
+        the difference of the two, in bytes and in seconds since the follower
+        last read to the end of the file. Returns None until the file is
+        open."""
+        if not self._file_id:
+            return None
+        size = self._size
+        f = self._file
+        if f:
+            # The follower may not have been serviced for a while
+            try:
+                size = os.fstat(f.fileno()).st_size
+            except (OSError, ValueError):
+                pass
+        lag = max(size - self._offset, 0)
+        lag_seconds = 0.0
+        if lag:
+            lag_seconds = max(time.time() - self._caught_up, 0.0)
+        return {'path': self.real_name, 'offset': self._offset, 'size': size,
+                'lag': lag, 'lag_seconds': lag_seconds, 'long_lines': self._long_lines,
+                'open': int(f is not None)}
+
+    def _flush_event(self):
+        """Sends the event held back by the multiline assembler."""
+        if self._assembler and self._assembler.pending_size():
+            self._process_line('', True)
+            if self._file:
+                self._checkpoint()
+
+    def _restart(self):
+        """Sends what has been read and follows the truncated file from its
+        new beginning."""
+        self._flush_rest()
+        self._flush_event()
+        self._set_file_position(0)
+        self._fingerprint = ""
+        self._continues = False
+        self._rest_start = self._rest_end = 0
+        self._checkpoint()
+
+    def _check_file(self, check_name):
+        """Recovers from truncation of the file and optionally checks if the
+        file has been rotated. Returns True if the follower should be
+        serviced again right away."""
+        if check_name:
+            self._checked = time.time()
+        stat = os.fstat(self._file.fileno())
+        if self._truncated(stat.st_size):
+            self._restart()
+            return True
+
+        if check_name or self._rotating:
+            candidate = self._rotated_candidate(stat)
+            if candidate:
+                # Read the rest of the rotated file before switching
+                if self._read_blocks():
+                    return True
+                self._flush_rest()
+                self._flush_event()
+                return self._open_log()
+            if self._owner and not self._index.lookup(self.name) and \
+                    time.time() - stat.st_mtime >= ROTATION_GRACE:
+                # Deleted or renamed away, and read to the end
+                self._owner.retire(self)
+        return False
 
-    def _send_line(self, line):
-        """ Sends the line. """
+    def _send_line(self, line, flush=False, head=0, tail=0):
+        """ Sends the line. Lines are assembled to multiline events first,
+        see `MultilineAssembler.feed' for head and tail. """
+        if self._assembler:
+            line = self._assembler.feed(line, flush, head, tail)
         if line:
             line = self.event_filter(line)
         if not line:
             return
+        if self._rate_limit:
+            # Limits apply to lines as read, not as formatted
+            line = self._rate_limit.admit(line)
+            if not line:
+                return
         if config.debug_events:
             print >> sys.stderr, line,
         if line:
@@ -1436,48 +2753,594 @@ class Follower(object):
             return
         self.transport.send(line)
 
+    def _process_line(self, line, flush=False, head=0, tail=0):
+        """ Sends the line, recovers from errors. """
+        try:
+            self._send_line(line, flush, head, tail)
+        except IOError, e:
+            if config.debug:
+                log.debug("IOError: %s", e)
+            self._open_log()
+        except UnicodeError, e:
+            log.warn("UnicodeError sending line %s", line, exc_info=True)
+        except Exception, e:
+            log.error("Caught unknown error %s while sending line %s", e, line, exc_info=True)
+
+    def _read_blocks(self):
+        """Reads and sends up to MAX_BLOCKS_SERVICED blocks of lines, or
+        CATCH_UP_BLOCKS_SERVICED if the follower lags behind, so that it
+        catches up with the file. Returns True if there is likely more to
+        read."""
+        max_blocks = MAX_BLOCKS_SERVICED
+        if self._lag() >= CATCH_UP_LAG:
+            max_blocks = CATCH_UP_BLOCKS_SERVICED
+        for blocks in xrange(max_blocks):
+            if self._throttle():
+                # Stay behind in the file until the rate limit allows more,
+                # see `_follow'
+                if blocks:
+                    self._checkpoint()
+                return True
+            line = self._read_log_line()
+            if len(line) == 0:
+                break
+            tail = self._block_tail
+            if self._rate_limit:
+                end = self._rate_limit.allowance(line)
+                if end < len(line):
+                    # Lines over the limit are read again later
+                    self._unread(end)
+                    line = line[:end]
+                    tail = 0
+            self._idle_delay = TAIL_RECHECK
+            self._active = time.time()
+            self._process_line(line, False, self._block_head, tail)
+            if not self._file:
+                return False
+        else:
+            self._checkpoint()
+            return True
+        if blocks:
+            self._checkpoint()
+        else:
+            # Idle followers do not hold buffers
+            self._release_buffer()
+        return False
+
+    def service(self, events):
+        """Reads and sends blocks of newly detected lines. Events are the
+        watcher's events collected since the last call, zero if the follower
+        has been scheduled by its timer. Returns delay in seconds after which
+        the follower should be serviced again even if no change is detected.
+        """
+        delay = self._follow(events)
+        if self._file and delay and not self._closed:
+            # Send the partial line once it times out
+            flush_delay = self._partial_line_delay()
+            if flush_delay == 0:
+                self._flush_rest(True)
+            elif flush_delay is not None:
+                delay = min(delay, flush_delay)
+        if self._assembler and delay and not self._closed:
+            # Send the held back event once it times out
+            flush_delay = self._assembler.flush_delay()
+            if flush_delay == 0:
+                self._flush_event()
+            elif flush_delay is not None:
+                delay = min(delay, flush_delay)
+        return delay
+
+    def _follow(self, events):
+        """Reads the file, see `service'."""
+        if self._parked is not None:
+            if not events and not self._changed():
+                if self._is_watched():
+                    return WATCH_RECHECK
+                return IDLE_RECHECK
+            if not self._unpark():
+                self._close_log()
+        if not self._file:
+            if not self._open_log():
+                if self._owner:
+                    # Vanished before we got to it
+                    self._owner.retire(self)
+                    return None
+                return REOPEN_TRY_INTERVAL
+        # Moves at the end of the log file or where we stopped last time
+        if self.flush:
+            self._set_file_position(self._initial_position())
+            self.flush = False
+            self._checkpoint()
+
+        if self._backfilling:
+            return self._read_backfill()
+
+        if (events or not self._is_watched()) and \
+                self._truncated(os.fstat(self._file.fileno()).st_size):
+            # Truncated and written past the old size since the last read,
+            # it would be read from the middle otherwise
+            self._restart()
+
+        delay = self._throttle()
+        if delay:
+            return delay
+        if not events and self._at_end():
+            # Idle followers do not hold buffers
+            self._release_buffer()
+        elif self._read_blocks():
+            # Let other followers go, but come back immediately
+            return 0
+        if not self._file:
+            return REOPEN_TRY_INTERVAL
+        self._caught_up = time.time()
+
+        if self._is_watched():
+            # Nothing to read after a move or a directory change means
+            # rotation, after a modification it means truncation
+            if self._check_file(events & ~inotify.IN_MODIFY or
+                                time.time() - self._checked >= IAA_INTERVAL):
+                return 0
+            if self._closed:
+                return None
+            if self._rotating:
+                # The new file is not watched yet
+                return TAIL_RECHECK
+            if self._idle():
+                self._park()
+            return WATCH_RECHECK
+
+        # Re-checks back off, the name is checked on every re-check then
+        if self._rotating or time.time() - self._checked >= NAME_CHECK:
+            if self._check_file(True):
+                return 0
+            if self._closed:
+                return None
+        if self._rotating:
+            return TAIL_RECHECK
+        if self._idle():
+            self._park()
+        delay = self._idle_delay
+        self._idle_delay = min(self._idle_delay * 2, IDLE_RECHECK)
+        return delay
+
+    def _flush_rest(self, timed=False):
+        """Sends lines read but not sent yet, including the partial line at
+        the end of the file. The partial line sent as it times out is marked
+        as split, the rest of it follows once written."""
+        if not self._file or self._rest_start == self._rest_end:
+            return
+        rest = self._continued(self._buffer_view[self._rest_start:self._rest_end].tobytes())
+        self._rest_start = self._rest_end = 0
+        tail = 0
+        if not rest.endswith('\n'):
+            if timed:
+                rest += LONG_LINE_MARKER
+                tail = len(LONG_LINE_MARKER)
+                self._continues = True
+            rest += '\n'
+            tail += 1
+        self._process_line(rest, False, self._block_head, tail)
+        if self._file:
+            self._checkpoint()
+
+    def close(self):
+        """Closes the file and removes watches. Called by the reactor."""
+        self._flush_rest()
+        self._flush_event()
+        self._close_log()
+        if self._dir_watch:
+            self._index.unsubscribe(self._dir_watch)
+            self._dir_watch = None
+
+
+class GlobFollower(object):
+
+    """Follows all files matching a glob pattern. Every matching file gets its
+    own follower. New matches are discovered from events of the watched
+    directory and by periodic re-scans, followers of deleted files retire."""
+
+    def __init__(self, pattern, event_filter, event_formatter, transport, reactor,
+                 backfill=None, multiline_event=None, rate_limit=None):
+        self.name = pattern
+        self.event_filter = event_filter
+        self.event_formatter = event_formatter
+        self.transport = transport
+        self.backfill = backfill
+        self.multiline_event = multiline_event
+        self.rate_limit = rate_limit
+
+        self._reactor = reactor
+        self._index = reactor.index
+        self._dir_name, self._base_pattern = os.path.split(pattern)
+        self._dir_watch = None
+        self._lock = threading.Lock()
+        # Path -> follower
+        self._followers = {}
+        # Device and inode of files followed now or in the past, files
+        # renamed by rotation to names matching the pattern are not followed
+        # again
+        self._known = set()
+        # Names reported by the watcher since the last scan
+        self._pending = set()
+        self._rescan = True
+        self._first_scan = True
+
+        # Scheduling state, maintained by the reactor
+        self._events = 0
+        self._queued = False
+        self._running = False
+        self._due = None
+        self._closed = False
+
+        self._watch_dir()
+        reactor.add(self)
+
+    def _watch_dir(self):
+        """Subscribes for changes of the directory of matching files if the
+        directory does not contain wildcards itself."""
+        if not glob.has_magic(self._dir_name):
+            self._dir_watch = self._index.subscribe(self._dir_name, None, self._wake)
+
+    def _is_watched(self):
+        return self._dir_watch is not None and self._index.watched(self._dir_name)
+
+    def _wake(self, mask, name):
+        """Called by the watcher when an entry of the directory changes."""
+        with self._lock:
+            if mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO) and name:
+                self._pending.add(name)
+            elif not name:
+                # Overflow or the directory itself has gone
+                self._rescan = True
+        self._reactor.notify(self, mask)
+
+    def stats(self):
+        """Files are reported by followers of the matches."""
+        return None
+
+    def opened(self, file_id):
+        """Called by followers when they open a file."""
+        with self._lock:
+            self._known.add(file_id)
+
+    def retire(self, follower):
+        """Stops the follower of a deleted file. Called by the follower while
+        it is being serviced."""
+        with self._lock:
+            if self._followers.get(follower.name) is follower:
+                del self._followers[follower.name]
+        self._reactor.remove(follower)
+        follower.close()
+
+    def _candidates(self, rescan):
+        """Returns names of files to check, all matches on re-scans."""
+        watched = self._is_watched()
+        with self._lock:
+            rescan = rescan or self._rescan or not watched
+            pending = self._pending
+            self._pending = set()
+            self._rescan = False
+        if not self._dir_watch:
+            return True, glob.glob(self.name)
+        if rescan:
+            pending = self._index.names(self._dir_name)
+        # Hidden files match only patterns starting with a dot, as with glob
+        hidden = self._base_pattern.startswith('.')
+        return rescan, [os.path.join(self._dir_name, name) for name in pending
+                        if (hidden or not name.startswith('.')) and
+                        fnmatch.fnmatch(name, self._base_pattern)]
+
+    def service(self, events):
+        """Starts followers of new matching files. Returns delay in seconds of
+        the next re-scan."""
+        rescan, candidates = self._candidates(not events)
+
+        seen = set()
+        for path in candidates:
+            with self._lock:
+                if path in self._followers:
+                    continue
+            file_id = self._index.lookup(path)
+            if not file_id:
+                continue
+            seen.add(file_id)
+            with self._lock:
+                if file_id in self._known:
+                    continue
+                self._known.add(file_id)
+                log.info("Following %s", path)
+                self._followers[path] = Follower(
+                    path, self.event_filter, self.event_formatter, self.transport,
+                    self._reactor, self, not self._first_scan, self.backfill,
+                    self.multiline_event, self.rate_limit)
+        self._first_scan = False
+
+        if rescan:
+            # Forget files which do not match any more
+            with self._lock:
+                for follower in self._followers.itervalues():
+                    seen.add(follower._file_id)
+                self._known &= seen
+
+        if self._is_watched():
+            return GLOB_WATCH_RECHECK
+        return GLOB_RECHECK
+
+    def close(self):
+        """Unsubscribes from the directory. Followers are closed by the
+        reactor."""
+        if self._dir_watch:
+            self._index.unsubscribe(self._dir_watch)
+            self._dir_watch = None
+
+
+class FollowerReactor(object):
+
+    """Services all followers from a small, fixed pool of worker threads. A
+    follower is queued for servicing when the watcher reports a change of its
+    file or when its re-check timer expires. Timers are handled by a single
+    thread waiting in select() on a wake-up pipe. If the event loop is given,
+    followers are serviced and timers handled by the loop instead. Followers
+    keep at most max_open_files files open, see `get_max_open_files'."""
+
+    def __init__(self, watcher, registry, threads, loop=None, max_open_files=None):
+        self.watcher = watcher
+        self.index = DirectoryIndex(watcher)
+        self.registry = registry
+        if max_open_files is None:
+            max_open_files = get_max_open_files()
+        self.open_files = OpenFiles(max_open_files)
+        self.loop = loop
+        self._lock = threading.Lock()
+        self._ready = Queue.Queue()
+        self._timers = []
+        self._timer_seq = itertools.count()
+        self._followers = []
+        # Followers closed by their workers once serviced, see `close'
+        self._closing = set()
+        self._shutdown = False
+        self._workers = []
+        if loop:
+            return
+        self._wake_r, self._wake_w = os.pipe()
+
+        self._timer_worker = threading.Thread(
+            target=self._run_timers, name='follower-timers')
+        self._timer_worker.daemon = True
+        self._timer_worker.start()
+        for index in range(threads):
+            worker = threading.Thread(
+                target=self.run, name='follower-%d' % index)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def add(self, follower):
+        with self._lock:
+            self._followers.append(follower)
+        self.notify(follower, 0)
+
+    def stats(self):
+        """Returns `Follower.stats' of all files followed."""
+        with self._lock:
+            followers = list(self._followers)
+        return [stats for stats in (follower.stats() for follower in followers) if stats]
+
+    def remove(self, follower):
+        """Stops servicing the follower."""
+        with self._lock:
+            follower._closed = True
+            self._followers.remove(follower)
+
+    def notify(self, follower, events):
+        """Queues the follower for servicing unless it is queued already.
+        Followers being serviced are re-queued once finished."""
+        with self._lock:
+            follower._events |= events
+            if follower._queued or follower._closed:
+                return
+            follower._queued = True
+            if follower._running:
+                return
+        self._enqueue(follower)
+
+    def _enqueue(self, follower):
+        if self.loop:
+            self.loop.call_soon(self._service, follower)
+        else:
+            self._ready.put(follower)
+
+    def _expire(self, follower, when):
+        """Queues the follower unless its timer has been re-armed."""
+        with self._lock:
+            if follower._due != when:
+                return
+            follower._due = None
+        self.notify(follower, 0)
+
+    def _schedule(self, follower, delay):
+        """Arms the re-check timer of the follower."""
+        when = time.time() + delay
+        if self.loop:
+            follower._due = when
+            self.loop.call_later(delay, self._expire, follower, when)
+            return
+        with self._lock:
+            follower._due = when
+            earliest = not self._timers or when < self._timers[0][0]
+            heapq.heappush(self._timers, (when, self._timer_seq.next(), follower))
+        if earliest:
+            os.write(self._wake_w, '.')
+
+    def _run_timers(self):
+        """Queues followers whose re-check timers have expired."""
+        while not self._shutdown:
+            expired = []
+            with self._lock:
+                now = time.time()
+                while self._timers and self._timers[0][0] <= now:
+                    when, _, follower = heapq.heappop(self._timers)
+                    # Skip timers re-armed in the meantime
+                    if follower._due == when:
+                        follower._due = None
+                        expired.append(follower)
+                timeout = None
+                if self._timers:
+                    timeout = self._timers[0][0] - now
+            for follower in expired:
+                self.notify(follower, 0)
+            try:
+                if select.select([self._wake_r], [], [], timeout)[0]:
+                    os.read(self._wake_r, 4096)
+            except select.error:
+                pass
+
+    def run(self):
+        """Services followers from the ready queue."""
+        while True:
+            follower = self._ready.get()
+            if follower is None:
+                break
+            self._service(follower)
+
+    def _service(self, follower):
+        """Services the follower and arranges its next turn."""
+        with self._lock:
+            follower._queued = False
+            if follower._closed:
+                return
+            follower._running = True
+            events = follower._events
+            follower._events = 0
+
+        delay = None
+        try:
+            delay = follower.service(events)
+        except Exception, e:
+            log.error("Caught unknown error %s while reading line", e, exc_info=True)
+            delay = TAIL_RECHECK
+
+        with self._lock:
+            follower._running = False
+            requeue = follower._queued and not follower._closed
+            close = follower in self._closing
+        if close:
+            follower.close()
+        elif requeue:
+            self._enqueue(follower)
+        elif delay == 0:
+            self.notify(follower, 0)
+        elif delay is not None:
+            self._schedule(follower, delay)
+
     def close(self):
-        """Closes the follower by setting the shutdown flag and waiting for the
-        worker thread to stop."""
+        """Stops the workers and closes all followers."""
         self._shutdown = True
-        self._worker.join(1.0)
-
-    def monitorlogs(self):
-        """ Opens the log file and starts to collect new events. """
-        self._open_log()
-        while not self._shutdown:
-            try:
-                line = self._get_line()
-                try:
-                    if line:
-                        self._send_line(line)
-                except IOError, e:
-                    if config.debug:
-                        log.debug("IOError: %s", e)
-                    self._open_log()
-                except UnicodeError, e:
-                    log.warn("UnicodeError sending line %s", line, exc_info=True)
-                except Exception, e:
-                    log.error("Caught unknown error %s while sending line %s", e, line, exc_info=True)
-            except Exception, e:
-                log.error("Caught unknown error %s while reading line", e, exc_info=True)
-        self._close_log()
+        with self._lock:
+            for follower in self._followers:
+                follower._closed = True
+        for _ in self._workers:
+            self._ready.put(None)
+        if not self.loop:
+            os.write(self._wake_w, '.')
+        for worker in self._workers:
+            worker.join(1.0)
+        if not self.loop:
+            self._timer_worker.join(1.0)
+        with self._lock:
+            # Followers still being serviced by workers which have not
+            # stopped in time are closed by them once done
+            self._closing = set(follower for follower in self._followers if follower._running)
+            idle = [follower for follower in self._followers if not follower._running]
+        for follower in idle:
+            follower.close()
+        if self.watcher:
+            self.watcher.close()
+        if self.registry:
+            self.registry.cancel()
 
 
 class Transport(object):
 
     """Encapsulates simple connection to a remote host. The connection may be
-    encrypted. Each communication is started with the preamble."""
-
-    def __init__(self, endpoint, port, use_ssl, preamble, debug_transport_events, proxy):
+    encrypted. Each communication is started with the preamble. Entries are
+    sent by a dedicated thread, or by threads of the pool given. Transports
+    sharing the endpoint and preamble are told apart by the channel number.
+    If compress is set, the data stream is deflated and flushed after each
+    batch."""
+
+    def __init__(self, endpoint, port, use_ssl, preamble, debug_transport_events, proxy, pool=None,
+                 channel=0, compress=False):
         # Copy transport configuration
         self.endpoint = endpoint
         self.port = port
         self.use_ssl = use_ssl
         self.preamble = preamble
-        self._entries = Queue.Queue(SEND_QUEUE_SIZE)
         self._socket = None
+        self._address = None
+        self._failover = False
         self._debug_transport_events = debug_transport_events
+        self._compress = compress
+        self._compressor = None
+        self.name = '%s:%s' % (endpoint, port)
+        if channel:
+            self.name += '/%d' % channel
+
+        # Counters of `stats', updated by the thread sending entries only
+        self._sent_bytes = 0
+        self._wire_bytes = 0
+        self._batches = 0
+        self._send_time = 0.0
+        self._connects = 0
+        self._connect_time = 0.0
+
+        # Batching of writes
+        self._max_bytes = config.send_max_bytes
+        if self._max_bytes == NOT_SET:
+            self._max_bytes = SEND_MAX_BYTES
+        self._max_linger = config.send_max_linger
+        if self._max_linger == NOT_SET:
+            self._max_linger = SEND_MAX_LINGER
+
+        # Entries are spooled to disk while the queue is full or the
+        # connection is down
+        self._spool = None
+        self._down = False
+        if config.spool_size != NOT_SET:
+            spool_name = '%s_%s_%08x' % (endpoint, port, zlib.crc32(preamble) & 0xffffffff)
+            if channel:
+                spool_name += '_%d' % channel
+            spool_dir = os.path.join(get_cache_dir(), SPOOL_NAME, spool_name)
+            try:
+                self._spool = spool.Spool(spool_dir, config.spool_size,
+                                          min(SPOOL_SEGMENT_SIZE, max(config.spool_size / 4, 1)))
+            except spool.SpoolError, e:
+                log.error("%s, spool disabled", e)
+
+        # Entries waiting for send, limited by size and by the memory budget
+        # shared by all transports
+        queue_size = config.queue_size
+        if queue_size == NOT_SET:
+            queue_size = SEND_QUEUE_SIZE
+        self._overflow = config.queue_overflow
+        if self._overflow == NOT_SET:
+            self._overflow = sendqueue.OVERFLOW_SPILL if self._spool else sendqueue.OVERFLOW_DROP_OLDEST
+        elif self._overflow == sendqueue.OVERFLOW_SPILL and not self._spool:
+            self._overflow = sendqueue.OVERFLOW_DROP_OLDEST
+        elif self._overflow == sendqueue.OVERFLOW_BLOCK and eventloop.current:
+            # Blocking would stall the event loop
+            self._overflow = sendqueue.OVERFLOW_DROP_OLDEST
+        self._entries = sendqueue.SendQueue(queue_size, get_memory_budget(), self._overflow)
+        self._drops_reported = 0
+        self._drops_report_time = 0
+        # Batch taken from the queue or read from the spool and not sent
+        # yet, and the size of spooled entries in it committed once written
+        self._unsent = ''
+        self._unsent_spooled = 0
+        # Batch written last and the time of the write; the batch is written
+        # again if the connection turns out to be lost
+        self._unconfirmed = ''
+        self._written = 0
 
         self._shutdown = False
 
@@ -1517,19 +3380,64 @@ class Transport(object):
         self._certs = cert_name
 
         # Start asynchronous worker
-        self._worker = threading.Thread(target=self.run)
-        self._worker.daemon = True
-        self._worker.start()
+        self._pool = pool
+        self._worker = None
+        self._start()
+
+    def _start(self):
+        if self._pool:
+            self._pool.add(self)
+        else:
+            self._worker = threading.Thread(target=self.run)
+            self._worker.daemon = True
+            self._worker.start()
+
+    def _target(self):
+        """Returns the host and port the socket connects to, the proxy or the
+        endpoint."""
+        if self._use_proxy:
+            return self._proxy_url, self._proxy_port
+        return self.endpoint, self.port
+
+    def _resolve_target(self):
+        """Looks up the address of the host the socket connects to. Addresses
+        are cached, see `DnsCache'."""
+        host, port = self._target()
+        self._address = dns_cache.address(host, port)
+        return self._address
+
+    def _connect_failed(self):
+        """Notes the address could not be connected. Returns True if another
+        address of the host should be tried right away."""
+        host, port = self._target()
+        return dns_cache.failed(host, port, self._address)
 
     def _get_address(self, use_proxy):
+        """Returns the address of the endpoint; the name if the proxy
+        resolves it."""
         if use_proxy:
             return self.endpoint
-        else:
-            """Returns an IP address of the endpoint. If the endpoint resolves to
-            multiple addresses, a random one is selected. This works better than
-            default selection."""
-            return random.choice(
-                socket.getaddrinfo(self.endpoint, self.port))[4][0]
+        return self._address
+
+    def _wrap_ssl(self, plain_socket, handshake=True):
+        """Wraps the socket in SSL. The SSL context with CA certificates
+        loaded is shared by all connections."""
+        context = get_ssl_context(self._certs)
+        if context:
+            server_hostname = None
+            if ssl.HAS_SNI:
+                server_hostname = self.endpoint
+            return context.wrap_socket(plain_socket, server_hostname=server_hostname,
+                                       do_handshake_on_connect=handshake)
+        try:
+            return ssl.wrap_socket(
+                plain_socket, ca_certs=self._certs,
+                cert_reqs=ssl.CERT_REQUIRED, ssl_version=ssl.PROTOCOL_TLSv1,
+                ciphers=SSL_CIPHERS, do_handshake_on_connect=handshake)
+        except TypeError:
+            return ssl.wrap_socket(
+                plain_socket, ca_certs=self._certs, cert_reqs=ssl.CERT_REQUIRED,
+                ssl_version=ssl.PROTOCOL_TLSv1, do_handshake_on_connect=handshake)
 
     def _connect_ssl(self, plain_socket):
         """Connects the socket and wraps in SSL. Returns the wrapped socket
@@ -1540,16 +3448,7 @@ class Transport(object):
             address = self._get_address(self._use_proxy)
             s = plain_socket
             s.connect((address, self.port))
-
-            try:
-                s = ssl.wrap_socket(
-                    plain_socket, ca_certs=self._certs,
-                    cert_reqs=ssl.CERT_REQUIRED, ssl_version=ssl.PROTOCOL_TLSv1,
-                    ciphers="HIGH:-aNULL:-eNULL:-PSK:RC4-SHA:RC4-MD5")
-            except TypeError:
-                s = ssl.wrap_socket(
-                    plain_socket, ca_certs=self._certs, cert_reqs=ssl.CERT_REQUIRED,
-                    ssl_version=ssl.PROTOCOL_TLSv1)
+            s = self._wrap_ssl(plain_socket)
 
             try:
                 match_hostname(s.getpeercert(), self.endpoint)
@@ -1560,6 +3459,7 @@ class Transport(object):
             return s
 
         except IOError, e:
+            self._failover = self._connect_failed()
             cause = e.strerror
             if not cause:
                 cause = "(No reason given)"
@@ -1574,6 +3474,7 @@ class Transport(object):
         try:
             plain_socket.connect((address, self.port))
         except IOError, e:
+            self._failover = self._connect_failed()
             cause = e.strerror
             if not cause:
                 cause = ""
@@ -1587,40 +3488,67 @@ class Transport(object):
         log.debug("Opening connection %s:%s %s",
                   self.endpoint, self.port, self.preamble.strip())
         self._close_connection()
-        retry = 0
         delay = SRV_RECON_TO_MIN
         # Keep trying to open the connection
-        while not self._shutdown:
-            try:
-                s = None
-                if self._use_proxy:
-                    s = socks.socksocket(socket.AF_INET, socket.SOCK_STREAM)
-                    s.setproxy(self._proxy_type, self._proxy_url, self._proxy_port)
-                else:
-                    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
-                s.settimeout(TCP_TIMEOUT)
-                if self.use_ssl:
-                    self._socket = self._connect_ssl(s)
-                else:
-                    self._socket = self._connect_plain(s)
-
-                # If the socket is open, send preamble and leave
-                if self._socket:
-                    if self.preamble:
-                        self._socket.send(self.preamble)
-                    break
-            except socket.error:
-                if self._shutdown:
-                    return  # XXX
+        while not self._shutdown and not self._attempt():
+            if self._shutdown:
+                return
+            if self._failover:
+                # Try the next address of the host right away
+                continue
 
             # Wait between attempts
             time.sleep(delay)
-            retry += 1
             delay *= 2
             if delay > SRV_RECON_TO_MAX:
                 delay = SRV_RECON_TO_MAX
 
+    def connect(self):
+        """Makes one attempt to open the connection, returns True if it is
+        open. Used by the pool to connect transports it has connections for
+        when they are added; further attempts are made on their turns."""
+        log.debug("Opening connection %s:%s %s",
+                  self.endpoint, self.port, self.preamble.strip())
+        self._close_connection()
+        return self._attempt()
+
+    def _attempt(self):
+        """Makes one attempt to open the connection and send the preamble.
+        Returns True if the connection is open."""
+        self._failover = False
+        attempt = time.time()
+        try:
+            s = None
+            address = self._resolve_target()
+            if self._use_proxy:
+                s = socks.socksocket(socket.AF_INET, socket.SOCK_STREAM)
+                s.setproxy(self._proxy_type, address, self._proxy_port)
+            else:
+                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+            s.settimeout(TCP_TIMEOUT)
+            if self.use_ssl:
+                self._socket = self._connect_ssl(s)
+            else:
+                self._socket = self._connect_plain(s)
+
+            # If the socket is open, send preamble and leave
+            if self._socket:
+                dns_cache.connected(*self._target())
+                self._start_stream()
+                if self.preamble:
+                    self._socket.send(self._encode(self.preamble))
+                self._down = False
+                self._written = time.time()
+                self._connects += 1
+                self._connect_time += time.time() - attempt
+                return True
+        except socket.error:
+            if self._shutdown:
+                return False
+        self._down = True
+        return False
+
     def _close_connection(self):
         if self._socket:
             try:
@@ -1629,67 +3557,1012 @@ class Transport(object):
                 pass
             self._socket = None
 
-    def _send_entry(self, entry):
-        """Sends the entry. If the connection fails it will re-open it and try
-        again."""
-        # Keep sending data until successful
-        while not self._shutdown:
+    def _start_stream(self):
+        """Starts the data stream of a new connection."""
+        if self._compress:
+            self._compressor = zlib.compressobj(COMPRESSION_LEVEL)
+
+    def _encode(self, data):
+        """Returns the data as sent over the connection. Compressed data is
+        flushed so the receiver can decompress all of it right away."""
+        if not self._compressor:
+            return data
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def _peer_closed(self):
+        """Returns True if the remote side has closed the connection. Checked
+        without blocking, received data is ignored as in
+        `AsyncTransport._readable'."""
+        try:
+            if not select.select([self._socket], [], [], 0)[0]:
+                return False
+            self._socket.setblocking(0)
             try:
-                self._socket.send(entry)
-                if self._debug_transport_events:
-                    print >> sys.stderr, entry,
-                break
-            except socket.error:
-                self._open_connection()
+                return not self._socket.recv(4096)
+            finally:
+                self._socket.settimeout(TCP_TIMEOUT)
+        except ssl.SSLError, e:
+            return e.args[0] not in (ssl.SSL_ERROR_WANT_READ, ssl.SSL_ERROR_WANT_WRITE)
+        except (socket.error, select.error), e:
+            return e.args[0] not in (errno.EAGAIN, errno.EINTR)
+
+    def _lost(self):
+        """Closes the connection lost. The batch written last may not have
+        been delivered, it is written again before the batch not sent yet."""
+        self._close_connection()
+        self._down = True
+        self._unsent = self._unconfirmed + self._unsent
+        self._unconfirmed = ''
+
+    def _check_closed(self):
+        """Closes the connection if the remote side has closed it, see
+        `_lost'."""
+        if self._socket and self._peer_closed():
+            log.debug("Connection %s:%s closed by the remote side", self.endpoint, self.port)
+            self._lost()
+
+    def _send_unsent(self):
+        """Sends the batch not sent yet. If the connection fails it will
+        re-open it and try again. Returns False if the batch has not been
+        sent due to shutdown.
+
+        Writes to a connection closed by the remote side may succeed, so
+        the batch written last is kept and written again if the next write
+        fails. Connections idle for SEND_IDLE_CHECK are checked for having
+        been closed before writing; busy connections are not, so that writes
+        take no extra system calls. Batches are thus delivered at least once
+        and may be duplicated."""
+        # Keep sending data until successful, during shutdown over the
+        # connection open only
+        while True:
+            if time.time() - self._written >= SEND_IDLE_CHECK:
+                self._check_closed()
+            if self._socket:
+                try:
+                    started = time.time()
+                    data = self._encode(self._unsent)
+                    self._socket.sendall(data)
+                except socket.error:
+                    self._lost()
+                else:
+                    self._sent(self._unsent, data, started)
+                    if self._unsent_spooled:
+                        self._spool.commit(self._unsent_spooled)
+                    self._unconfirmed = self._unsent
+                    self._written = time.time()
+                    self._unsent = ''
+                    self._unsent_spooled = 0
+                    return True
+            if self._shutdown:
+                return False
+            self._open_connection()
+
+    def _sent(self, entry, data, started):
+        """Counts the entry sent as data since the time given."""
+        self._sent_bytes += len(entry)
+        self._wire_bytes += len(data)
+        self._batches += 1
+        self._send_time += time.time() - started
+        if self._debug_transport_events:
+            print >> sys.stderr, entry,
+
+    def _replay(self):
+        """Takes the oldest spooled entries as the batch to send, committed
+        once written. Returns False if the spool is empty."""
+        entries = self._spool.read(self._max_bytes)
+        if not entries:
+            return False
+        self._unsent = entries
+        self._unsent_spooled = len(entries)
+        return True
 
-    def send(self, entry):
+    def send(self, entry, flow=None):
         """Sends the entry given. Depending on transport configuration it will
         block until the entry is sent or it will queue the entry for async
-        send.
+        send. The entry is queued to the flow of its log if given.
 
         Note: entry must end with a new line
         """
+        if self._enqueue(entry, flow) and self._pool:
+            self._pool.schedule(self)
+
+    def flow(self, name, share=1, priority=0):
+        """Returns the transport for entries of the log with the name given.
+        Logs sharing the transport take turns in proportion to their share;
+        logs of higher priority are sent first and dropped last."""
+        return TransportFlow(self, self._entries.flow(name, share, priority))
+
+    def _spooled(self):
+        """Returns the size of spooled entries not taken for writing yet."""
+        # Entries taken are not pending any more if their segment has been
+        # dropped meanwhile
+        return max(self._spool.pending() - self._unsent_spooled, 0)
+
+    def _enqueue(self, entry, flow=None):
+        """Queues or spools the entry. Returns False if it has been dropped."""
+        if self._spool and (self._down or self._spooled()):
+            # Once spooled, entries are sent from the spool until it drains
+            # to keep them in order
+            if self._spool.append(entry):
+                return True
+        if self._entries.put(entry, flow):
+            if self._entries.dropped_entries != self._drops_reported:
+                self._report_drops()
+            return True
+        if self._overflow == sendqueue.OVERFLOW_SPILL:
+            if self._spool.append(entry):
+                return True
+            self._entries.discard(entry, flow)
+        self._report_drops()
+        return False
+
+    def _report_drops(self):
+        """Logs the number of entries dropped so far, at most once per
+        QUEUE_DROP_REPORT_INTERVAL."""
+        now = time.time()
+        if now - self._drops_report_time < QUEUE_DROP_REPORT_INTERVAL:
+            return
+        self._drops_report_time = now
+        self._drops_reported = self._entries.dropped_entries
+        flows = ', '.join('%s: %d' % (flow.name, flow.dropped_entries)
+                          for flow in self._entries.flows() if flow.name and flow.dropped_entries)
+        if flows:
+            flows = ' (%s)' % flows
+        log.warning("Send queue for %s:%s is full, %d events (%d bytes) dropped so far%s",
+                    self.endpoint, self.port, self._entries.dropped_entries,
+                    self._entries.dropped_bytes, flows)
+
+    def queued(self):
+        """Returns the size in bytes of entries waiting to be sent."""
+        return self._entries.size()
+
+    def unsent(self):
+        """Returns the size in bytes of entries queued or being sent.
+        Spooled entries are not counted."""
+        return self._entries.size() + len(self._unsent) - self._unsent_spooled
+
+    def drained(self):
+        """Returns True if all entries queued have been sent."""
+        return not self.unsent()
+
+    def stats(self):
+        """Returns counters and gauges of the transport. Bytes sent are
+        counted before compression, wire bytes after. Times are totals in
+        seconds, of writes of batches and of connection setup."""
+        entries = self._entries
+        stats = {
+            'name': self.name,
+            'connected': int(self._socket is not None),
+            'queued': entries.size(),
+            'queue_high_water': entries.high_water,
+            'in_entries': entries.queued_entries,
+            'in_bytes': entries.queued_bytes,
+            'dropped_entries': entries.dropped_entries,
+            'dropped_bytes': entries.dropped_bytes,
+            'sent_bytes': self._sent_bytes,
+            'wire_bytes': self._wire_bytes,
+            'batches': self._batches,
+            'send_time': self._send_time,
+            'connects': self._connects,
+            'connect_time': self._connect_time,
+            'spooled_bytes': 0,
+            'spool_pending': 0,
+            'spool_lost_entries': 0,
+        }
+        if self._spool:
+            stats['spooled_bytes'] = self._spool.appended_bytes
+            stats['spool_pending'] = self._spool.pending()
+            stats['spool_lost_entries'] = self._spool.evicted_events
+        return stats
+
+    def close(self, left=None):
+        """Stops sending. Entries left unsent are spooled if possible, the
+        number of bytes spooled and the number of lines and bytes abandoned are
+        added to the counter given. Use `drained' to wait for entries queued
+        before."""
+        self._shutdown = True
+        self._entries.close()
+        if self._worker:
+            self._worker.join(1.5)
+        if self._entries.dropped_entries != self._drops_reported:
+            self._drops_report_time = 0
+            self._report_drops()
+        if not self._pool:
+            # Pools do so once their threads have stopped
+            self._abandon(left)
+
+    def _abandon(self, left=None):
+        """Spools entries left unsent, or counts them as abandoned. See
+        `close'."""
+        if left is None:
+            left = collections.Counter()
+        if self._unconfirmed:
+            self._check_closed()
+        entries = []
+        # Spooled entries not written stay in the spool
+        unsent = self._unsent[:len(self._unsent) - self._unsent_spooled]
+        if unsent:
+            entries.append(unsent)
+        self._unsent = ''
+        self._unsent_spooled = 0
         while True:
             try:
-                self._entries.put_nowait(entry)
+                entries.append(self._entries.get_nowait())
+            except Queue.Empty:
                 break
-            except Queue.Full:
+        for entry in entries:
+            # Spooled after entries spooled before; the order is kept
+            # within the queue only
+            if self._spool and self._spool.append(entry):
+                left['spooled'] += len(entry)
+            else:
+                left['abandoned lines'] += entry.count('\n')
+                left['abandoned'] += len(entry)
+        if self._spool:
+            self._spool.close()
+
+    def _collect_batch(self, entry):
+        """Returns the entry given joined with entries queued after it, up to
+        the maximal batch size. Waits for more entries up to the maximal
+        linger time if the batch is not full."""
+        batch = [entry]
+        size = len(entry)
+        deadline = None
+        while size < self._max_bytes:
+            try:
+                entry = self._entries.get_nowait()
+            except Queue.Empty:
+                if self._max_linger <= 0 or self._shutdown:
+                    break
+                if deadline is None:
+                    deadline = time.time() + self._max_linger
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
                 try:
-                    self._entries.get_nowait()
+                    entry = self._entries.get(True, remaining)
                 except Queue.Empty:
-                    pass
+                    break
+            batch.append(entry)
+            size += len(entry)
+        if len(batch) == 1:
+            return batch[0]
+        return ''.join(batch)
+
+    def _send_batch(self, block):
+        """Sends a batch of queued entries, or of spooled entries once the
+        queue is empty. If block is set, waits a while for an entry. Returns
+        False if there was nothing to send."""
+        # Spooled entries are newer than those in the queue
+        if self._spool and self._entries.empty() and not self._unsent and self._spooled():
+            self._replay()
+        if not self._unsent:
+            try:
+                entry = self._entries.get(block, 1)
+            except Queue.Empty:
+                return False
+            self._unsent = self._collect_batch(entry)
+        self._send_unsent()
+        return True
 
-    def close(self):
-        self._shutdown = True
-        self._worker.join(1.5)
+    def pending(self):
+        """Returns True if there are entries waiting to be sent."""
+        return not self._entries.empty() or bool(self._spool and self._spool.pending())
+
+    def service(self):
+        """Connects if needed and sends a batch of entries. Called by the
+        pool."""
+        if not self._socket:
+            self._open_connection()
+        if not self._shutdown:
+            self._send_batch(False)
+
+    def disconnect(self):
+        """Closes the connection and the spool. Called by the pool."""
+        if self._unconfirmed:
+            self._check_closed()
+        self._close_connection()
+        if self._spool:
+            self._spool.close()
 
     def run(self):
         """When run with backgroud thread it collects entries from internal
-        queue and sends them to destination."""
+        queue and sends them to destination. Entries queued meanwhile are
+        sent in one write."""
         self._open_connection()
         while not self._shutdown:
             try:
-                entry = self._entries.get(True, 1)
-                self._send_entry(entry)
-            except Queue.Empty:
-                pass
+                self._send_batch(True)
             except Exception:
                 log.error("Exception in run: {0}".format(traceback.format_exc()))
+        self.disconnect()
+
+
+class AsyncTransport(Transport):
+
+    """Transport driven by the event loop. Connecting, proxy negotiation, TLS
+    handshake and writes are non-blocking steps run by the loop, no thread is
+    needed. Entries are sent in batches like with the threaded transport;
+    lingering for more entries is done with a timer. Transports of a pool
+    take turns on its connections."""
+
+    def __init__(self, loop, endpoint, port, use_ssl, preamble, debug_transport_events, proxy,
+                 pool=None, channel=0, compress=False):
+        self._loop = loop
+        # Plain or wrapped socket being connected
+        self._conn = None
+        self._connected = False
+        self._retry = None
+        self._retry_delay = SRV_RECON_TO_MIN
+        self._linger = None
+        self._linger_delay = 0
+        self._writing = False
+        self._write_soon = False
+        self._connect_started = 0
+        self._batch_started = 0
+        # Batch being written, as sent over the connection, and whether it
+        # comes from the spool
+        self._batch = ''
+        self._out = ''
+        self._out_pos = 0
+        self._out_spooled = False
+        # Proxy or preamble exchange in progress
+        self._request = ''
+        self._reply = ''
+        self._reply_check = None
+        self._exchanged = None
+        Transport.__init__(self, endpoint, port, use_ssl, preamble, debug_transport_events, proxy,
+                           pool, channel, compress)
+        # Lingering is done by `_kick', batches are collected without waiting
+        self._linger_delay = self._max_linger
+        self._max_linger = 0
+
+    def _start(self):
+        if self._pool:
+            self._pool.add(self)
+        else:
+            self._loop.call_soon(self.service)
+
+    def _watch(self, on_read=None, on_write=None):
+        """Sets callbacks of the connection socket, None removes them."""
+        fd = self._conn.fileno()
+        if on_read:
+            self._loop.add_reader(fd, on_read)
+        else:
+            self._loop.remove_reader(fd)
+        if on_write:
+            self._loop.add_writer(fd, on_write)
+        else:
+            self._loop.remove_writer(fd)
+
+    def _open_connection(self):
+        """Starts connecting. The outcome is handled by `_connect_done'."""
+        self._retry = None
+        if self._shutdown or self._conn:
+            return
+        if self._pool and not self._pool.acquire(self):
+            # The pool gives us a turn once a connection is released
+            return
+        log.debug("Opening connection %s:%s %s",
+                  self.endpoint, self.port, self.preamble.strip())
+        self._connect_started = time.time()
+        try:
+            address = self._resolve_target()
+        except socket.error, e:
+            log.debug("Can't resolve %s: %s", self._target()[0], e)
+            self._failed()
+            return
+        try:
+            self._conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._conn.setblocking(0)
+            err = self._conn.connect_ex((address, self._target()[1]))
+        except socket.error, e:
+            err = e.args[0]
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            log.debug("Can't connect to %s at port %s: %s", self.endpoint, self.port, os.strerror(err))
+            self._failed(failover=self._connect_failed())
+            return
+        self._watch(None, self._connect_done)
+
+    def _connect_done(self):
+        err = self._conn.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            log.debug("Can't connect to %s at port %s: %s", self.endpoint, self.port, os.strerror(err))
+            self._failed(failover=self._connect_failed())
+            return
+        dns_cache.connected(*self._target())
+        self._watch()
+        if not self._use_proxy:
+            self._start_ssl()
+        elif self._proxy_type == socks.PROXY_TYPE_HTTP:
+            self._exchange("CONNECT %s:%s HTTP/1.1\r\nHost: %s\r\n\r\n" %
+                           (self.endpoint, self.port, self.endpoint),
+                           self._http_proxy_reply, self._start_ssl)
+        elif self._proxy_type == socks.PROXY_TYPE_SOCKS4:
+            # SOCKS4a, the proxy resolves the endpoint
+            self._exchange(struct.pack('>BBH', 0x04, 0x01, self.port) + '\x00\x00\x00\x01\x00' +
+                           self.endpoint + '\x00',
+                           self._socks4_reply, self._start_ssl)
+        else:
+            self._exchange('\x05\x01\x00', self._socks5_auth_reply, self._socks5_connect)
+
+    def _socks5_connect(self):
+        self._exchange('\x05\x01\x00\x03' + chr(len(self.endpoint)) + self.endpoint +
+                       struct.pack('>H', self.port),
+                       self._socks5_reply, self._start_ssl)
+
+    @staticmethod
+    def _http_proxy_reply(reply):
+        if '\r\n\r\n' not in reply:
+            return False
+        status = reply.split('\r\n', 1)[0].split(' ', 2)
+        if len(status) < 2 or status[0] not in ('HTTP/1.0', 'HTTP/1.1') or status[1] != '200':
+            raise socks.HTTPError('Proxy refused connection: %s' % reply.split('\r\n', 1)[0])
+        return True
+
+    @staticmethod
+    def _socks4_reply(reply):
+        if len(reply) < 8:
+            return False
+        if reply[0] != '\x00' or reply[1] != '\x5a':
+            raise socks.Socks4Error('Proxy refused connection: %d' % ord(reply[1]))
+        return True
+
+    @staticmethod
+    def _socks5_auth_reply(reply):
+        if len(reply) < 2:
+            return False
+        if reply != '\x05\x00':
+            raise socks.Socks5AuthError('Proxy requires authentication')
+        return True
+
+    @staticmethod
+    def _socks5_reply(reply):
+        if len(reply) < 5:
+            return False
+        if reply[0] != '\x05' or reply[1] != '\x00':
+            raise socks.Socks5Error('Proxy refused connection: %d' % ord(reply[1]))
+        # Bound address follows, its length depends on the address type
+        size = {'\x01': 4, '\x03': 1 + ord(reply[4]), '\x04': 16}.get(reply[3])
+        if size is None:
+            raise socks.GeneralProxyError('Invalid proxy reply')
+        return len(reply) >= 4 + size + 2
+
+    def _exchange(self, request, check_reply, then):
+        """Writes the request, then reads the reply until check_reply accepts
+        it, and continues with then. If check_reply is None, the reply is not
+        awaited."""
+        self._request = request
+        self._reply = ''
+        self._reply_check = check_reply
+        self._exchanged = then
+        self._watch(None, self._write_request)
+
+    def _write_request(self):
+        try:
+            sent = self._send_some(self._request)
+        except (socket.error, IOError), e:
+            self._failed("Can't connect to %s at port %s: %s" % (self.endpoint, self.port, e))
+            return
+        self._request = self._request[sent:]
+        if self._request:
+            return
+        if self._reply_check:
+            self._watch(self._read_reply)
+        else:
+            self._watch()
+            self._exchanged()
+
+    def _read_reply(self):
+        try:
+            data = self._conn.recv(4096)
+            if not data:
+                raise socket.error('Connection closed by proxy')
+            self._reply += data
+            if not self._reply_check(self._reply):
+                return
+        except (socket.error, socks.ProxyError), e:
+            if e.args and e.args[0] in (errno.EAGAIN, errno.EINTR):
+                return
+            self._failed("Can't connect to %s at port %s via proxy: %s" % (self.endpoint, self.port, e))
+            return
+        self._watch()
+        self._exchanged()
+
+    def _start_ssl(self):
+        if not self.use_ssl:
+            self._established()
+            return
+        try:
+            self._conn = self._wrap_ssl(self._conn, False)
+        except (socket.error, IOError), e:
+            self._failed("Can't connect to %s via SSL at port %s: %s" % (self.endpoint, self.port, e))
+            return
+        self._handshake()
+
+    def _handshake(self):
+        try:
+            self._conn.do_handshake()
+        except ssl.SSLError, e:
+            if e.args[0] == ssl.SSL_ERROR_WANT_READ:
+                self._watch(self._handshake)
+                return
+            if e.args[0] == ssl.SSL_ERROR_WANT_WRITE:
+                self._watch(None, self._handshake)
+                return
+            self._failed("Can't connect to %s via SSL at port %s. Make sure that the host and port are "
+                         "reachable and speak SSL: %s" % (self.endpoint, self.port, e))
+            return
+        except (socket.error, IOError), e:
+            self._failed("Can't connect to %s via SSL at port %s. Make sure that the host and port are "
+                         "reachable and speak SSL: %s" % (self.endpoint, self.port, e))
+            return
+        self._watch()
+        try:
+            match_hostname(self._conn.getpeercert(), self.endpoint)
+        except CertificateError, ce:
+            self._failed("Could not validate SSL certificate for %s: %s" % (self.endpoint, ce.message))
+            return
+        self._established()
+
+    def _established(self):
+        self._start_stream()
+        if self.preamble:
+            self._exchange(self._encode(self.preamble), None, self._ready)
+        else:
+            self._ready()
+
+    def _ready(self):
+        self._socket = self._conn
+        self._connected = True
+        self._down = False
+        self._retry_delay = SRV_RECON_TO_MIN
+        self._connects += 1
+        self._connect_time += time.time() - self._connect_started
+        if self._batch:
+            # The batch interrupted is sent again over the new stream
+            self._out = self._encode(self._batch)
+            self._out_pos = 0
+        # Detect connections closed by the remote side
+        self._watch(self._readable)
+        self._kick()
+
+    def _failed(self, reason=None, failover=False):
+        """Closes the connection and tries again later, or right away with
+        the next address if failover is set. The reason is reported if
+        given."""
+        if reason and not self._shutdown:
+            report(reason)
         self._close_connection()
+        self._down = True
+        # Unsent batch is sent again in full over the new connection
+        self._out_pos = 0
+        if self._shutdown or self._retry:
+            return
+        if failover:
+            self._retry = self._loop.call_later(0, self._open_connection)
+        else:
+            self._retry = self._loop.call_later(self._retry_delay, self._open_connection)
+            self._retry_delay = min(self._retry_delay * 2, SRV_RECON_TO_MAX)
+
+    def _close_connection(self):
+        if self._conn:
+            self._watch()
+            try:
+                self._conn.close()
+            except socket.error:
+                pass
+            self._conn = None
+            self._socket = None
+        if self._pool:
+            self._pool.release(self)
+        self._connected = False
+        self._writing = False
+
+    def _readable(self):
+        try:
+            data = self._conn.recv(4096)
+        except ssl.SSLError, e:
+            if e.args[0] in (ssl.SSL_ERROR_WANT_READ, ssl.SSL_ERROR_WANT_WRITE):
+                return
+            self._failed("Connection to %s:%s failed: %s" % (self.endpoint, self.port, e))
+            return
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EINTR):
+                return
+            self._failed("Connection to %s:%s failed: %s" % (self.endpoint, self.port, e))
+            return
+        if not data:
+            log.debug("Connection %s:%s closed by the remote side", self.endpoint, self.port)
+            self._failed()
+
+    def _send_some(self, data):
+        """Writes data to the socket. Returns the number of bytes written, 0
+        if the socket is not writable."""
+        try:
+            return self._conn.send(data)
+        except ssl.SSLError, e:
+            if e.args[0] in (ssl.SSL_ERROR_WANT_READ, ssl.SSL_ERROR_WANT_WRITE):
+                return 0
+            raise
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EINTR):
+                return 0
+            raise
+
+    def _next_batch(self):
+        """Loads the next batch to write. Returns False if there is none."""
+        # Spooled entries are newer than those in the queue
+        if self._spool and self._entries.empty():
+            self._batch = self._spool.read(self._max_bytes)
+            self._out_spooled = True
+        else:
+            try:
+                self._batch = self._collect_batch(self._entries.get_nowait())
+            except Queue.Empty:
+                self._batch = ''
+            self._out_spooled = False
+        self._out = self._encode(self._batch) if self._batch else ''
+        self._out_pos = 0
+        self._batch_started = time.time()
+        return bool(self._out)
+
+    def _write(self):
+        """Writes batches until the socket would block or there is nothing
+        left to write."""
+        try:
+            for _ in xrange(ASYNC_MAX_BATCHES):
+                if not self._out and not self._next_batch():
+                    break
+                while self._out_pos < len(self._out):
+                    sent = self._send_some(buffer(self._out, self._out_pos))
+                    if not sent:
+                        break
+                    self._out_pos += sent
+                if self._out_pos < len(self._out):
+                    break
+                if self._out_spooled:
+                    self._spool.commit(len(self._batch))
+                self._sent(self._batch, self._out, self._batch_started)
+                self._batch = ''
+                self._out = ''
+        except (socket.error, IOError), e:
+            self._failed("Connection to %s:%s failed: %s" % (self.endpoint, self.port, e))
+            return
+        if self._pool:
+            self._pool.used(self)
+            if not self._connected:
+                return
+        writing = bool(self._out) or self.pending()
+        if writing != self._writing:
+            self._writing = writing
+            self._watch(self._readable, self._write if writing else None)
+
+    def _kick(self):
+        """Starts writing unless it is in progress."""
+        if not self._loop.in_loop():
+            self._loop.call_soon(self._kick)
+            return
+        if self._shutdown:
+            return
+        if not self._connected:
+            if not self._conn and not self._retry:
+                self._open_connection()
+            return
+        if self._writing:
+            return
+        if self._linger_delay > 0 and not self._out and self._entries.size() < self._max_bytes \
+                and not (self._spool and self._spool.pending()):
+            if not self._linger:
+                self._linger = self._loop.call_later(self._linger_delay, self._write_queued)
+            return
+        if self._entries.size() >= self._max_bytes:
+            self._write()
+        elif not self._write_soon:
+            # Entries queued in the same turn of the loop are written together
+            self._write_soon = True
+            self._loop.call_soon(self._write_queued)
+
+    def _write_queued(self):
+        self._linger = None
+        self._write_soon = False
+        if not self._connected:
+            self._kick()
+        elif not self._writing:
+            self._write()
+
+    def send(self, entry, flow=None):
+        if self._enqueue(entry, flow):
+            self._kick()
+
+    def idle(self):
+        """Returns True if the connection is open and nothing is being
+        written."""
+        return self._connected and not self._writing and not self._out and not self.pending()
+
+    def service(self):
+        """Connects if needed and writes pending entries."""
+        self._kick()
+
+    def unsent(self):
+        if self._out_spooled:
+            # Still in the spool
+            return self._entries.size()
+        return self._entries.size() + len(self._batch)
+
+    def close(self, left=None):
+        self._shutdown = True
+        self._entries.close()
+        for timer in (self._retry, self._linger):
+            if timer:
+                timer.cancel()
+        if self._entries.dropped_entries != self._drops_reported:
+            self._drops_report_time = 0
+            self._report_drops()
+        if not self._out_spooled:
+            self._unsent = self._batch
+        self._batch = self._out = ''
+        if not self._pool:
+            self._abandon(left)
+            self.disconnect()
+
+
+class TransportFlow(object):
+
+    """Sends entries of one log over a transport shared with other logs.
+    See `Transport.flow'."""
+
+    def __init__(self, transport, flow):
+        self._transport = transport
+        self._flow = flow
+
+    def send(self, entry):
+        self._transport.send(entry, self._flow)
+
+    def queued(self):
+        return self._transport.queued()
+
+
+class TransportPool(object):
+
+    """Sends entries of many transports with a fixed number of threads and
+    a bounded number of connections. Transports are serviced in turns, one
+    batch at a time. Transports connect on their first turn; when all
+    connections are in use, the connection used least recently is closed
+    once it has been held for POOL_CONNECTION_HOLD, so that transports
+    taking turns do not reconnect for every batch. Transports added while
+    there are free connections connect right away, in the thread adding
+    them, so that they connect in the order logs are followed. If the event
+    loop is given, transports are driven by the loop instead of threads and
+    only take turns on connections."""
+
+    def __init__(self, workers, max_connections, loop=None):
+        self._max_connections = max(max_connections, 1)
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        # Transports waiting for a turn
+        self._queue = collections.deque()
+        # Transports being serviced or waiting for a turn
+        self._scheduled = set()
+        # Transports being serviced
+        self._active = set()
+        # Connected transports and times they connected, least recently
+        # used first
+        self._connected = collections.OrderedDict()
+        self._transports = []
+        self._shutdown = False
+        self._workers = []
+        self._loop = loop
+        # Transports waiting for a connection in the event loop mode
+        self._waiting = collections.deque()
+        self._retry = None
+        if loop:
+            return
+        for n in xrange(max(min(workers, self._max_connections), 1)):
+            worker = threading.Thread(target=self.run, name='transport-%d' % n)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def add(self, transport):
+        with self._lock:
+            self._transports.append(transport)
+            connect = len(self._connected) + len(self._scheduled) < self._max_connections
+            if connect and not self._loop:
+                self._connected[transport] = time.time()
+        if connect and self._loop:
+            self._loop.call_soon(transport.service)
+        elif connect and not transport.connect():
+            # Workers keep trying
+            self.schedule(transport)
+
+    def schedule(self, transport):
+        """Gives the transport a turn unless it already has one."""
+        with self._lock:
+            if transport not in self._scheduled:
+                self._scheduled.add(transport)
+                self._queue.append(transport)
+                self._ready.notify()
+
+    def _held(self, transport, now):
+        """Returns True if the transport has held its connection long enough
+        to give it up."""
+        return now - self._connected[transport] >= POOL_CONNECTION_HOLD
+
+    def _hold_delay(self, now):
+        """Returns seconds until the first connection held can be given up,
+        None if there is none still held."""
+        delays = [connected + POOL_CONNECTION_HOLD - now for connected in self._connected.itervalues()
+                  if connected + POOL_CONNECTION_HOLD > now]
+        if not delays:
+            return None
+        return min(delays)
+
+    def _next(self):
+        """Returns the next transport waiting for a turn which is connected
+        or can connect now, closing the connection used least recently and
+        held long enough if needed. Returns None if all transports waiting
+        have to wait for a connection. Called with the lock held."""
+        now = time.time()
+        for transport in self._queue:
+            if transport in self._connected:
+                break
+            if len(self._connected) < self._max_connections:
+                self._connected[transport] = now
+                break
+            idle = [t for t in self._connected if t not in self._active and self._held(t, now)]
+            if idle:
+                del self._connected[idle[0]]
+                idle[0]._close_connection()
+                self._connected[transport] = now
+                break
+        else:
+            return None
+        self._queue.remove(transport)
+        return transport
+
+    def acquire(self, transport):
+        """Reserves a connection for the transport in the event loop mode,
+        closing the idle connection used least recently and held long enough
+        if needed. Returns False if all connections are busy or held; the
+        transport is serviced once a connection is released."""
+        if transport in self._connected:
+            return True
+        now = time.time()
+        while len(self._connected) >= self._max_connections:
+            idle = [t for t in self._connected if t.idle() and self._held(t, now)]
+            if not idle:
+                if transport not in self._waiting:
+                    self._waiting.append(transport)
+                self._retry_later(now)
+                return False
+            idle[0]._close_connection()
+        self._connected[transport] = now
+        return True
+
+    def _retry_later(self, now):
+        """Gives waiting transports another turn once a connection held can
+        be given up."""
+        delay = self._hold_delay(now)
+        if delay is not None and not self._retry:
+            self._retry = self._loop.call_later(delay, self._retry_waiting)
+
+    def _retry_waiting(self):
+        self._retry = None
+        for _ in xrange(len(self._waiting)):
+            waiting = self._waiting.popleft()
+            if waiting not in self._scheduled:
+                self._scheduled.add(waiting)
+                self._loop.call_soon(self._service, waiting)
+
+    def used(self, transport):
+        """Marks the connection of the transport as used most recently. If
+        other transports wait for a connection and the transport has held
+        its connection long enough, it ends its turn and waits for another
+        one if it has more to send."""
+        if transport not in self._connected:
+            return
+        self._connected[transport] = self._connected.pop(transport)
+        if self._waiting and not transport._out and self._held(transport, time.time()):
+            transport._close_connection()
+            if transport.pending():
+                self._waiting.append(transport)
+
+    def release(self, transport):
+        """Frees the connection reserved for the transport."""
+        self._connected.pop(transport, None)
+        while self._waiting and len(self._connected) + len(self._scheduled) < self._max_connections:
+            waiting = self._waiting.popleft()
+            self._scheduled.add(waiting)
+            self._loop.call_soon(self._service, waiting)
+
+    def _service(self, transport):
+        self._scheduled.discard(transport)
+        transport.service()
+
+    def run(self):
+        while not self._shutdown:
+            with self._lock:
+                transport = None
+                while not self._shutdown:
+                    transport = self._next()
+                    if transport:
+                        break
+                    delay = self._hold_delay(time.time())
+                    self._ready.wait(min(delay or 1, 1))
+                if self._shutdown:
+                    break
+                self._active.add(transport)
+            try:
+                transport.service()
+            except Exception:
+                log.error("Exception in run: {0}".format(traceback.format_exc()))
+            with self._lock:
+                self._active.discard(transport)
+                if transport in self._connected:
+                    # Most recently used
+                    self._connected[transport] = self._connected.pop(transport)
+                if transport.pending() and not self._shutdown:
+                    self._queue.append(transport)
+                else:
+                    self._scheduled.discard(transport)
+                # Its connection may be given up now
+                self._ready.notify()
+
+    def unsent(self):
+        return sum(transport.unsent() for transport in self._transports)
+
+    def drained(self):
+        return all(transport.drained() for transport in self._transports)
+
+    def stats(self):
+        """Returns counters of all transports of the pool together."""
+        stats = {'name': 'pool', 'transports': len(self._transports)}
+        for transport in self._transports:
+            for key, value in transport.stats().iteritems():
+                if key == 'name':
+                    stats[key] = 'pool %s' % value
+                elif key == 'queue_high_water':
+                    stats[key] = max(stats.get(key, 0), value)
+                else:
+                    stats[key] = stats.get(key, 0) + value
+        return stats
+
+    def close(self, left=None):
+        for transport in self._transports:
+            transport.close()
+        with self._lock:
+            self._shutdown = True
+            self._ready.notify_all()
+        for worker in self._workers:
+            worker.join(1.5)
+        for transport in self._transports:
+            transport._abandon(left)
+            transport.disconnect()
 
 
 class DefaultTransport(object):
 
-    def __init__(self, xconfig):
-        self._transport = None
+    """Transport of token-based logs and metrics. It may use several
+    connections in parallel; entries of a log are always sent over the same
+    connection to keep them in order. If the event loop is given, the
+    connections are driven by the loop."""
+
+    def __init__(self, xconfig, loop=None):
+        self._transports = []
         self._config = xconfig
+        self._loop = loop
 
-    def get(self):
-        if not self._transport:
+    def get(self, key=''):
+        """Returns the transport for entries of the log with the key (token)
+        given."""
+        if not self._transports:
             use_ssl = not self._config.suppress_ssl
+            compress = False
             if self._config.datahub:
                 endpoint = self._config.datahub_ip
                 port = self._config.datahub_port
+                compress = self._config.datahub_compression == COMPRESSION_DEFLATE
             else:
                 endpoint = Domain.DATA
                 if use_ssl:
@@ -1704,23 +4577,54 @@ class DefaultTransport(object):
                 endpoint = Domain.LOCAL
                 port = 10000
                 use_ssl = False
-            self._transport = Transport(
-                endpoint, port, use_ssl, '', self._config.debug_transport_events,
-                (self._config.proxy_type, self._config.proxy_url, self._config.proxy_port))
-        return self._transport
+            connections = self._config.data_connections
+            if connections == NOT_SET:
+                connections = DATA_CONNECTIONS
+            proxy = (self._config.proxy_type, self._config.proxy_url, self._config.proxy_port)
+            for channel in xrange(max(connections, 1)):
+                if self._loop:
+                    transport = AsyncTransport(self._loop, endpoint, port, use_ssl, '',
+                                               self._config.debug_transport_events, proxy,
+                                               channel=channel, compress=compress)
+                else:
+                    transport = Transport(endpoint, port, use_ssl, '', self._config.debug_transport_events,
+                                          proxy, channel=channel, compress=compress)
+                self._transports.append(transport)
+        if len(self._transports) == 1:
+            return self._transports[0]
+        return self._transports[(zlib.crc32(key) & 0xffffffff) % len(self._transports)]
 
-    def close(self):
-        if self._transport:
-            self._transport.close()
+    def unsent(self):
+        return sum(transport.unsent() for transport in self._transports)
+
+    def drained(self):
+        return all(transport.drained() for transport in self._transports)
+
+    def transports(self):
+        """Returns the transports created so far."""
+        return list(self._transports)
+
+    def close(self, left=None):
+        for transport in self._transports:
+            transport.close(left)
 
 
 class ConfiguredLog(object):
 
-    def __init__(self, name, token, destination, path):
+    def __init__(self, name, token, destination, path, backfill=NOT_SET,
+                 multiline_start=NOT_SET, multiline_timeout=NOT_SET, priority=NOT_SET, share=NOT_SET,
+                 rate_limit_lines=NOT_SET, rate_limit_bytes=NOT_SET):
         self.name = name
         self.token = token
         self.destination = destination
         self.path = path
+        self.backfill = backfill
+        self.multiline_start = multiline_start
+        self.multiline_timeout = multiline_timeout
+        self.priority = priority
+        self.share = share
+        self.rate_limit_lines = rate_limit_lines
+        self.rate_limit_bytes = rate_limit_bytes
         self.logset = None
         self.set_key = None
         self.log_key = None
@@ -1746,8 +4650,30 @@ class Config(object):
         self.datahub = NOT_SET
         self.datahub_ip = NOT_SET
         self.datahub_port = NOT_SET
+        self.datahub_compression = NOT_SET
         self.system_stats_token = NOT_SET
         self.pull_server_side_config = NOT_SET
+        self.follower_threads = NOT_SET
+        self.max_catch_up = NOT_SET
+        self.send_max_bytes = NOT_SET
+        self.send_max_linger = NOT_SET
+        self.spool_size = NOT_SET
+        self.queue_size = NOT_SET
+        self.queue_overflow = NOT_SET
+        self.memory_budget = NOT_SET
+        self.pool_workers = NOT_SET
+        self.pool_connections = NOT_SET
+        self.data_connections = NOT_SET
+        self.runtime = NOT_SET
+        self.rate_limit_lines = NOT_SET
+        self.rate_limit_bytes = NOT_SET
+        self.rate_limit_mode = NOT_SET
+        self.shutdown_timeout = NOT_SET
+        self.partial_line_timeout = NOT_SET
+        self.long_lines = NOT_SET
+        self.max_open_files = NOT_SET
+        self.idle_file_timeout = NOT_SET
+        self.backfill = NOT_SET
         self.configured_logs = []
         self.metrics = metrics.MetricsConfig()
 
@@ -1858,12 +4784,33 @@ class Config(object):
                 FORCE_DOMAIN_PARAM: '',
                 USE_CA_PROVIDED_PARAM: '',
                 DATAHUB_PARAM: '',
+                DATAHUB_COMPRESSION_PARAM: '',
                 SYSSTAT_TOKEN_PARAM: '',
                 HOSTNAME_PARAM: '',
                 PULL_SERVER_SIDE_CONFIG_PARAM: 'True',
                 PROXY_TYPE_PARAM: '',
                 PROXY_URL_PARAM: '',
                 PROXY_PORT_PARAM: '',
+                FOLLOWER_THREADS_PARAM: '',
+                MAX_CATCH_UP_PARAM: '',
+                SEND_MAX_BYTES_PARAM: '',
+                SEND_MAX_LINGER_PARAM: '',
+                SPOOL_SIZE_PARAM: '',
+                QUEUE_SIZE_PARAM: '',
+                QUEUE_OVERFLOW_PARAM: '',
+                MEMORY_BUDGET_PARAM: '',
+                POOL_WORKERS_PARAM: '',
+                POOL_CONNECTIONS_PARAM: '',
+                DATA_CONNECTIONS_PARAM: '',
+                RUNTIME_PARAM: '',
+                RATE_LIMIT_LINES_PARAM: '',
+                RATE_LIMIT_BYTES_PARAM: '',
+                RATE_LIMIT_MODE_PARAM: '',
+                SHUTDOWN_TIMEOUT_PARAM: '',
+                PARTIAL_LINE_TIMEOUT_PARAM: '',
+                LONG_LINES_PARAM: '',
+                MAX_OPEN_FILES_PARAM: '',
+                IDLE_FILE_TIMEOUT_PARAM: '',
             })
             conf.read(self.config_filename)
 
@@ -1914,6 +4861,175 @@ class Config(object):
                 else:
                     self.proxy_port = int(proxy_port)
 
+            if self.follower_threads == NOT_SET:
+                follower_threads = conf.get(MAIN_SECT, FOLLOWER_THREADS_PARAM)
+                if follower_threads:
+                    self.follower_threads = parse_count(follower_threads)
+                    if self.follower_threads is None:
+                        log.warning("Invalid %s `%s', expected a number of threads of at least 1", FOLLOWER_THREADS_PARAM, follower_threads)
+                        self.follower_threads = NOT_SET
+            if self.max_catch_up == NOT_SET:
+                max_catch_up = conf.get(MAIN_SECT, MAX_CATCH_UP_PARAM)
+                if max_catch_up:
+                    self.max_catch_up = parse_size(max_catch_up)
+                    if self.max_catch_up is None:
+                        log.warning("Invalid %s `%s', using default", MAX_CATCH_UP_PARAM, max_catch_up)
+                        self.max_catch_up = NOT_SET
+            if self.send_max_bytes == NOT_SET:
+                send_max_bytes = conf.get(MAIN_SECT, SEND_MAX_BYTES_PARAM)
+                if send_max_bytes:
+                    self.send_max_bytes = parse_size(send_max_bytes)
+                    if self.send_max_bytes is None:
+                        log.warning("Invalid %s `%s', using default", SEND_MAX_BYTES_PARAM, send_max_bytes)
+                        self.send_max_bytes = NOT_SET
+            if self.send_max_linger == NOT_SET:
+                send_max_linger = conf.get(MAIN_SECT, SEND_MAX_LINGER_PARAM)
+                if send_max_linger:
+                    try:
+                        self.send_max_linger = float(send_max_linger)
+                    except ValueError:
+                        log.warning("Invalid %s `%s', using default", SEND_MAX_LINGER_PARAM, send_max_linger)
+            if self.spool_size == NOT_SET:
+                spool_size = conf.get(MAIN_SECT, SPOOL_SIZE_PARAM)
+                if spool_size:
+                    self.spool_size = parse_size(spool_size)
+                    if self.spool_size is None:
+                        log.warning("Invalid %s `%s', spool disabled", SPOOL_SIZE_PARAM, spool_size)
+                        self.spool_size = NOT_SET
+            if self.queue_size == NOT_SET:
+                queue_size = conf.get(MAIN_SECT, QUEUE_SIZE_PARAM)
+                if queue_size:
+                    self.queue_size = parse_size(queue_size)
+                    if self.queue_size is None:
+                        log.warning("Invalid %s `%s', using default", QUEUE_SIZE_PARAM, queue_size)
+                        self.queue_size = NOT_SET
+            if self.memory_budget == NOT_SET:
+                memory_budget = conf.get(MAIN_SECT, MEMORY_BUDGET_PARAM)
+                if memory_budget:
+                    self.memory_budget = parse_size(memory_budget)
+                    if self.memory_budget is None:
+                        log.warning("Invalid %s `%s', using default", MEMORY_BUDGET_PARAM, memory_budget)
+                        self.memory_budget = NOT_SET
+            if self.queue_overflow == NOT_SET:
+                queue_overflow = conf.get(MAIN_SECT, QUEUE_OVERFLOW_PARAM)
+                if queue_overflow:
+                    if queue_overflow in sendqueue.OVERFLOW_MODES:
+                        self.queue_overflow = queue_overflow
+                    else:
+                        log.warning("Invalid %s `%s', expected one of %s", QUEUE_OVERFLOW_PARAM,
+                                    queue_overflow, ', '.join(sendqueue.OVERFLOW_MODES))
+            if self.pool_workers == NOT_SET:
+                pool_workers = conf.get(MAIN_SECT, POOL_WORKERS_PARAM)
+                if pool_workers:
+                    self.pool_workers = parse_count(pool_workers)
+                    if self.pool_workers is None:
+                        log.warning("Invalid %s `%s', expected a number of workers of at least 1", POOL_WORKERS_PARAM, pool_workers)
+                        self.pool_workers = NOT_SET
+            if self.pool_connections == NOT_SET:
+                pool_connections = conf.get(MAIN_SECT, POOL_CONNECTIONS_PARAM)
+                if pool_connections:
+                    self.pool_connections = parse_count(pool_connections)
+                    if self.pool_connections is None:
+                        log.warning("Invalid %s `%s', expected a number of connections of at least 1", POOL_CONNECTIONS_PARAM, pool_connections)
+                        self.pool_connections = NOT_SET
+            if self.data_connections == NOT_SET:
+                data_connections = conf.get(MAIN_SECT, DATA_CONNECTIONS_PARAM)
+                if data_connections:
+                    self.data_connections = parse_count(data_connections)
+                    if self.data_connections is None:
+                        log.warning("Invalid %s `%s', expected a number of connections of at least 1", DATA_CONNECTIONS_PARAM, data_connections)
+                        self.data_connections = NOT_SET
+            if self.runtime == NOT_SET:
+                runtime = conf.get(MAIN_SECT, RUNTIME_PARAM)
+                if runtime:
+                    if runtime in RUNTIMES:
+                        self.runtime = runtime
+                    else:
+                        log.warning("Invalid %s `%s', expected one of %s", RUNTIME_PARAM,
+                                    runtime, ', '.join(RUNTIMES))
+            if self.rate_limit_lines == NOT_SET:
+                rate_limit_lines = conf.get(MAIN_SECT, RATE_LIMIT_LINES_PARAM)
+                if rate_limit_lines:
+                    self.rate_limit_lines = parse_rate_limit_lines(rate_limit_lines)
+                    if self.rate_limit_lines is None:
+                        log.warning("Invalid %s `%s', expected lines per second",
+                                    RATE_LIMIT_LINES_PARAM, rate_limit_lines)
+                        self.rate_limit_lines = NOT_SET
+            if self.rate_limit_bytes == NOT_SET:
+                rate_limit_bytes = conf.get(MAIN_SECT, RATE_LIMIT_BYTES_PARAM)
+                if rate_limit_bytes:
+                    self.rate_limit_bytes = parse_size(rate_limit_bytes)
+                    if not self.rate_limit_bytes:
+                        log.warning("Invalid %s `%s', expected bytes per second",
+                                    RATE_LIMIT_BYTES_PARAM, rate_limit_bytes)
+                        self.rate_limit_bytes = NOT_SET
+            if self.rate_limit_mode == NOT_SET:
+                rate_limit_mode = conf.get(MAIN_SECT, RATE_LIMIT_MODE_PARAM)
+                if rate_limit_mode:
+                    if rate_limit_mode in ratelimit.RATE_LIMIT_MODES:
+                        self.rate_limit_mode = rate_limit_mode
+                    else:
+                        log.warning("Invalid %s `%s', expected one of %s", RATE_LIMIT_MODE_PARAM,
+                                    rate_limit_mode, ', '.join(ratelimit.RATE_LIMIT_MODES))
+            if self.shutdown_timeout == NOT_SET:
+                shutdown_timeout = conf.get(MAIN_SECT, SHUTDOWN_TIMEOUT_PARAM)
+                if shutdown_timeout:
+                    try:
+                        self.shutdown_timeout = float(shutdown_timeout)
+                        if self.shutdown_timeout < 0:
+                            raise ValueError
+                    except ValueError:
+                        log.warning("Invalid %s `%s', expected seconds", SHUTDOWN_TIMEOUT_PARAM,
+                                    shutdown_timeout)
+                        self.shutdown_timeout = NOT_SET
+            if self.partial_line_timeout == NOT_SET:
+                partial_line_timeout = conf.get(MAIN_SECT, PARTIAL_LINE_TIMEOUT_PARAM)
+                if partial_line_timeout:
+                    try:
+                        self.partial_line_timeout = float(partial_line_timeout)
+                        if self.partial_line_timeout < 0:
+                            raise ValueError
+                    except ValueError:
+                        log.warning("Invalid %s `%s', expected seconds", PARTIAL_LINE_TIMEOUT_PARAM,
+                                    partial_line_timeout)
+                        self.partial_line_timeout = NOT_SET
+            if self.long_lines == NOT_SET:
+                long_lines = conf.get(MAIN_SECT, LONG_LINES_PARAM)
+                if long_lines:
+                    if long_lines in LONG_LINES:
+                        self.long_lines = long_lines
+                    else:
+                        log.warning("Invalid %s `%s', expected one of %s", LONG_LINES_PARAM,
+                                    long_lines, ', '.join(LONG_LINES))
+            if self.max_open_files == NOT_SET:
+                max_open_files = conf.get(MAIN_SECT, MAX_OPEN_FILES_PARAM)
+                if max_open_files:
+                    try:
+                        self.max_open_files = int(max_open_files)
+                        if self.max_open_files < 1:
+                            raise ValueError
+                    except ValueError:
+                        log.warning("Invalid %s `%s', expected number of files",
+                                    MAX_OPEN_FILES_PARAM, max_open_files)
+                        self.max_open_files = NOT_SET
+            if self.idle_file_timeout == NOT_SET:
+                idle_file_timeout = conf.get(MAIN_SECT, IDLE_FILE_TIMEOUT_PARAM)
+                if idle_file_timeout:
+                    try:
+                        self.idle_file_timeout = float(idle_file_timeout)
+                        if self.idle_file_timeout < 0:
+                            raise ValueError
+                    except ValueError:
+                        log.warning("Invalid %s `%s', expected seconds", IDLE_FILE_TIMEOUT_PARAM,
+                                    idle_file_timeout)
+                        self.idle_file_timeout = NOT_SET
+            if self.queue_overflow == sendqueue.OVERFLOW_SPILL and self.spool_size == NOT_SET:
+                log.warning("%s = %s requires %s, dropping oldest events instead",
+                            QUEUE_OVERFLOW_PARAM, self.queue_overflow, SPOOL_SIZE_PARAM)
+            if self.queue_overflow == sendqueue.OVERFLOW_BLOCK and self.runtime == RUNTIME_EVENT_LOOP:
+                log.warning("%s = %s cannot be used with %s = %s, dropping oldest events instead",
+                            QUEUE_OVERFLOW_PARAM, self.queue_overflow, RUNTIME_PARAM, self.runtime)
+
             if self.proxy_type != NOT_SET and self.proxy_url != NOT_SET and self.proxy_port != NOT_SET:
                 self.use_proxy = True
             else:
@@ -1928,6 +5044,14 @@ class Config(object):
             if self.datahub == NOT_SET:
                 self.set_datahub_settings(
                     conf.get(MAIN_SECT, DATAHUB_PARAM), should_die=False)
+            if self.datahub_compression == NOT_SET:
+                datahub_compression = conf.get(MAIN_SECT, DATAHUB_COMPRESSION_PARAM)
+                if datahub_compression:
+                    if datahub_compression in COMPRESSIONS:
+                        self.datahub_compression = datahub_compression
+                    else:
+                        log.warning("Invalid %s `%s', expected one of %s", DATAHUB_COMPRESSION_PARAM,
+                                    datahub_compression, ', '.join(COMPRESSIONS))
             if self.system_stats_token == NOT_SET:
                 system_stats_token_str = conf.get(
                     MAIN_SECT, SYSSTAT_TOKEN_PARAM)
@@ -1964,6 +5088,16 @@ class Config(object):
                     token_param = TOKEN_PARAM + str(n) if appendN else TOKEN_PARAM
                     path_param = PATH_PARAM + str(n) if appendN else PATH_PARAM
                     destination_param = DESTINATION_PARAM + str(n) if appendN else DESTINATION_PARAM
+                    backfill_param = BACKFILL_PARAM + str(n) if appendN else BACKFILL_PARAM
+                    multiline_param = MULTILINE_PARAM + str(n) if appendN else MULTILINE_PARAM
+                    multiline_timeout_param = MULTILINE_TIMEOUT_PARAM + str(n) if appendN \
+                        else MULTILINE_TIMEOUT_PARAM
+                    priority_param = PRIORITY_PARAM + str(n) if appendN else PRIORITY_PARAM
+                    share_param = SHARE_PARAM + str(n) if appendN else SHARE_PARAM
+                    rate_limit_lines_param = RATE_LIMIT_LINES_PARAM + str(n) if appendN \
+                        else RATE_LIMIT_LINES_PARAM
+                    rate_limit_bytes_param = RATE_LIMIT_BYTES_PARAM + str(n) if appendN \
+                        else RATE_LIMIT_BYTES_PARAM
                     token = ''
                     try:
                         xtoken = conf.get(name, token_param)
@@ -1987,7 +5121,89 @@ class Config(object):
                         destination = conf.get(name, destination_param)
                     except ConfigParser.NoOptionError:
                         pass
-                    configured_log = ConfiguredLog(name, token, destination, path)
+                    backfill = NOT_SET
+                    try:
+                        xbackfill = conf.get(name, backfill_param)
+                        if xbackfill:
+                            if parse_backfill(xbackfill) is None:
+                                log.warning("Invalid %s `%s' in section `%s'.", backfill_param, xbackfill, name)
+                            else:
+                                backfill = xbackfill
+                    except ConfigParser.NoOptionError:
+                        pass
+                    multiline_start = NOT_SET
+                    try:
+                        xmultiline = conf.get(name, multiline_param, raw=True)
+                        if xmultiline:
+                            try:
+                                re.compile(xmultiline)
+                                multiline_start = xmultiline
+                            except re.error, e:
+                                log.warning("Invalid %s `%s' in section `%s': %s", multiline_param,
+                                            xmultiline, name, e)
+                    except ConfigParser.NoOptionError:
+                        pass
+                    multiline_timeout = NOT_SET
+                    try:
+                        xmultiline_timeout = conf.get(name, multiline_timeout_param)
+                        if xmultiline_timeout:
+                            try:
+                                multiline_timeout = float(xmultiline_timeout)
+                            except ValueError:
+                                log.warning("Invalid %s `%s' in section `%s'.", multiline_timeout_param,
+                                            xmultiline_timeout, name)
+                    except ConfigParser.NoOptionError:
+                        pass
+                    priority = NOT_SET
+                    try:
+                        xpriority = conf.get(name, priority_param)
+                        if xpriority:
+                            try:
+                                priority = int(xpriority)
+                            except ValueError:
+                                log.warning("Invalid %s `%s' in section `%s'.", priority_param,
+                                            xpriority, name)
+                    except ConfigParser.NoOptionError:
+                        pass
+                    share = NOT_SET
+                    try:
+                        xshare = conf.get(name, share_param)
+                        if xshare:
+                            try:
+                                share = float(xshare)
+                                if share <= 0:
+                                    raise ValueError
+                            except ValueError:
+                                share = NOT_SET
+                                log.warning("Invalid %s `%s' in section `%s'.", share_param,
+                                            xshare, name)
+                    except ConfigParser.NoOptionError:
+                        pass
+                    rate_limit_lines = NOT_SET
+                    try:
+                        xrate_limit_lines = conf.get(name, rate_limit_lines_param)
+                        if xrate_limit_lines:
+                            rate_limit_lines = parse_rate_limit_lines(xrate_limit_lines)
+                            if rate_limit_lines is None:
+                                rate_limit_lines = NOT_SET
+                                log.warning("Invalid %s `%s' in section `%s'.", rate_limit_lines_param,
+                                            xrate_limit_lines, name)
+                    except ConfigParser.NoOptionError:
+                        pass
+                    rate_limit_bytes = NOT_SET
+                    try:
+                        xrate_limit_bytes = conf.get(name, rate_limit_bytes_param)
+                        if xrate_limit_bytes:
+                            rate_limit_bytes = parse_size(xrate_limit_bytes)
+                            if not rate_limit_bytes:
+                                rate_limit_bytes = NOT_SET
+                                log.warning("Invalid %s `%s' in section `%s'.", rate_limit_bytes_param,
+                                            xrate_limit_bytes, name)
+                    except ConfigParser.NoOptionError:
+                        pass
+                    configured_log = ConfiguredLog(name, token, destination, path, backfill,
+                                                   multiline_start, multiline_timeout, priority, share,
+                                                   rate_limit_lines, rate_limit_bytes)
                     self.configured_logs.append(configured_log)
                     appendLog(n + 1)
                 appendLog(1)
@@ -2025,6 +5241,48 @@ class Config(object):
                          self.pull_server_side_config)
             if self.datahub != NOT_SET:
                 conf.set(MAIN_SECT, DATAHUB_PARAM, self.datahub)
+            if self.datahub_compression != NOT_SET:
+                conf.set(MAIN_SECT, DATAHUB_COMPRESSION_PARAM, self.datahub_compression)
+            if self.follower_threads != NOT_SET:
+                conf.set(MAIN_SECT, FOLLOWER_THREADS_PARAM, str(self.follower_threads))
+            if self.max_catch_up != NOT_SET:
+                conf.set(MAIN_SECT, MAX_CATCH_UP_PARAM, str(self.max_catch_up))
+            if self.send_max_bytes != NOT_SET:
+                conf.set(MAIN_SECT, SEND_MAX_BYTES_PARAM, str(self.send_max_bytes))
+            if self.send_max_linger != NOT_SET:
+                conf.set(MAIN_SECT, SEND_MAX_LINGER_PARAM, str(self.send_max_linger))
+            if self.spool_size != NOT_SET:
+                conf.set(MAIN_SECT, SPOOL_SIZE_PARAM, str(self.spool_size))
+            if self.queue_size != NOT_SET:
+                conf.set(MAIN_SECT, QUEUE_SIZE_PARAM, str(self.queue_size))
+            if self.queue_overflow != NOT_SET:
+                conf.set(MAIN_SECT, QUEUE_OVERFLOW_PARAM, self.queue_overflow)
+            if self.memory_budget != NOT_SET:
+                conf.set(MAIN_SECT, MEMORY_BUDGET_PARAM, str(self.memory_budget))
+            if self.pool_workers != NOT_SET:
+                conf.set(MAIN_SECT, POOL_WORKERS_PARAM, str(self.pool_workers))
+            if self.pool_connections != NOT_SET:
+                conf.set(MAIN_SECT, POOL_CONNECTIONS_PARAM, str(self.pool_connections))
+            if self.data_connections != NOT_SET:
+                conf.set(MAIN_SECT, DATA_CONNECTIONS_PARAM, str(self.data_connections))
+            if self.runtime != NOT_SET:
+                conf.set(MAIN_SECT, RUNTIME_PARAM, self.runtime)
+            if self.rate_limit_lines != NOT_SET:
+                conf.set(MAIN_SECT, RATE_LIMIT_LINES_PARAM, str(self.rate_limit_lines))
+            if self.rate_limit_bytes != NOT_SET:
+                conf.set(MAIN_SECT, RATE_LIMIT_BYTES_PARAM, str(self.rate_limit_bytes))
+            if self.rate_limit_mode != NOT_SET:
+                conf.set(MAIN_SECT, RATE_LIMIT_MODE_PARAM, self.rate_limit_mode)
+            if self.shutdown_timeout != NOT_SET:
+                conf.set(MAIN_SECT, SHUTDOWN_TIMEOUT_PARAM, '%g' % self.shutdown_timeout)
+            if self.partial_line_timeout != NOT_SET:
+                conf.set(MAIN_SECT, PARTIAL_LINE_TIMEOUT_PARAM, '%g' % self.partial_line_timeout)
+            if self.long_lines != NOT_SET:
+                conf.set(MAIN_SECT, LONG_LINES_PARAM, self.long_lines)
+            if self.max_open_files != NOT_SET:
+                conf.set(MAIN_SECT, MAX_OPEN_FILES_PARAM, str(self.max_open_files))
+            if self.idle_file_timeout != NOT_SET:
+                conf.set(MAIN_SECT, IDLE_FILE_TIMEOUT_PARAM, '%g' % self.idle_file_timeout)
             if self.system_stats_token != NOT_SET:
                 conf.set(
                     MAIN_SECT, SYSSTAT_TOKEN_PARAM, self.system_stats_token)
@@ -2036,6 +5294,20 @@ class Config(object):
                 conf.set(clog.name, PATH_PARAM, clog.path)
                 if clog.destination:
                     conf.set(clog.name, DESTINATION_PARAM, clog.destination)
+                if clog.backfill != NOT_SET:
+                    conf.set(clog.name, BACKFILL_PARAM, clog.backfill)
+                if clog.multiline_start != NOT_SET:
+                    conf.set(clog.name, MULTILINE_PARAM, clog.multiline_start.replace('%', '%%'))
+                if clog.multiline_timeout != NOT_SET:
+                    conf.set(clog.name, MULTILINE_TIMEOUT_PARAM, str(clog.multiline_timeout))
+                if clog.priority != NOT_SET:
+                    conf.set(clog.name, PRIORITY_PARAM, str(clog.priority))
+                if clog.share != NOT_SET:
+                    conf.set(clog.name, SHARE_PARAM, '%g' % clog.share)
+                if clog.rate_limit_lines != NOT_SET:
+                    conf.set(clog.name, RATE_LIMIT_LINES_PARAM, str(clog.rate_limit_lines))
+                if clog.rate_limit_bytes != NOT_SET:
+                    conf.set(clog.name, RATE_LIMIT_BYTES_PARAM, str(clog.rate_limit_bytes))
 
             self.metrics.save(conf)
 
@@ -2185,7 +5457,7 @@ class Config(object):
                     debug-stats-only debug-cmds debug-system help version yes force uuid list
                     std std-all name= hostname= type= pid-file= debug no-defaults
                     suppress-ssl use-ca-provided force-api-host= force-domain=
-                    system-stat-token= datahub= pull-server-side-config= config="""
+                    system-stat-token= datahub= pull-server-side-config= config= backfill="""
         try:
             optlist, args = getopt.gnu_getopt(params, '', param_list.split())
         except getopt.GetoptError, err:
@@ -2275,6 +5547,11 @@ class Config(object):
                 self.pull_server_side_config = value == "True"
             elif name == "--datahub":
                 self.set_datahub_settings(value)
+            elif name == "--backfill":
+                if parse_backfill(value) is None:
+                    die("Cannot parse %s for --backfill. Expected `%s', size with unit, e.g. 500M, or time, e.g. 03:00" %
+                        (value, BACKFILL_START))
+                self.backfill = value
 
         if self.datahub_ip and not self.datahub_port:
             if self.suppress_ssl:
@@ -2292,6 +5569,15 @@ class Config(object):
 
 config = Config()
 
+# Memory budget of transport queues, see get_memory_budget
+memory_budget = None
+
+# Addresses of endpoints resolved by transports
+dns_cache = dnscache.DnsCache(DNS_CACHE_TTL)
+
+# SSL contexts of transports by CA certificates file, see get_ssl_context
+ssl_contexts = {}
+
 
 def do_request(conn, operation, addr, data=None, headers={}):
     log.debug('Domain request: %s %s %s %s', operation, addr, data, headers)
@@ -2536,6 +5822,48 @@ def get_cache_filename():
     return os.path.join(cache_dir, CACHE_NAME)
 
 
+def get_memory_budget():
+    """Returns the memory budget shared by queues of all transports.
+    """
+    global memory_budget
+    if not memory_budget:
+        limit = config.memory_budget
+        if limit == NOT_SET:
+            limit = MEMORY_BUDGET
+        memory_budget = sendqueue.MemoryBudget(limit)
+    return memory_budget
+
+
+def get_ssl_context(ca_certs):
+    """Returns the SSL context of transports verifying certificates against
+    the CA certificates file given, None if this Python has no SSL contexts.
+    Certificates are loaded once, not on every connection.
+    """
+    if not FEAT_SSL_CONTEXT:
+        return None
+    context = ssl_contexts.get(ca_certs)
+    if not context:
+        context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        context.options |= ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3
+        context.verify_mode = ssl.CERT_REQUIRED
+        context.load_verify_locations(ca_certs)
+        context.set_ciphers(SSL_CIPHERS)
+        ssl_contexts[ca_certs] = context
+    return context
+
+
+def get_offsets_filename():
+    """Gets full filename of saved offsets of followed files.
+    """
+    return os.path.join(get_cache_dir(), OFFSETS_NAME)
+
+
+def get_status_filename():
+    """Gets full filename of the status of the agent.
+    """
+    return os.path.join(get_cache_dir(), STATUS_NAME)
+
+
 def load_cache():
     """Loads or creates cache.
     """
@@ -2784,7 +6112,21 @@ def get_filters(available_filters, filter_filenames, log_name, log_key, log_file
     return event_filter
 
 
-def start_followers(default_transport):
+def get_rate_limit(name, lines, size, parent):
+    """
+    Returns the rate limit of the log with the limits given, the limit of all
+    logs if the log has none.
+    """
+    if lines == NOT_SET and size == NOT_SET:
+        return parent
+    mode = config.rate_limit_mode
+    if mode == NOT_SET:
+        mode = ratelimit.RATE_LIMIT_DELAY
+    return ratelimit.RateLimit(name, lines if lines != NOT_SET else None,
+                               size if size != NOT_SET else None, mode, parent)
+
+
+def start_followers(default_transport, reactor):
     """
     Loads logs from the server (or configuration) and initializes followers.
     """
@@ -2792,6 +6134,7 @@ def start_followers(default_transport):
     logs = []
     followers = []
     transports = []
+    pool = None
 
     if config.pull_server_side_config:
         # Use LE server as the source for list of followed logs
@@ -2820,7 +6163,10 @@ def start_followers(default_transport):
         # returned by LE Server.
         logs.append(
             {'type': 'token', 'name': log_name, 'filename': log_path, 'key': '', 'token': log_token,
-                     'follow': 'true'})
+                     'follow': 'true', 'backfill': cl.backfill,
+                     'multiline_start': cl.multiline_start, 'multiline_timeout': cl.multiline_timeout,
+                     'priority': cl.priority, 'share': cl.share,
+                     'rate_limit_lines': cl.rate_limit_lines, 'rate_limit_bytes': cl.rate_limit_bytes})
 
     available_filters = {}
     filter_filenames = default_filter_filenames
@@ -2853,6 +6199,9 @@ def start_followers(default_transport):
                       config.formatters, sys.exc_info()[1])
             log.error('Details: %s', traceback.print_exc(sys.exc_info()))
 
+    # Limit of all logs, if any
+    rate_limit = get_rate_limit('all logs', config.rate_limit_lines, config.rate_limit_bytes, None)
+
     # Start followers
     for l in logs:
         # Note! Token-type logs have follow param == false by default, so we need to
@@ -2864,6 +6213,18 @@ def start_followers(default_transport):
             log_token = ''
             if l['type'] == 'token':
                 log_token = l['token']
+            log_backfill = l.get('backfill', NOT_SET)
+            if log_backfill == NOT_SET:
+                log_backfill = config.backfill
+            if log_backfill != NOT_SET:
+                log_backfill = parse_backfill(log_backfill)
+            log_rate_limit = get_rate_limit(log_name, l.get('rate_limit_lines', NOT_SET),
+                                            l.get('rate_limit_bytes', NOT_SET), rate_limit)
+            log_multiline = None
+            if l.get('multiline_start', NOT_SET) != NOT_SET:
+                log_multiline = [l['multiline_start'], l.get('multiline_timeout', NOT_SET)]
+                if log_multiline[1] == NOT_SET:
+                    log_multiline[1] = MULTILINE_TIMEOUT
 
             # Do not start a follower for a log with absent filepath.
             if not check_file_name(log_filename):
@@ -2885,7 +6246,15 @@ def start_followers(default_transport):
                 else:
                     log.error("Ignoring unknown default_formatter %s, using syslog format instead", config.formatter)
                     default_formatter = formatters.FormatSyslog(config.hostname, log_name, log_token)
-                transport = default_transport.get()
+                log_priority = l.get('priority', NOT_SET)
+                if log_priority == NOT_SET:
+                    log_priority = 0
+                log_share = l.get('share', NOT_SET)
+                if log_share == NOT_SET:
+                    log_share = 1
+                # Logs sharing the connection take turns
+                transport = default_transport.get(log_token or log_name).flow(
+                    log_token or log_name, log_share, log_priority)
             elif log_key:
                 endpoint = Domain.API
                 port = 443
@@ -2901,9 +6270,23 @@ def start_followers(default_transport):
                 preamble = 'PUT /%s/hosts/%s/%s/?realtime=1 HTTP/1.0\r\n\r\n' % (
                     config.user_key, config.agent_key, log_key)
                 default_formatter = formatters.FormatPlain('')
-                transport = Transport(endpoint, port, use_ssl, preamble, config.debug_transport_events,
-                                      (config.proxy_type, config.proxy_url, config.proxy_port))
-                transports.append(transport)
+                if not pool:
+                    # Logs identified by key share connections and threads
+                    pool_workers = config.pool_workers
+                    if pool_workers == NOT_SET:
+                        pool_workers = POOL_WORKERS
+                    pool_connections = config.pool_connections
+                    if pool_connections == NOT_SET:
+                        pool_connections = POOL_CONNECTIONS
+                    pool = TransportPool(pool_workers, pool_connections, reactor.loop)
+                    transports.append(pool)
+                proxy = (config.proxy_type, config.proxy_url, config.proxy_port)
+                if reactor.loop:
+                    transport = AsyncTransport(reactor.loop, endpoint, port, use_ssl, preamble,
+                                               config.debug_transport_events, proxy, pool)
+                else:
+                    transport = Transport(endpoint, port, use_ssl, preamble, config.debug_transport_events,
+                                          proxy, pool)
             else:
                 continue
 
@@ -2911,8 +6294,14 @@ def start_followers(default_transport):
                                              log_name, log_key, log_filename,
                                              log_token)
 
-            # Instantiate the follower
-            follower = Follower(log_filename, entry_filter, entry_formatter, transport)
+            # Instantiate the follower, glob patterns fan out to all matches
+            if glob.has_magic(log_filename):
+                follower = GlobFollower(log_filename, entry_filter, entry_formatter, transport, reactor,
+                                        log_backfill, log_multiline, log_rate_limit)
+            else:
+                follower = Follower(log_filename, entry_filter, entry_formatter, transport, reactor,
+                                    backfill=log_backfill, multiline_event=log_multiline,
+                                    rate_limit=log_rate_limit)
             followers.append(follower)
     return (followers, transports)
 
@@ -2952,6 +6341,15 @@ def create_configured_logs(configured_logs):
     save_cache(cache)
 
 
+def terminate(signum, frame):
+    """Shuts the agent down on SIGTERM as on interrupt."""
+    if eventloop.current:
+        # Callbacks of the loop are not interrupted
+        eventloop.current.stop()
+    else:
+        raise KeyboardInterrupt
+
+
 def cmd_monitor(args):
     """Monitors host activity and sends events collected to logentries
     infrastructure.
@@ -2973,45 +6371,94 @@ def cmd_monitor(args):
     if config.daemon:
         daemonize()
 
+    # All tasks but resource monitoring run in one event loop if configured
+    loop = None
+    if config.runtime == RUNTIME_EVENT_LOOP:
+        loop = eventloop.EventLoop()
+        eventloop.current = loop
+
     # Start default transport channel
-    default_transport = DefaultTransport(config)
+    default_transport = DefaultTransport(config, loop)
 
     # Register resource monitoring
     if config.agent_key != NOT_SET:
         stats = Stats()
         stats.start()
+    try:
+        status = AgentStatus(get_status_filename(), STATUS_SAVE_INTERVAL)
+    except OSError, e:
+        log.warning("Cannot save status of the agent, consider adjusting XDG_CACHE_HOME: %s", e)
+        status = AgentStatus(None, STATUS_SAVE_INTERVAL)
     formatter = formatters.FormatSyslog(config.hostname, 'le',
                                         config.metrics.token)
     smetrics = metrics.Metrics(config.metrics, default_transport,
-                                formatter, config.debug_metrics)
+                                formatter, config.debug_metrics, status)
     smetrics.start()
 
     followers = []
     transports = []
+    reactor = None
     try:
         # Load logs to follow and start following them
         if not config.debug_stats_only:
-            (followers, transports) = start_followers(default_transport)
-
-        # Park this thread
-        while True:
-            time.sleep(600)  # FIXME: is there a better way?
+            follower_threads = config.follower_threads
+            if follower_threads == NOT_SET:
+                follower_threads = FOLLOWER_THREADS
+            try:
+                registry = OffsetRegistry(get_offsets_filename(), OFFSETS_SAVE_INTERVAL)
+                registry.start()
+            except OSError, e:
+                log.warning("Cannot keep offsets of followed files, consider adjusting XDG_CACHE_HOME: %s", e)
+                registry = None
+            reactor = FollowerReactor(inotify.create_watcher(loop), registry, follower_threads, loop)
+            (followers, transports) = start_followers(default_transport, reactor)
+        status.watch(transports, default_transport, reactor)
+        status.start()
+
+        signal.signal(signal.SIGTERM, terminate)
+        if loop:
+            loop.run()
+        else:
+            # Park this thread
+            while True:
+                time.sleep(600)  # FIXME: is there a better way?
     except KeyboardInterrupt:
         pass
 
     print >> sys.stderr, "\nShutting down"
+    # The deadline bounds the shutdown, further signals are ignored
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    shutdown_timeout = config.shutdown_timeout
+    if shutdown_timeout == NOT_SET:
+        shutdown_timeout = SHUTDOWN_TIMEOUT
+    deadline = time.time() + shutdown_timeout
     # Stop metrics
     if stats:
         stats.cancel()
     if smetrics:
         smetrics.cancel()
-    # Close followers
-    for follower in followers:
-        follower.close()
-    # Close transports
+    status.cancel()
+    # Close followers, lines read are queued
+    if reactor:
+        reactor.close()
+    # Send what is queued, spool the rest
+    transports.append(default_transport)
+    unsent = sum(transport.unsent() for transport in transports)
+    drained = lambda: all(transport.drained() for transport in transports)
+    if loop:
+        loop.run_until(drained, deadline, SHUTDOWN_POLL)
+    else:
+        while not drained() and time.time() < deadline:
+            time.sleep(SHUTDOWN_POLL)
+    left = collections.Counter()
     for transport in transports:
-        transport.close()
-    default_transport.close()
+        transport.close(left)
+    delivered = max(unsent - left['spooled'] - left['abandoned'], 0)
+    if left['abandoned']:
+        log.warning("Shut down, %d bytes delivered, %d bytes spooled, %d events (%d bytes) abandoned",
+                    delivered, left['spooled'], left['abandoned lines'], left['abandoned'])
+    else:
+        log.info("Shut down, %d bytes delivered, %d bytes spooled", delivered, left['spooled'])
 
 
 def cmd_monitor_daemon(args):
@@ -10,6 +10,7 @@ import time
 import traceback
 import uuid
 
+import eventloop
 import formatters
 from utils import report
 from __init__ import __version__
@@ -38,6 +39,7 @@ NET = 'net'
 DISK = 'disk'
 SPACE = 'space'
 PROCESS = 'process'
+AGENT = 'agent'
 
 
 def _psutil_cpu_count():
@@ -343,6 +345,66 @@ class NetMetrics(object):
             self._last = counters
 
 
+class AgentMetrics(object):
+
+    """Collecting metrics of the agent itself, throughput and health of its
+    transports as reported by the agent status."""
+
+    def __init__(self, selection, interval, status, transport, formatter):
+        xselection = set(selection.split())
+        self._sum = 'sum' in xselection
+        self._all = 'all' in xselection
+        self._interval = interval
+        self._status = status
+        self._transport = transport
+        self._formatter = formatter
+        self._last = None
+
+    def _construct(self, name, curr, last, lag, lag_seconds):
+        in_bytes = curr['in_bytes'] - last['in_bytes']
+        sent_bytes = curr['sent_bytes'] - last['sent_bytes']
+        batches = curr['batches'] - last['batches']
+        latency = 0.0
+        if batches:
+            latency = (curr['send_time'] - last['send_time']) / batches * 1000
+        line = 'transport=%s in_bytes=%d sent_bytes=%d wire_bytes=%d sent_rate=%.1f dropped_entries=%d dropped_bytes=%d spooled_bytes=%d spool_pending=%d connects=%d queued=%d queue_high_water=%d latency_ms=%.1f max_lag=%d max_lag_seconds=%.1f\n' % (
+                quote(name), in_bytes, sent_bytes,
+                curr['wire_bytes'] - last['wire_bytes'],
+                float(sent_bytes) / self._interval,
+                curr['dropped_entries'] - last['dropped_entries'],
+                curr['dropped_bytes'] - last['dropped_bytes'],
+                curr['spooled_bytes'] - last['spooled_bytes'],
+                curr['spool_pending'], curr['connects'] - last['connects'],
+                curr['queued'], curr['queue_high_water'], latency, lag, lag_seconds)
+        self._transport.send(self._formatter.format_line(line, msgid='agent'))
+
+    @staticmethod
+    def _sum_of(transports):
+        xsum = {}
+        for stats in transports:
+            for key, value in stats.iteritems():
+                if key == 'queue_high_water':
+                    xsum[key] = max(xsum.get(key, 0), value)
+                elif isinstance(value, (int, long, float)) and not isinstance(value, bool):
+                    xsum[key] = xsum.get(key, 0) + value
+        return xsum
+
+    def collect(self):
+        status = self._status.snapshot()
+        curr = dict((stats['name'], stats) for stats in status['transports'])
+        curr['sum'] = self._sum_of(status['transports'])
+        lag = max([f['lag'] for f in status['files']] or [0])
+        lag_seconds = max([f['lag_seconds'] for f in status['files']] or [0])
+        if self._last:
+            if self._sum:
+                self._construct('sum', curr['sum'], self._last['sum'], lag, lag_seconds)
+            if self._all:
+                for name in curr:
+                    if name != 'sum' and name in self._last:
+                        self._construct(name, curr[name], self._last[name], lag, lag_seconds)
+        self._last = curr
+
+
 class ProcMetrics(object):
 
     """Collecting process metrics."""
@@ -429,8 +491,9 @@ class Metrics(object):
 
     """Metrics collecting class."""
 
-    def __init__(self, conf, default_transport, formatter, debug):
-        """Creates an instance of metrics from the configuration."""
+    def __init__(self, conf, default_transport, formatter, debug, status=None):
+        """Creates an instance of metrics from the configuration. Status, if
+        given, is the agent status reported by agent metrics."""
         self._ready = False
         if not psutil_available:
             if debug:
@@ -450,12 +513,14 @@ class Metrics(object):
         self._formatter = formatter
         self._debug = debug
 
+        self._lock = threading.Lock()
         self._timer = None
         self._shutdown = False
         self._interval = self._parse_interval(conf.interval)
         if self._interval == 0:
             report("Warning: Cannot instantiate metrics, invalid interval `%s'." % conf.interval)
 
+        self._status = status
         self._items = self._instantiate(conf)
         self._ready = True
 
@@ -503,6 +568,11 @@ class Metrics(object):
             items.append(DiskSpaceMetrics(conf.space, self._interval, self._transport, self._formatter))
         if conf.net:
             items.append(NetMetrics(conf.net, self._interval, self._transport, self._formatter))
+        if conf.agent:
+            if set(conf.agent.split()) <= set(['sum', 'all']) and self._status:
+                items.append(AgentMetrics(conf.agent, self._interval, self._status, self._transport, self._formatter))
+            else:
+                report("Unrecognized agent option `%s', `sum' or `all' expected" % conf.agent)
 
         for process in conf.processes:
             items.append(ProcMetrics(process[0], process[1], process[2], self._interval, self._transport, self._formatter))
@@ -513,10 +583,9 @@ class Metrics(object):
         # TODO - align metrics on time boundary
         ethalon += self._interval
         next_step = (ethalon - time.time()) % self._interval
-        if not self._shutdown:
-            self._timer = threading.Timer(next_step, self._collect_metrics, ())
-            self._timer.daemon = True
-            self._timer.start()
+        with self._lock:
+            if not self._shutdown:
+                self._timer = eventloop.start_timer(next_step, self._collect_metrics)
 
     def _collect_metrics(self):
         ethalon = time.time()
@@ -545,10 +614,11 @@ class Metrics(object):
 
     def cancel(self):
         if self._ready:
-            self._shutdown = True
-            t = self._timer
+            with self._lock:
+                self._shutdown = True
+                t = self._timer
             if t:
-                t.cancel()
+                eventloop.stop_timer(t)
 
 
 class StderrTransport(object):
@@ -588,6 +658,8 @@ class MetricsConfig(object):
         self.token = '' # Avoid pylint error
         for item in self.DEFAULTS:
             self.__dict__[item] = self.DEFAULTS[item]
+        # Not a default, configurations saved before stay unchanged
+        self.agent = ''
         self.processes = []
 
     def load(self, conf):
@@ -598,6 +670,10 @@ class MetricsConfig(object):
                 self.__dict__[item] = conf.get(SECT, PREFIX + item)
             except ConfigParser.NoOptionError:
                 pass
+        try:
+            self.agent = conf.get(SECT, PREFIX + AGENT)
+        except ConfigParser.NoOptionError:
+            pass
         # Process metrics
         for section in conf.sections():
             if section != SECT:
@@ -616,6 +692,8 @@ class MetricsConfig(object):
         # Basic metrics
         for item in self.DEFAULTS:
             conf.set(SECT, PREFIX + item, self.__dict__[item])
+        if self.agent:
+            conf.set(SECT, PREFIX + AGENT, self.agent)
         # Process metrics
         for process in self.processes:
             try:
@@ -0,0 +1,82 @@
+# coding: utf-8
+# vim: set ts=4 sw=4 et:
+
+import re
+import time
+
+__author__ = 'Logentries'
+
+__all__ = ['MultilineAssembler', 'LINE_SEPARATOR']
+
+
+# Lines of an event are joined with Unicode line separator (UTF-8 encoded),
+# Logentries displays them as a single multi-line event
+LINE_SEPARATOR = u'\u2028'.encode('utf-8')
+
+
+class MultilineAssembler(object):
+
+    """Joins continuation lines, such as lines of stack traces, with the line
+    which starts the event. Lines matching the start pattern start a new
+    event. The last event is held back until the next event starts or until
+    no line has been added for the timeout given."""
+
+    def __init__(self, start_pattern, timeout, max_size):
+        self._start = re.compile(start_pattern)
+        self._timeout = timeout
+        self._max_size = max_size
+        self._pending = []
+        # Size of the event held back and of its lines in the file
+        self._pending_size = 0
+        self._pending_bytes = 0
+        self._updated = 0
+
+    def feed(self, block, flush=False, head=0, tail=0):
+        """Returns complete events of the block of lines given, one event per
+        line. If flush is set, the held back event is returned as well. Head
+        and tail are numbers of bytes the caller added at the beginning and
+        the end of the block, such as markers, which are not in the file."""
+        if block.endswith('\n'):
+            block = block[:-1]
+        events = []
+        if block:
+            lines = block.split('\n')
+            for i, line in enumerate(lines):
+                if self._pending and (self._start.match(line) or
+                                      self._pending_size + len(LINE_SEPARATOR) + len(line) >= self._max_size):
+                    events.append(self._take())
+                if self._pending:
+                    self._pending_size += len(LINE_SEPARATOR)
+                self._pending.append(line)
+                self._pending_size += len(line)
+                self._pending_bytes += len(line) + 1
+                if i == 0:
+                    self._pending_bytes -= head
+                if i == len(lines) - 1:
+                    self._pending_bytes -= tail
+            self._updated = time.time()
+        if flush and self._pending:
+            events.append(self._take())
+        if not events:
+            return ''
+        return '\n'.join(events) + '\n'
+
+    def _take(self):
+        """Returns the event held back and forgets it."""
+        event = LINE_SEPARATOR.join(self._pending)
+        self._pending = []
+        self._pending_size = 0
+        self._pending_bytes = 0
+        return event
+
+    def pending_size(self):
+        """Returns the number of bytes of the file held back, so that the
+        offset of the event can be found."""
+        return self._pending_bytes
+
+    def flush_delay(self):
+        """Returns time in seconds after which the held back event should be
+        flushed, None if there is no such event."""
+        if not self._pending:
+            return None
+        return max(0, self._updated + self._timeout - time.time())
@@ -0,0 +1,177 @@
+# coding: utf-8
+# vim: set ts=4 sw=4 et:
+
+import threading
+import time
+
+from utils import log
+
+__author__ = 'Logentries'
+
+__all__ = ['RateLimit', 'RATE_LIMIT_DELAY', 'RATE_LIMIT_SAMPLE', 'RATE_LIMIT_MODES']
+
+# What happens with lines over the limit
+RATE_LIMIT_DELAY = 'delay'
+RATE_LIMIT_SAMPLE = 'sample'
+RATE_LIMIT_MODES = [RATE_LIMIT_DELAY, RATE_LIMIT_SAMPLE]
+
+# Time in seconds between reports of lines held back or dropped
+REPORT_INTERVAL = 60  # Seconds
+# Lines held back for a shorter time in total are not reported
+REPORT_MIN_DELAY = 0.1  # Seconds
+
+
+def lines_within(data, max_lines, max_bytes):
+    """Returns the size of the leading lines of data, at most max_lines
+    lines and max_bytes bytes long, and the number of the lines."""
+    end = 0
+    lines = 0
+    while lines < max_lines:
+        nl = data.find('\n', end)
+        if nl == -1 or nl + 1 > max_bytes:
+            break
+        end = nl + 1
+        lines += 1
+    return end, lines
+
+
+class TokenBucket(object):
+
+    """Allows rate units per second in bursts of up to a second's worth.
+    Taking more than available is allowed, the debt is paid back by waiting."""
+
+    def __init__(self, rate):
+        # Waits are fractions of a second also for sizes given in bytes
+        self.rate = float(rate)
+        self.tokens = self.rate
+        self.updated = time.time()
+
+    def refill(self, now):
+        # Clock set back does not add tokens
+        elapsed = max(now - self.updated, 0)
+        self.tokens = min(self.tokens + elapsed * self.rate, self.rate)
+        self.updated = now
+
+    def wait(self):
+        """Returns seconds until the debt is paid back."""
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate
+
+    def available(self):
+        return max(int(self.tokens), 0)
+
+    def take(self, count):
+        self.tokens -= count
+
+
+class RateLimit(object):
+
+    """Limits lines and bytes per second sent by a log, or by all logs if the
+    limit is shared. Lines over the limit are either delayed, so the follower
+    stays behind in its file, or dropped. A log limit can have the limit of
+    all logs as its parent, both are enforced then."""
+
+    def __init__(self, name, lines, size, mode=RATE_LIMIT_DELAY, parent=None):
+        self.name = name
+        self.mode = mode
+        self._parent = parent
+        self._lock = threading.Lock()
+        self._lines = None
+        self._bytes = None
+        if lines:
+            self._lines = TokenBucket(lines)
+        if size:
+            self._bytes = TokenBucket(size)
+        self._buckets = [b for b in [self._lines, self._bytes] if b]
+        self.dropped_lines = 0
+        self.dropped_bytes = 0
+        self.delayed = 0.0
+        self._delayed_since = None
+        self._reported = 0
+        self._reported_counts = (0, 0, 0.0)
+
+    def wait(self):
+        """Returns seconds the log has to wait before sending more lines."""
+        delay = 0
+        if self.mode == RATE_LIMIT_DELAY:
+            now = time.time()
+            with self._lock:
+                for bucket in self._buckets:
+                    bucket.refill(now)
+                    delay = max(delay, bucket.wait())
+                if delay:
+                    if self._delayed_since is None:
+                        self._delayed_since = now
+                elif self._delayed_since is not None:
+                    self.delayed += now - self._delayed_since
+                    self._delayed_since = None
+            self._report(now)
+        if self._parent:
+            delay = max(delay, self._parent.wait())
+        return delay
+
+    def allowance(self, data):
+        """Returns the size of the leading lines of data which can be read
+        now, at least the first line. Lines over the limit are dropped rather
+        than delayed in the sample mode, so all of them can be read."""
+        if self.mode != RATE_LIMIT_DELAY:
+            end = len(data)
+        else:
+            with self._lock:
+                max_lines = self._lines.available() if self._lines else len(data)
+                max_bytes = self._bytes.available() if self._bytes else len(data)
+            end = max(lines_within(data, max_lines, max_bytes)[0],
+                      data.find('\n') + 1) or len(data)
+        if self._parent:
+            end = min(end, self._parent.allowance(data[:end]))
+        return end
+
+    def admit(self, data):
+        """Takes lines of data given from the limit. Returns the lines to
+        send: all of them if they are delayed, the leading lines within the
+        limit if they are sampled. Lines are counted as read, before they are
+        formatted."""
+        if self.mode == RATE_LIMIT_DELAY:
+            with self._lock:
+                if self._lines:
+                    self._lines.take(data.count('\n'))
+                if self._bytes:
+                    self._bytes.take(len(data))
+        else:
+            now = time.time()
+            with self._lock:
+                for bucket in self._buckets:
+                    bucket.refill(now)
+                max_lines = self._lines.available() if self._lines else len(data)
+                max_bytes = self._bytes.available() if self._bytes else len(data)
+                end, lines = lines_within(data, max_lines, max_bytes)
+                if self._lines:
+                    self._lines.take(lines)
+                if self._bytes:
+                    self._bytes.take(end)
+                if end < len(data):
+                    self.dropped_lines += data.count('\n', end)
+                    self.dropped_bytes += len(data) - end
+                    data = data[:end]
+            self._report(now)
+        if data and self._parent:
+            data = self._parent.admit(data)
+        return data
+
+    def _report(self, now):
+        """Logs lines held back or dropped since the last report."""
+        with self._lock:
+            counts = (self.dropped_lines, self.dropped_bytes, self.delayed)
+            if counts == self._reported_counts or now - self._reported < REPORT_INTERVAL:
+                return
+            if self.mode == RATE_LIMIT_DELAY and counts[2] < REPORT_MIN_DELAY:
+                return
+            self._reported = now
+            self._reported_counts = counts
+        if self.mode == RATE_LIMIT_DELAY:
+            log.warning("Rate limit of %s reached, lines held back for %.1fs so far",
+                        self.name, counts[2])
+        else:
+            log.warning("Rate limit of %s reached, %d lines (%d bytes) dropped so far",
+                        self.name, counts[0], counts[1])
@@ -0,0 +1,255 @@
+# coding: utf-8
+# vim: set ts=4 sw=4 et:
+
+import collections
+import threading
+import time
+import Queue
+
+__author__ = 'Logentries'
+
+__all__ = ['MemoryBudget', 'SendQueue', 'Flow',
+           'OVERFLOW_BLOCK', 'OVERFLOW_DROP_OLDEST', 'OVERFLOW_DROP_NEWEST', 'OVERFLOW_SPILL',
+           'OVERFLOW_MODES']
+
+# What happens with entries which do not fit into the queue
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP_OLDEST = 'drop-oldest'
+OVERFLOW_DROP_NEWEST = 'drop-newest'
+OVERFLOW_SPILL = 'spill'
+OVERFLOW_MODES = [OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST, OVERFLOW_SPILL]
+
+# Time in seconds between checks of the closed flag by blocked senders
+BLOCK_WAIT = 1  # Seconds
+
+# Bytes a flow of weight 1 may dequeue per round
+QUANTUM = 4096
+
+
+class MemoryBudget(object):
+
+    """Limits the total size of entries held by all send queues. Queues
+    sharing the budget share its lock as well."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.lock = threading.Lock()
+        # Notified when space is released
+        self.not_full = threading.Condition(self.lock)
+
+
+class Flow(object):
+
+    """Entries of one log in a send queue. Flows of higher priority are
+    served first; flows of the same priority share the queue in proportion
+    to their weights."""
+
+    def __init__(self, name, weight, priority):
+        self.name = name
+        self.weight = weight
+        self.priority = priority
+        self.entries = collections.deque()
+        self.size = 0
+        # Bytes the flow may dequeue in the current round
+        self.deficit = 0
+        self.dropped_entries = 0
+        self.dropped_bytes = 0
+
+
+class SendQueue(object):
+
+    """Queue of entries bounded by their total size in bytes and by the
+    memory budget shared with other queues. Entries of each flow are kept
+    in order; flows take turns by deficit round robin. The overflow mode
+    decides what happens when an entry does not fit: the sender blocks, or
+    entries of the flow using most of its share, preferably of low priority,
+    are dropped: its oldest entries or the newest one. Dropped entries are
+    counted."""
+
+    def __init__(self, max_size, budget, overflow=OVERFLOW_DROP_OLDEST):
+        self._max_size = max_size
+        self._budget = budget
+        self._overflow = overflow
+        self._flows = {}
+        # Flows with entries by priority, the next one to serve first
+        self._active = {}
+        self._priorities = []
+        self._count = 0
+        self._size = 0
+        self._closed = False
+        self._not_empty = threading.Condition(budget.lock)
+        self._default = self.flow('')
+        self.dropped_entries = 0
+        self.dropped_bytes = 0
+        # Entries queued so far and the largest size of the queue
+        self.queued_entries = 0
+        self.queued_bytes = 0
+        self.high_water = 0
+
+    def flow(self, name, weight=1, priority=0):
+        """Returns the flow of the name given, creates it if needed."""
+        with self._budget.lock:
+            flow = self._flows.get(name)
+            if not flow:
+                flow = Flow(name, weight, priority)
+                self._flows[name] = flow
+                if priority not in self._active:
+                    self._active[priority] = collections.deque()
+                    self._priorities = sorted(self._active, reverse=True)
+            return flow
+
+    def flows(self):
+        """Returns all flows of the queue."""
+        return self._flows.values()
+
+    def _fits(self, size):
+        # An entry always fits into an empty queue, it would never fit otherwise
+        if not self._count:
+            return True
+        return self._size + size <= self._max_size and \
+            self._budget.used + size <= self._budget.limit
+
+    def _victim(self, flow, size):
+        """Returns the flow whose entries are dropped to make room for an
+        entry of the size given: of the lowest priority, the one using most
+        of its share."""
+        victim = None
+        victim_key = None
+        for candidate in self._flows.itervalues():
+            queued = candidate.size
+            if candidate is flow:
+                queued += size
+            if not queued:
+                continue
+            key = (candidate.priority, -float(queued) / candidate.weight)
+            if victim is None or key < victim_key:
+                victim = candidate
+                victim_key = key
+        return victim
+
+    def _removed(self, flow, entry):
+        self._count -= 1
+        self._size -= len(entry)
+        self._budget.used -= len(entry)
+        flow.size -= len(entry)
+        if not flow.entries:
+            flow.deficit = 0
+            self._active[flow.priority].remove(flow)
+        self._budget.not_full.notify_all()
+
+    def _drop(self, flow, newest=False):
+        if newest:
+            entry = flow.entries.pop()
+        else:
+            entry = flow.entries.popleft()
+        self._removed(flow, entry)
+        self._count_dropped(flow, len(entry))
+
+    def _count_dropped(self, flow, size):
+        flow.dropped_entries += 1
+        flow.dropped_bytes += size
+        self.dropped_entries += 1
+        self.dropped_bytes += size
+
+    def _pop(self):
+        """Removes and returns the next entry by deficit round robin."""
+        for priority in self._priorities:
+            active = self._active[priority]
+            while active:
+                flow = active[0]
+                size = len(flow.entries[0])
+                if flow.deficit >= size:
+                    flow.deficit -= size
+                    entry = flow.entries.popleft()
+                    self._removed(flow, entry)
+                    return entry
+                flow.deficit += QUANTUM * flow.weight
+                active.rotate(-1)
+        raise IndexError('pop from an empty queue')
+
+    def put(self, entry, flow=None):
+        """Queues the entry to the flow given, the default one if None.
+        Returns False if the entry has been refused, in which case it is
+        counted as dropped unless the overflow mode is spill."""
+        if flow is None:
+            flow = self._default
+        size = len(entry)
+        with self._budget.lock:
+            while not self._fits(size):
+                if self._overflow == OVERFLOW_BLOCK and not self._closed:
+                    self._budget.not_full.wait(BLOCK_WAIT)
+                    continue
+                if self._overflow in (OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST):
+                    victim = self._victim(flow, size)
+                    if victim is not flow:
+                        self._drop(victim, self._overflow == OVERFLOW_DROP_NEWEST)
+                        continue
+                    if self._overflow == OVERFLOW_DROP_OLDEST and flow.entries:
+                        self._drop(flow)
+                        continue
+                if self._overflow != OVERFLOW_SPILL:
+                    self._count_dropped(flow, size)
+                return False
+            if not flow.entries:
+                self._active[flow.priority].append(flow)
+            flow.entries.append(entry)
+            flow.size += size
+            self._count += 1
+            self._size += size
+            self._budget.used += size
+            self.queued_entries += 1
+            self.queued_bytes += size
+            if self._size > self.high_water:
+                self.high_water = self._size
+            self._not_empty.notify()
+            return True
+
+    def discard(self, entry, flow=None):
+        """Counts the entry refused by `put' as dropped."""
+        if flow is None:
+            flow = self._default
+        with self._budget.lock:
+            self._count_dropped(flow, len(entry))
+
+    def get(self, block=True, timeout=None):
+        """Removes and returns the next entry. Raises Queue.Empty if there
+        is no entry within the timeout given."""
+        with self._budget.lock:
+            if block and not self._count:
+                deadline = None
+                if timeout is not None:
+                    deadline = time.time() + timeout
+                while not self._count and not self._closed:
+                    if deadline is None:
+                        self._not_empty.wait()
+                        continue
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._not_empty.wait(remaining)
+            if not self._count:
+                raise Queue.Empty
+            return self._pop()
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def empty(self):
+        return not self._count
+
+    def qsize(self):
+        """Returns the number of entries queued."""
+        return self._count
+
+    def size(self):
+        """Returns the total size of entries queued in bytes."""
+        return self._size
+
+    def close(self):
+        """Releases blocked senders and receivers, entries which do not fit
+        are dropped from now on."""
+        with self._budget.lock:
+            self._closed = True
+            self._budget.not_full.notify_all()
+            self._not_empty.notify_all()
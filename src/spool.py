@@ -0,0 +1,221 @@
+# coding: utf-8
+# vim: set ts=4 sw=4 et:
+
+import io
+import os
+import threading
+
+from utils import log
+
+__author__ = 'Logentries'
+
+__all__ = ['Spool', 'SpoolError']
+
+
+# Suffix of segment files
+SEGMENT_SUFFIX = '.spool'
+# Name of the file with the replay position
+POSITION_NAME = 'position'
+
+
+class SpoolError(Exception):
+
+    """Raised when the spool directory cannot be used."""
+    pass
+
+
+class Spool(object):
+
+    """Keeps entries which cannot be sent right away in append-only segment
+    files of a directory. Entries are read back in the order they have been
+    appended. When the size of all segments exceeds the limit, the oldest
+    segment is dropped and the entries lost are counted. The replay position
+    is saved on close, data replayed but not committed is sent again after a
+    restart."""
+
+    def __init__(self, directory, max_size, segment_size):
+        self._directory = directory
+        self._max_size = max_size
+        self._segment_size = segment_size
+        self._lock = threading.Lock()
+        # Sequence numbers of segments, oldest first
+        self._segments = []
+        self._size = 0
+        self._writer = None
+        self._writer_size = 0
+        self._reader = None
+        self._read_offset = 0
+        # Segment returned by `read' last, None if it has been dropped
+        self._read_segment = None
+        # Bytes appended but not committed yet
+        self._pending = 0
+        self.evicted_bytes = 0
+        self.evicted_events = 0
+        # Bytes appended since the start of the agent
+        self.appended_bytes = 0
+
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            for name in os.listdir(directory):
+                if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit():
+                    self._segments.append(int(name[:-len(SEGMENT_SUFFIX)]))
+        except OSError, e:
+            raise SpoolError('Cannot use spool directory %s: %s' % (directory, e))
+        self._segments.sort()
+        for segment in self._segments:
+            self._size += os.path.getsize(self._segment_name(segment))
+        self._pending = self._size
+        if self._segments:
+            self._load_position()
+            log.info("Replaying %d bytes spooled in %s", self._pending, directory)
+
+    def _segment_name(self, segment):
+        return os.path.join(self._directory, '%016d%s' % (segment, SEGMENT_SUFFIX))
+
+    def _load_position(self):
+        """Skips data committed before the last close."""
+        try:
+            with open(os.path.join(self._directory, POSITION_NAME)) as f:
+                segment, offset = [int(x) for x in f.read().split()]
+        except (IOError, ValueError):
+            return
+        if segment == self._segments[0]:
+            self._read_offset = min(offset, os.path.getsize(self._segment_name(segment)))
+            self._pending -= self._read_offset
+
+    def _save_position(self):
+        position_name = os.path.join(self._directory, POSITION_NAME)
+        try:
+            if self._segments:
+                with open(position_name + '.tmp', 'w') as f:
+                    f.write('%d %d\n' % (self._segments[0], self._read_offset))
+                os.rename(position_name + '.tmp', position_name)
+            elif os.path.exists(position_name):
+                os.remove(position_name)
+        except (IOError, OSError), e:
+            log.error("Cannot save spool position in %s: %s", self._directory, e)
+
+    def _close_writer(self):
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+
+    def _close_reader(self):
+        if self._reader:
+            self._reader.close()
+            self._reader = None
+
+    def _drop_oldest(self, evicted):
+        """Removes the oldest segment. Counts its unread entries as lost if
+        evicted is set."""
+        segment = self._segments.pop(0)
+        name = self._segment_name(segment)
+        if segment == self._read_segment:
+            # Data being replayed is not committed
+            self._read_segment = None
+        self._close_reader()
+        if self._writer and not self._segments:
+            self._close_writer()
+        try:
+            size = os.path.getsize(name)
+        except OSError:
+            size = 0
+        if evicted:
+            unread = max(size - self._read_offset, 0)
+            self.evicted_bytes += unread
+            self._pending -= unread
+            try:
+                with open(name, 'rb') as f:
+                    f.seek(self._read_offset)
+                    self.evicted_events += f.read().count('\n')
+            except IOError:
+                pass
+        try:
+            os.remove(name)
+        except OSError, e:
+            log.error("Cannot remove spool segment %s: %s", name, e)
+        self._size -= size
+        self._read_offset = 0
+
+    def append(self, entry):
+        """Appends the entry to the newest segment. Returns False if the entry
+        could not be written."""
+        with self._lock:
+            try:
+                if not self._writer or self._writer_size >= self._segment_size:
+                    self._close_writer()
+                    segment = self._segments[-1] + 1 if self._segments else 0
+                    self._writer = io.open(self._segment_name(segment), 'ab', buffering=0)
+                    self._writer_size = 0
+                    self._segments.append(segment)
+                self._writer.write(entry)
+            except (IOError, OSError), e:
+                log.error("Cannot write to spool %s: %s", self._directory, e)
+                self._close_writer()
+                return False
+            self._writer_size += len(entry)
+            self._size += len(entry)
+            self._pending += len(entry)
+            self.appended_bytes += len(entry)
+
+            # Make room by dropping the oldest data
+            while self._size > self._max_size and len(self._segments) > 1:
+                evicted = self.evicted_events
+                self._drop_oldest(True)
+                log.warning("Spool %s is full, dropped %d oldest events, %d in total",
+                            self._directory, self.evicted_events - evicted, self.evicted_events)
+            return True
+
+    def pending(self):
+        """Returns the number of bytes waiting for replay."""
+        return self._pending
+
+    def read(self, max_size):
+        """Returns up to max_size bytes of the oldest data not committed yet,
+        cut at the end of the last complete entry if possible. Returns an
+        empty string if there is nothing to replay."""
+        with self._lock:
+            while self._segments:
+                if not self._reader:
+                    try:
+                        self._reader = io.open(self._segment_name(self._segments[0]), 'rb')
+                    except IOError, e:
+                        log.error("Cannot read spool segment: %s", e)
+                        self._drop_oldest(True)
+                        continue
+                self._reader.seek(self._read_offset)
+                data = self._reader.read(max_size)
+                if data:
+                    nl = data.rfind('\n')
+                    if nl != -1:
+                        data = data[:nl + 1]
+                    self._read_segment = self._segments[0]
+                    return data
+                if len(self._segments) == 1:
+                    # The segment being written
+                    return ''
+                self._drop_oldest(False)
+            return ''
+
+    def commit(self, size):
+        """Marks size bytes returned by `read' as delivered. Ignored if the
+        segment read has been dropped since; its entries have been counted
+        as lost, delivered or not."""
+        with self._lock:
+            if self._read_segment is None:
+                return
+            self._read_segment = None
+            self._read_offset += size
+            self._pending -= size
+            if not self._pending and self._segments:
+                # All delivered, start afresh
+                while self._segments:
+                    self._drop_oldest(False)
+                self._save_position()
+
+    def close(self):
+        with self._lock:
+            self._close_writer()
+            self._close_reader()
+            self._save_position()
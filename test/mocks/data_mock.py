@@ -3,12 +3,39 @@
 #
 # Logentries data server mock
 #
+# Received events are written to the standard output. Streams starting with
+# a zlib header (agent configured with datahub-compression = deflate) are
+# decompressed first, which is noted on the standard error output.
+#
+
+import sys
+import zlib
 
 from twisted.internet import protocol, reactor, endpoints
 
+# First byte of a zlib stream (deflate, 32K window)
+ZLIB_HEADER = '\x78'
+
 class Listen( protocol.Protocol):
+	def connectionMade( self):
+		self.decompressor = None
+		self.started = False
+
 	def dataReceived( self, data):
-		pass
+		if not self.started:
+			self.started = True
+			if data.startswith( ZLIB_HEADER):
+				print >>sys.stderr, "Decompressing stream"
+				self.decompressor = zlib.decompressobj()
+		if self.decompressor:
+			try:
+				data = self.decompressor.decompress( data)
+			except zlib.error, e:
+				print >>sys.stderr, "Invalid compressed stream: %s" % e
+				self.transport.loseConnection()
+				return
+		sys.stdout.write( data)
+		sys.stdout.flush()
 
 class ListenFactory( protocol.Factory):
 	def buildProtocol( self, addr):
@@ -17,4 +44,3 @@ class ListenFactory( protocol.Factory):
 if __name__ == "__main__":
 	endpoints.serverFromString( reactor, "tcp:10000").listen(ListenFactory())
 	reactor.run()
-
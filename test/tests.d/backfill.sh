@@ -0,0 +1,86 @@
+#!/bin/bash
+
+. vars
+
+#
+# Existing content of files seen for the first time is sent with --backfill
+#
+
+Scenario 'Backfill'
+
+function backfill {
+	# Files are seen for the first time
+	rm -f "$TMP/logentries/offsets"
+	: >"$TMP/data_mock_output"
+	: >"$TMP/le_output"
+	$LE monitor "$@" 2>>"$TMP/le_output" &
+	LE_PID=$!
+	sleep 2
+}
+
+function stop_le {
+	kill $LE_PID
+	wait $LE_PID
+	LE_PID=''
+}
+
+function messages {
+	grep -o 'Message [0-9]*$' "$TMP/data_mock_output" | sed -e 's/Message //' | tr '\n' ' ' ; echo
+}
+
+Testcase 'Init'
+
+$LE init --account-key=$ACCOUNT_KEY --host-key=$HOST_KEY --hostname myhost
+#e Initialized
+
+echo 'pull-server-side-config = False' >>"$CONFIG"
+echo '[Web]' >>"$CONFIG"
+echo 'token = 0b52788c-7981-4138-ac40-6720ae2d5f0c' >>"$CONFIG"
+echo "path = $TMP/example.log" >>"$CONFIG"
+seq 1 20000 | sed -e 's/^/Message /' >example.log
+
+Testcase 'Whole files'
+
+backfill --backfill=start
+echo 'Message 20001' >>example.log
+sleep 1
+messages | wc -w
+#o 20001
+grep -o 'Backfilled .*, [0-9]* bytes' "$TMP/le_output"
+#o Backfilled $TMP/example.log, 268894 bytes
+stop_le
+
+Testcase 'Last bytes of files'
+
+backfill --backfill=50B
+messages
+#o 19999 20000 20001 
+stop_le
+
+Testcase 'Size without a unit'
+
+$LE monitor --backfill=500 || true
+#e Cannot parse 500 for --backfill. Expected `start', size with unit, e.g. 500M, or time, e.g. 03:00
+
+Testcase 'Lines since a time'
+
+for m in $(seq 10 59) ; do
+	echo "2015-01-01 10:$m:00 Message $m"
+	echo "  continued"
+done >example.log.new
+mv example.log.new example.log
+backfill --backfill="2015-01-01 10:50"
+messages
+#o 50 51 52 53 54 55 56 57 58 59 
+stop_le
+
+Testcase 'Lines of the last hours'
+
+for h in 240 180 60 30 ; do
+	echo "$(date -d "-$h minutes" '+%Y-%m-%d %H:%M:%S') Message $h"
+done >example.log.new
+mv example.log.new example.log
+backfill --backfill="last 2h"
+messages
+#o 60 30 
+stop_le
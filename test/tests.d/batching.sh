@@ -0,0 +1,60 @@
+#!/bin/bash
+
+. vars
+
+#
+# Entries queued are written to the connection together, a batch is closed
+# once it reaches send-max-bytes.
+#
+
+Scenario 'Batched writes'
+
+STATUS="$TMP/logentries/status"
+
+function start_data_mock {
+	$DIR/env/bin/python $DIR/mocks/data_mock.py >>"$TMP/data_mock_output" 2>/dev/null &
+	DATA_MOCK_PID=$!
+	until (echo >/dev/tcp/localhost/10000) &>/dev/null ; do sleep 0.1 ; done
+}
+
+function stop_data_mock {
+	kill $DATA_MOCK_PID
+	wait $DATA_MOCK_PID || true
+	DATA_MOCK_PID=''
+}
+
+Testcase 'Init'
+
+$LE init --account-key=$ACCOUNT_KEY --host-key=$HOST_KEY --hostname myhost
+#e Initialized
+
+echo 'pull-server-side-config = False' >>"$CONFIG"
+echo 'send-max-bytes = 3K' >>"$CONFIG"
+echo '[Web]' >>"$CONFIG"
+echo 'token = 0b52788c-7981-4138-ac40-6720ae2d5f0c' >>"$CONFIG"
+echo "path = $TMP/example.log" >>"$CONFIG"
+touch example.log
+
+Testcase 'Entries queued while the endpoint is down'
+
+stop_data_mock
+$LE monitor 2>>"$TMP/le_output" &
+LE_PID=$!
+sleep 1
+# Lines are written in blocks of ten, each of them one entry of 1270 bytes
+for i in $(seq 1 10 50) ; do
+	seq -f 'Message %03g' $i $((i + 9)) >>example.log
+	sleep 0.2
+done
+start_data_mock
+sleep 9
+$DIR/env/bin/python -c 'import json, sys
+for item in json.load(open(sys.argv[1]))["transports"]:
+    print item["in_entries"], item["batches"], item["sent_bytes"]' "$STATUS"
+#o 5 2 6350
+grep -o 'Message [0-9]*$' "$TMP/data_mock_output" | sed -e 's/Message //' | tr '\n' ' ' ; echo
+#o 001 002 003 004 005 006 007 008 009 010 011 012 013 014 015 016 017 018 019 020 021 022 023 024 025 026 027 028 029 030 031 032 033 034 035 036 037 038 039 040 041 042 043 044 045 046 047 048 049 050 
+
+kill $LE_PID
+wait $LE_PID
+LE_PID=''
@@ -55,4 +55,8 @@ sleep 1
 #e Second message
 
 kill $LE_PID
+wait $LE_PID
+#e 
+#e Shutting down
+#e Shut down, 0 bytes delivered, 0 bytes spooled
 
@@ -65,4 +65,8 @@ sleep 1
 
 #e First message
 #e Second message
+#e 
+#e Shutting down
+#e Connection 127.0.0.1:8081 closed by the remote side
+#e Shut down, 0 bytes delivered, 0 bytes spooled, 2 events (29 bytes) abandoned
 
@@ -0,0 +1,69 @@
+#!/bin/bash
+
+. vars
+
+#
+# The data stream sent to a data hub is deflated if configured; every
+# connection starts a new zlib stream
+#
+
+Scenario 'Compressed data hub stream'
+
+function start_data_mock {
+	$DIR/env/bin/python $DIR/mocks/data_mock.py >>"$TMP/data_mock_output" 2>&1 &
+	DATA_MOCK_PID=$!
+	until (echo >/dev/tcp/localhost/10000) &>/dev/null ; do sleep 0.1 ; done
+}
+
+function stop_data_mock {
+	kill $DATA_MOCK_PID
+	wait $DATA_MOCK_PID || true
+	DATA_MOCK_PID=''
+}
+
+Testcase 'Init'
+
+$LE init --account-key=$ACCOUNT_KEY --host-key=$HOST_KEY --hostname myhost
+#e Initialized
+
+echo 'pull-server-side-config = False' >>"$CONFIG"
+echo 'datahub = 127.0.0.1:10000' >>"$CONFIG"
+echo 'datahub-compression = deflate' >>"$CONFIG"
+echo '[Web]' >>"$CONFIG"
+echo 'token = 0b52788c-7981-4138-ac40-6720ae2d5f0c' >>"$CONFIG"
+echo "path = $TMP/example.log" >>"$CONFIG"
+touch example.log
+
+Testcase 'Monitoring'
+
+$LE monitor 2>>"$TMP/le_output" &
+LE_PID=$!
+sleep 1
+echo 'First message' >>example.log
+sleep 0.2
+echo 'Second message' >>example.log
+sleep 1
+grep -o '[A-Z][a-z]* message$' "$TMP/data_mock_output"
+#o First message
+#o Second message
+
+Testcase 'Reconnected in the middle of the stream'
+
+# The batch written last is sent again over the new connection
+stop_data_mock
+start_data_mock
+sleep 2
+echo 'Third message' >>example.log
+sleep 1
+kill $LE_PID
+wait $LE_PID
+LE_PID=''
+grep -o '[A-Z][a-z]* message$' "$TMP/data_mock_output"
+#o First message
+#o Second message
+#o Second message
+#o Third message
+grep -c 'Decompressing stream' "$TMP/data_mock_output"
+#o 2
+grep -c 'Invalid compressed stream' "$TMP/data_mock_output" || true
+#o 0
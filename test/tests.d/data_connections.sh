@@ -0,0 +1,55 @@
+#!/bin/bash
+
+. vars
+
+#
+# Logs are spread over data-connections by a hash of their token, entries of
+# a log always use the same connection.
+#
+
+Scenario 'Parallel data connections'
+
+STATUS="$TMP/logentries/status"
+
+Testcase 'Init'
+
+$LE init --account-key=$ACCOUNT_KEY --host-key=$HOST_KEY --hostname myhost
+#e Initialized
+
+echo 'pull-server-side-config = False' >>"$CONFIG"
+echo 'data-connections = 2' >>"$CONFIG"
+# The first token hashes to the second connection, the others to the first
+for log in Web:0b52788c Db:1b52788c Cache:2b52788c ; do
+	echo "[${log%:*}]" >>"$CONFIG"
+	echo "token = ${log#*:}-7981-4138-ac40-6720ae2d5f0c" >>"$CONFIG"
+	echo "path = $TMP/${log%:*}.log" >>"$CONFIG"
+	touch "${log%:*}.log"
+done
+
+Testcase 'Entries of each log sent over its connection'
+
+$LE monitor 2>>"$TMP/le_output" &
+LE_PID=$!
+sleep 1
+for i in $(seq 1 10 30) ; do
+	for log in Web Db Cache ; do
+		seq -f "$log %03g" $i $((i + 9)) >>$log.log
+		sleep 0.1
+	done
+done
+sleep 10
+$DIR/env/bin/python -c 'import json, sys
+for item in json.load(open(sys.argv[1]))["transports"]:
+    print item["name"], item["connects"], item["in_entries"], item["sent_bytes"]' "$STATUS"
+#o 127.0.0.1:10000 1 6 7470
+#o 127.0.0.1:10000/1 1 3 3690
+for log in Web Db Cache ; do
+	grep -o "$log [0-9]*$" "$TMP/data_mock_output" | wc -l
+done
+#o 30
+#o 30
+#o 30
+
+kill $LE_PID
+wait $LE_PID
+LE_PID=''
@@ -0,0 +1,38 @@
+#!/bin/bash
+
+. vars
+
+#
+# The event loop runtime: followers and transports run in one loop thread
+#
+
+Scenario 'Event loop'
+
+Testcase 'Init'
+
+$LE init --account-key=$ACCOUNT_KEY --host-key=$HOST_KEY --hostname myhost
+#e Initialized
+
+echo 'pull-server-side-config = False' >>"$CONFIG"
+echo 'runtime = event-loop' >>"$CONFIG"
+echo '[Web]' >>"$CONFIG"
+echo 'token = 0b52788c-7981-4138-ac40-6720ae2d5f0c' >>"$CONFIG"
+echo "path = $TMP/example.log" >>"$CONFIG"
+touch example.log
+
+Testcase 'Monitoring'
+
+$LE monitor 2>>"$TMP/le_output" &
+LE_PID=$!
+sleep 1
+echo 'First message' >>example.log
+echo 'Second message' >>example.log
+sleep 1
+grep -o '[A-Z][a-z]* message$' "$TMP/data_mock_output"
+#o First message
+#o Second message
+kill $LE_PID
+wait $LE_PID
+LE_PID=''
+tail -n 1 "$TMP/le_output"
+#o Shut down, 0 bytes delivered, 0 bytes spooled
@@ -0,0 +1,61 @@
+#!/bin/bash
+
+. vars
+
+#
+# Logs sharing a destination share its queue: events of logs with a higher
+# priority are sent first and dropped last
+#
+
+Scenario 'Fair send queue'
+
+function start_data_mock {
+	$DIR/env/bin/python $DIR/mocks/data_mock.py >>"$TMP/data_mock_output" 2>/dev/null &
+	DATA_MOCK_PID=$!
+	until (echo >/dev/tcp/localhost/10000) &>/dev/null ; do sleep 0.1 ; done
+}
+
+function stop_data_mock {
+	kill $DATA_MOCK_PID
+	wait $DATA_MOCK_PID || true
+	DATA_MOCK_PID=''
+}
+
+Testcase 'Init'
+
+$LE init --account-key=$ACCOUNT_KEY --host-key=$HOST_KEY --hostname myhost
+#e Initialized
+
+echo 'pull-server-side-config = False' >>"$CONFIG"
+echo 'queue-size = 8000' >>"$CONFIG"
+echo '[Low]' >>"$CONFIG"
+echo 'token = 0b52788c-7981-4138-ac40-6720ae2d5f0c' >>"$CONFIG"
+echo "path = $TMP/low.log" >>"$CONFIG"
+echo '[High]' >>"$CONFIG"
+echo 'token = 1b52788c-7981-4138-ac40-6720ae2d5f0c' >>"$CONFIG"
+echo "path = $TMP/high.log" >>"$CONFIG"
+echo 'priority = 1' >>"$CONFIG"
+touch low.log high.log
+
+Testcase 'Low priority dropped first, high priority sent first'
+
+stop_data_mock
+$LE monitor 2>>"$TMP/le_output" &
+LE_PID=$!
+sleep 1
+# Lines are written in blocks of ten, each of them a queued entry
+for i in $(seq 1 10 40) ; do
+	seq -f 'Low %03g' $i $((i + 9)) >>low.log
+	sleep 0.2
+	seq -f 'High %03g' $i $((i + 9)) >>high.log
+	sleep 0.2
+done
+start_data_mock
+# Reconnected within the back-off delay
+sleep 6
+kill $LE_PID
+wait $LE_PID
+LE_PID=''
+grep -o '\(Low\|High\) [0-9]*$' "$TMP/data_mock_output" | uniq -c -w 4
+#o      40 High 001
+#o      20 Low 021
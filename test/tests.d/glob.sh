@@ -0,0 +1,78 @@
+#!/bin/bash
+
+. vars
+
+#
+# Every file matching a glob pattern is followed; new matches are followed
+# from their start and followers of deleted files retire. Hidden files do
+# not match wildcards.
+#
+
+Scenario 'Glob patterns'
+
+function open_logs {
+	ls -l /proc/$LE_PID/fd | grep -c "$TMP/logs/$1" || true
+}
+
+function messages {
+	grep -o 'Message .*$' "$TMP/data_mock_output" | sort
+	: >"$TMP/data_mock_output"
+}
+
+Testcase 'Init'
+
+$LE init --account-key=$ACCOUNT_KEY --host-key=$HOST_KEY --hostname myhost
+#e Initialized
+
+echo 'pull-server-side-config = False' >>"$CONFIG"
+echo '[Web]' >>"$CONFIG"
+echo 'token = 0b52788c-7981-4138-ac40-6720ae2d5f0c' >>"$CONFIG"
+echo "path = $TMP/logs/*.log" >>"$CONFIG"
+mkdir logs
+touch logs/one.log logs/two.log logs/.hidden.log
+
+$LE monitor 2>>"$TMP/le_output" &
+LE_PID=$!
+sleep 1
+
+Testcase 'Existing files followed'
+
+grep -o 'Following .*' "$TMP/le_output" | sort
+#o Following $TMP/logs/*.log
+#o Following $TMP/logs/one.log
+#o Following $TMP/logs/two.log
+echo 'Message to one' >>logs/one.log
+echo 'Message to two' >>logs/two.log
+echo 'Message to a hidden file' >>logs/.hidden.log
+sleep 1
+messages
+#o Message to one
+#o Message to two
+
+Testcase 'New file followed from its start'
+
+echo 'Message to three' >>logs/three.log
+echo 'Message to a new hidden file' >>logs/.three.log
+sleep 1
+messages
+#o Message to three
+grep -o 'Following .*three.*' "$TMP/le_output"
+#o Following $TMP/logs/three.log
+
+Testcase 'Deleted file retired'
+
+rm logs/two.log
+for i in $(seq 1 40) ; do
+	[ $(open_logs two.log) -eq 0 ] && break
+	sleep 0.5
+done
+open_logs two.log
+#o 0
+echo 'Message to a new two' >>logs/two.log
+sleep 1
+messages
+#o Message to a new two
+
+kill $LE_PID
+wait $LE_PID
+LE_PID=''
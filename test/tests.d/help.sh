@@ -42,5 +42,8 @@ $LE
 #e                           the format is address:port with port being optional
 #e   --system-stat-token=    set the token for system stats log (beta)
 #e   --pull-server-side-config=False do not use server-side config for following files
+#e   --backfill=             send existing content of followed files seen for the first time,
+#e                           either from start, the given size of their tail, e.g. 500M,
+#e                           or lines since the given time, e.g. 03:00 or "last 2h"
 #e
 
@@ -0,0 +1,78 @@
+#!/bin/bash
+
+. vars
+
+#
+# Followers keep at most max-open-files files open, files used least recently
+# are closed and reopened once they change
+#
+
+Scenario 'More files than max-open-files'
+
+function open_logs {
+	ls -l /proc/$LE_PID/fd | grep -c "$TMP/logs/.*\.log" || true
+}
+
+function messages {
+	grep -o 'Message .*$' "$TMP/data_mock_output" | sort
+	: >"$TMP/data_mock_output"
+}
+
+Testcase 'Init'
+
+$LE init --account-key=$ACCOUNT_KEY --host-key=$HOST_KEY --hostname myhost
+#e Initialized
+
+echo 'pull-server-side-config = False' >>"$CONFIG"
+echo 'max-open-files = 2' >>"$CONFIG"
+echo '[Web]' >>"$CONFIG"
+echo 'token = 0b52788c-7981-4138-ac40-6720ae2d5f0c' >>"$CONFIG"
+echo "path = $TMP/logs/*.log" >>"$CONFIG"
+mkdir logs
+for n in 1 2 3 4 5 6 ; do touch logs/$n.log ; done
+
+$LE monitor 2>>"$TMP/le_output" &
+LE_PID=$!
+sleep 2
+
+Testcase 'Lines of all files sent'
+
+for round in 1 2 ; do
+	for n in 1 2 3 4 5 6 ; do
+		echo "Message $round of $n" >>logs/$n.log
+		sleep 0.1
+	done
+done
+sleep 1
+messages
+#o Message 1 of 1
+#o Message 1 of 2
+#o Message 1 of 3
+#o Message 1 of 4
+#o Message 1 of 5
+#o Message 1 of 6
+#o Message 2 of 1
+#o Message 2 of 2
+#o Message 2 of 3
+#o Message 2 of 4
+#o Message 2 of 5
+#o Message 2 of 6
+[ $(open_logs) -le 2 ] && echo 'At most 2 open'
+#o At most 2 open
+
+Testcase 'Renamed while closed'
+
+# The first file is closed by now
+mv logs/1.log logs/1.log.old
+echo 'Message 3 of 1 to the rotated file' >>logs/1.log.old
+echo 'Message 4 of 1 to the new file' >>logs/1.log
+sleep 2
+messages
+#o Message 3 of 1 to the rotated file
+#o Message 4 of 1 to the new file
+[ $(open_logs) -le 2 ] && echo 'At most 2 open'
+#o At most 2 open
+
+kill $LE_PID
+wait $LE_PID
+LE_PID=''
@@ -0,0 +1,45 @@
+#!/bin/bash
+
+. vars
+
+#
+# Continuation lines such as lines of stack traces are joined with the line
+# starting the event
+#
+
+Scenario 'Multi-line events'
+
+Testcase 'Init'
+
+$LE init --account-key=$ACCOUNT_KEY --host-key=$HOST_KEY --hostname myhost
+#e Initialized
+
+echo 'pull-server-side-config = False' >>"$CONFIG"
+echo '[Web]' >>"$CONFIG"
+echo 'token = 0b52788c-7981-4138-ac40-6720ae2d5f0c' >>"$CONFIG"
+echo "path = $TMP/example.log" >>"$CONFIG"
+echo 'multiline = ^\d{4}-\d{2}-\d{2}' >>"$CONFIG"
+echo 'multiline-timeout = 0.5' >>"$CONFIG"
+touch example.log
+
+Testcase 'Stack trace sent as one event'
+
+$LE monitor 2>>"$TMP/le_output" &
+LE_PID=$!
+sleep 1
+cat >>example.log <<LOG
+2015-01-01 10:00:00 Request failed
+Traceback (most recent call last):
+  File "app.py", line 1, in <module>
+ValueError: invalid
+2015-01-01 10:00:01 Request done
+LOG
+sleep 0.2
+grep -o '2015-.*' "$TMP/data_mock_output" | sed -e 's/\xe2\x80\xa8/|/g'
+#o 2015-01-01 10:00:00 Request failed|Traceback (most recent call last):|  File "app.py", line 1, in <module>|ValueError: invalid
+sleep 1
+grep -o '2015-.*' "$TMP/data_mock_output" | sed -e 's/\xe2\x80\xa8/|/g' | tail -n 1
+#o 2015-01-01 10:00:01 Request done
+kill $LE_PID
+wait $LE_PID
+LE_PID=''
@@ -0,0 +1,96 @@
+#!/bin/bash
+
+. vars
+
+#
+# The last line of a file is sent once nothing is appended to it for a while,
+# its rest follows marked as the rest of a split line. Lines longer than a
+# block are split or truncated.
+#
+
+Scenario 'Partial and long lines'
+
+function start_le {
+	$LE monitor 2>>"$TMP/le_output" &
+	LE_PID=$!
+	sleep 1
+}
+
+function stop_le {
+	kill $LE_PID
+	wait $LE_PID
+	LE_PID=''
+}
+
+function messages {
+	# Long runs of x are shortened
+	grep -o 'Message.*$' "$TMP/data_mock_output" | sed -e 's/xxxxx*/x../'
+	: >"$TMP/data_mock_output"
+}
+
+Testcase 'Init'
+
+$LE init --account-key=$ACCOUNT_KEY --host-key=$HOST_KEY --hostname myhost
+#e Initialized
+
+echo 'pull-server-side-config = False' >>"$CONFIG"
+echo 'partial-line-timeout = 0.5' >>"$CONFIG"
+echo '[Web]' >>"$CONFIG"
+echo 'token = 0b52788c-7981-4138-ac40-6720ae2d5f0c' >>"$CONFIG"
+echo "path = $TMP/example.log" >>"$CONFIG"
+touch example.log
+
+Testcase 'Partial line sent on timeout'
+
+start_le
+printf 'Message 1\nMessage 2 starts' >>example.log
+sleep 0.2
+messages
+#o Message 1
+sleep 1
+messages
+#o Message 2 starts…
+printf ' and ends\nMessage 3\n' >>example.log
+sleep 0.5
+sed -n -e 's/.*appname=Web \(….*\)$/\1/p' "$TMP/data_mock_output"
+#o … and ends
+messages
+#o Message 3
+
+Testcase 'Partial line completed in time'
+
+printf 'Message 4 starts' >>example.log
+sleep 0.2
+printf ' and ends\n' >>example.log
+sleep 1
+messages
+#o Message 4 starts and ends
+
+Testcase 'Long lines split'
+
+(printf 'Message 5 ' ; head -c 70000 /dev/zero | tr '\0' x ; echo ; echo 'Message 6') >>example.log
+sleep 1
+grep -c '…x*…$' "$TMP/data_mock_output" || true
+#o 0
+sed -n -e 's/.*appname=Web \(….*\)$/\1/p' "$TMP/data_mock_output" | sed -e 's/xxxxx*/x../'
+#o …x..
+messages
+#o Message 5 x..…
+#o Message 6
+stop_le
+
+Testcase 'Long lines truncated'
+
+sed -i -e 's/^partial-line-timeout = 0.5$/&\nlong-lines = truncate/' "$CONFIG"
+start_le
+(printf 'Message 7 ' ; head -c 70000 /dev/zero | tr '\0' x ; echo ; echo 'Message 8') >>example.log
+sleep 1
+grep -c 'appname=Web …' "$TMP/data_mock_output" || true
+#o 0
+messages
+#o Message 7 x..…
+#o Message 8
+stop_le
+grep -o 'Lines of .* longer than [0-9]* bytes are [a-z]*' "$TMP/le_output"
+#o Lines of $TMP/example.log longer than 65536 bytes are split
+#o Lines of $TMP/example.log longer than 65536 bytes are truncated
@@ -0,0 +1,37 @@
+#!/bin/bash
+
+. vars
+
+#
+# Logs identified by key are sent over pooled connections, which are kept
+# open between batches
+#
+
+Scenario 'Pooled connections'
+
+$LE init --account-key=$ACCOUNT_KEY --host-key=$HOST_KEY
+#e Initialized
+
+echo 'pool-connections = 1' >>"$CONFIG"
+echo 'pool-workers = 1' >>"$CONFIG"
+
+Testcase 'Monitoring'
+
+touch example.log
+$LE --debug-events monitor 2>>"$TMP/le_output" &
+LE_PID=$!
+sleep 1
+for i in 1 2 3 ; do
+	echo "Message $i" >>example.log
+	sleep 0.5
+done
+sleep 0.5
+kill $LE_PID
+wait $LE_PID
+LE_PID=''
+grep -o '^Message [0-9]$' "$TMP/le_output"
+#o Message 1
+#o Message 2
+#o Message 3
+grep -c '^Opening connection 127.0.0.1:8081 PUT' "$TMP/le_output"
+#o 1
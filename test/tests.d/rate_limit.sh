@@ -0,0 +1,81 @@
+#!/bin/bash
+
+. vars
+
+#
+# Lines of a log over its rate limit are held back, or dropped in the sample
+# mode. Limits allow bursts of one second's worth of lines.
+#
+
+Scenario 'Rate limits'
+
+function run_le {
+	$LE monitor 2>>"$TMP/le_output" &
+	LE_PID=$!
+	sleep 1
+	seq $1 $2 | sed -e 's/^/Message /' >>example.log
+}
+
+function stop_le {
+	kill $LE_PID
+	wait $LE_PID
+	LE_PID=''
+}
+
+function delivered {
+	grep -c 'Message [0-9]*$' "$TMP/data_mock_output" || true
+}
+
+Testcase 'Init'
+
+$LE init --account-key=$ACCOUNT_KEY --host-key=$HOST_KEY --hostname myhost
+#e Initialized
+
+echo 'pull-server-side-config = False' >>"$CONFIG"
+echo '[Web]' >>"$CONFIG"
+echo 'token = 0b52788c-7981-4138-ac40-6720ae2d5f0c' >>"$CONFIG"
+echo "path = $TMP/example.log" >>"$CONFIG"
+echo 'rate-limit-lines = 20' >>"$CONFIG"
+touch example.log
+
+Testcase 'Lines held back'
+
+run_le 1 60
+sleep 0.5
+[ $(delivered) -ge 20 -a $(delivered) -lt 60 ] && echo 'Held back'
+#o Held back
+sleep 3
+delivered
+#o 60
+stop_le
+grep -o 'Message [0-9]*$' "$TMP/data_mock_output" | sed -e 's/Message //' | sort -n -c && echo 'In order'
+#o In order
+grep -c 'Rate limit of Web reached, lines held back for' "$TMP/le_output"
+#o 1
+
+Testcase 'Bytes held back'
+
+: >"$TMP/data_mock_output"
+sed -i -e 's/^rate-limit-lines = 20$/rate-limit-bytes = 200/' "$CONFIG"
+run_le 1000 1039
+sleep 0.5
+[ $(delivered) -ge 16 -a $(delivered) -lt 40 ] && echo 'Held back'
+#o Held back
+sleep 2
+delivered
+#o 40
+stop_le
+
+Testcase 'Lines dropped'
+
+: >"$TMP/le_output"
+: >"$TMP/data_mock_output"
+sed -i -e 's/^pull-server-side-config = False$/&\nrate-limit-mode = sample/' \
+	-e 's/^rate-limit-bytes = 200$/rate-limit-lines = 20/' "$CONFIG"
+run_le 61 120
+sleep 1
+delivered
+#o 20
+stop_le
+grep -o 'Rate limit of Web reached, .* dropped so far' "$TMP/le_output"
+#o Rate limit of Web reached, 40 lines (461 bytes) dropped so far
@@ -0,0 +1,70 @@
+#!/bin/bash
+
+. vars
+
+#
+# The agent resumes where it stopped, lines written while it was down are
+# sent after a restart
+#
+
+Scenario 'Resume after restart'
+
+function start_le {
+	$LE monitor 2>>"$TMP/le_output" &
+	LE_PID=$!
+	sleep 1
+}
+
+function write {
+	seq $1 $2 | sed -e 's/^/Message /' >>example.log
+}
+
+function messages {
+	grep -o 'Message [0-9]*$' "$TMP/data_mock_output" | sed -e 's/Message //' | tr '\n' ' ' ; echo
+	: >"$TMP/data_mock_output"
+}
+
+Testcase 'Init'
+
+$LE init --account-key=$ACCOUNT_KEY --host-key=$HOST_KEY --hostname myhost
+#e Initialized
+
+echo 'pull-server-side-config = False' >>"$CONFIG"
+echo '[Web]' >>"$CONFIG"
+echo 'token = 0b52788c-7981-4138-ac40-6720ae2d5f0c' >>"$CONFIG"
+echo "path = $TMP/example.log" >>"$CONFIG"
+
+Testcase 'New file followed from its end'
+
+write 1 5
+start_le
+write 6 10
+sleep 1
+messages
+#o 6 7 8 9 10 
+
+Testcase 'Stopped'
+
+kill $LE_PID
+wait $LE_PID
+write 11 15
+start_le
+write 16 20
+sleep 1
+messages
+#o 11 12 13 14 15 16 17 18 19 20 
+
+Testcase 'Killed'
+
+sleep 2
+kill -9 $LE_PID
+wait $LE_PID 2>/dev/null || true
+write 21 25
+start_le
+sleep 1
+messages
+#o 21 22 23 24 25 
+
+kill $LE_PID
+wait $LE_PID
+LE_PID=''
@@ -0,0 +1,86 @@
+#!/bin/bash
+
+. vars
+
+#
+# Rotated files are read to the end before the agent switches to the new
+# file, files truncated by copytruncate are followed from their beginning
+#
+
+Scenario 'Rotation'
+
+function messages {
+	grep -o 'Message .*$' "$TMP/data_mock_output" | tail -n $1
+}
+
+Testcase 'Init'
+
+$LE init --account-key=$ACCOUNT_KEY --host-key=$HOST_KEY --hostname myhost
+#e Initialized
+
+echo 'pull-server-side-config = False' >>"$CONFIG"
+echo '[Web]' >>"$CONFIG"
+echo 'token = 0b52788c-7981-4138-ac40-6720ae2d5f0c' >>"$CONFIG"
+echo "path = $TMP/example.log" >>"$CONFIG"
+touch example.log
+
+$LE monitor 2>>"$TMP/le_output" &
+LE_PID=$!
+sleep 1
+
+Testcase 'Renamed'
+
+echo 'Message 1' >>example.log
+mv example.log example.log.1
+# Written by the application before it reopens its log
+echo 'Message 2 to the rotated file' >>example.log.1
+echo 'Message 3 to the rotated file' >>example.log.1
+echo 'Message 4 to the new file' >>example.log
+sleep 2
+messages 4
+#o Message 1
+#o Message 2 to the rotated file
+#o Message 3 to the rotated file
+#o Message 4 to the new file
+echo 'Message 5 to the rotated file' >>example.log.1
+echo 'Message 6 to the new file' >>example.log
+sleep 1
+messages 1
+#o Message 6 to the new file
+
+Testcase 'Copied and truncated'
+
+echo 'Message 7 before truncation' >>example.log
+sleep 1
+cp example.log example.log.2
+: >example.log
+echo 'Message 8' >>example.log
+sleep 2
+messages 2
+#o Message 7 before truncation
+#o Message 8
+
+Testcase 'Truncated and written past the old size'
+
+sleep 1
+: >example.log
+seq 9 20 | sed -e 's/^/Message /' >>example.log
+sleep 2
+messages 13
+#o Message 8
+#o Message 9
+#o Message 10
+#o Message 11
+#o Message 12
+#o Message 13
+#o Message 14
+#o Message 15
+#o Message 16
+#o Message 17
+#o Message 18
+#o Message 19
+#o Message 20
+
+kill $LE_PID
+wait $LE_PID
+LE_PID=''
@@ -0,0 +1,72 @@
+#!/bin/bash
+
+. vars
+
+#
+# Entries waiting for the endpoint are bounded by the size of the send queue;
+# the oldest or the newest entries are dropped when it is full
+#
+
+Scenario 'Send queue bounds'
+
+function start_data_mock {
+	$DIR/env/bin/python $DIR/mocks/data_mock.py >>"$TMP/data_mock_output" 2>/dev/null &
+	DATA_MOCK_PID=$!
+	until (echo >/dev/tcp/localhost/10000) &>/dev/null ; do sleep 0.1 ; done
+}
+
+function stop_data_mock {
+	kill $DATA_MOCK_PID
+	wait $DATA_MOCK_PID || true
+	DATA_MOCK_PID=''
+}
+
+function run_le {
+	stop_data_mock
+	$LE monitor 2>>"$TMP/le_output" &
+	LE_PID=$!
+	sleep 1
+	# Lines are written in blocks of ten, each of them a queued entry
+	for i in $(seq 1 10 100) ; do
+		seq -f 'Message %03g' $i $((i + 9)) >>example.log
+		sleep 0.2
+	done
+	start_data_mock
+	# Reconnected within the back-off delay
+	sleep 6
+	kill $LE_PID
+	wait $LE_PID
+	LE_PID=''
+}
+
+Testcase 'Init'
+
+$LE init --account-key=$ACCOUNT_KEY --host-key=$HOST_KEY --hostname myhost
+#e Initialized
+
+echo 'pull-server-side-config = False' >>"$CONFIG"
+echo 'queue-size = 4000' >>"$CONFIG"
+echo '[Web]' >>"$CONFIG"
+echo 'token = 0b52788c-7981-4138-ac40-6720ae2d5f0c' >>"$CONFIG"
+echo "path = $TMP/example.log" >>"$CONFIG"
+touch example.log
+
+Testcase 'Oldest entries dropped'
+
+run_le
+grep -o 'Message [0-9]*$' "$TMP/data_mock_output" | sed -e 's/Message //' | tr '\n' ' ' ; echo
+#o 071 072 073 074 075 076 077 078 079 080 081 082 083 084 085 086 087 088 089 090 091 092 093 094 095 096 097 098 099 100 
+grep -o 'is full, .* dropped so far' "$TMP/le_output" | tail -n 1
+#o is full, 7 events (8890 bytes) dropped so far
+
+Testcase 'Newest entries dropped'
+
+: >example.log
+: >"$TMP/le_output"
+: >"$TMP/data_mock_output"
+sed -i -e 's/^queue-size = 4000$/&\nqueue-overflow = drop-newest/' "$CONFIG"
+run_le
+grep -o 'Message [0-9]*$' "$TMP/data_mock_output" | sed -e 's/Message //' | tr '\n' ' ' ; echo
+#o 001 002 003 004 005 006 007 008 009 010 011 012 013 014 015 016 017 018 019 020 021 022 023 024 025 026 027 028 029 030 
+grep -o 'is full, .* dropped so far' "$TMP/le_output" | tail -n 1
+#o is full, 7 events (8890 bytes) dropped so far
@@ -0,0 +1,74 @@
+#!/bin/bash
+
+. vars
+
+#
+# On SIGTERM the agent sends what is queued until the shutdown deadline.
+# Entries left are spooled if configured (see spool.sh) and abandoned
+# otherwise.
+#
+
+Scenario 'Shutdown'
+
+function start_data_mock {
+	$DIR/env/bin/python $DIR/mocks/data_mock.py >>"$TMP/data_mock_output" 2>/dev/null &
+	DATA_MOCK_PID=$!
+	until (echo >/dev/tcp/localhost/10000) &>/dev/null ; do sleep 0.1 ; done
+}
+
+function stop_data_mock {
+	kill $DATA_MOCK_PID
+	wait $DATA_MOCK_PID || true
+	DATA_MOCK_PID=''
+}
+
+function start_le {
+	$LE monitor 2>>"$TMP/le_output" &
+	LE_PID=$!
+	sleep 1
+	# Lines are written in blocks of ten, each of them one entry of 1270 bytes
+	for i in $(seq $1 10 $2) ; do
+		seq -f 'Message %03g' $i $((i + 9)) >>example.log
+		sleep 0.2
+	done
+	sleep 1
+}
+
+function stop_le {
+	kill $LE_PID
+	wait $LE_PID
+	LE_PID=''
+}
+
+Testcase 'Init'
+
+$LE init --account-key=$ACCOUNT_KEY --host-key=$HOST_KEY --hostname myhost
+#e Initialized
+
+echo 'pull-server-side-config = False' >>"$CONFIG"
+echo '[Web]' >>"$CONFIG"
+echo 'token = 0b52788c-7981-4138-ac40-6720ae2d5f0c' >>"$CONFIG"
+echo "path = $TMP/example.log" >>"$CONFIG"
+touch example.log
+
+Testcase 'Queue drained before the deadline'
+
+stop_data_mock
+start_le 1 30
+start_data_mock
+stop_le
+grep -o 'Shut down.*' "$TMP/le_output"
+#o Shut down, 3810 bytes delivered, 0 bytes spooled
+grep -o 'Message [0-9]*$' "$TMP/data_mock_output" | sed -e 's/Message //' | tr '\n' ' ' ; echo
+#o 001 002 003 004 005 006 007 008 009 010 011 012 013 014 015 016 017 018 019 020 021 022 023 024 025 026 027 028 029 030 
+
+Testcase 'Queue abandoned at the deadline'
+
+: >"$TMP/le_output"
+: >"$TMP/data_mock_output"
+echo 'shutdown-timeout = 1' >>"$CONFIG"
+stop_data_mock
+start_le 31 50
+stop_le
+grep -o 'Shut down.*' "$TMP/le_output"
+#o Shut down, 0 bytes delivered, 0 bytes spooled, 20 events (2540 bytes) abandoned
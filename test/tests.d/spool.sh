@@ -0,0 +1,73 @@
+#!/bin/bash
+
+. vars
+
+#
+# Entries are spooled to disk while the endpoint is down and replayed in
+# order once it is back. Oldest entries are dropped when the spool is full.
+#
+
+Scenario 'Spooling while the endpoint is down'
+
+function start_data_mock {
+	$DIR/env/bin/python $DIR/mocks/data_mock.py >>"$TMP/data_mock_output" 2>/dev/null &
+	DATA_MOCK_PID=$!
+	until (echo >/dev/tcp/localhost/10000) &>/dev/null ; do sleep 0.1 ; done
+}
+
+function stop_data_mock {
+	kill $DATA_MOCK_PID
+	wait $DATA_MOCK_PID || true
+	DATA_MOCK_PID=''
+}
+
+function run_le {
+	$LE monitor 2>>"$TMP/le_output" &
+	LE_PID=$!
+	sleep 1
+	# Lines are written in blocks of ten, each of them a spooled entry
+	for i in $(seq $1 10 $2) ; do
+		seq $i $((i + 9)) | sed -e 's/^/Message /' >>example.log
+		sleep 0.2
+	done
+	sleep 1
+	kill $LE_PID
+	wait $LE_PID
+	LE_PID=''
+}
+
+Testcase 'Init'
+
+$LE init --account-key=$ACCOUNT_KEY --host-key=$HOST_KEY --hostname myhost
+#e Initialized
+
+echo 'pull-server-side-config = False' >>"$CONFIG"
+echo 'spool-size = 4K' >>"$CONFIG"
+echo '[Web]' >>"$CONFIG"
+echo 'token = 0b52788c-7981-4138-ac40-6720ae2d5f0c' >>"$CONFIG"
+echo "path = $TMP/example.log" >>"$CONFIG"
+touch example.log
+
+Testcase 'Replay in order'
+
+stop_data_mock
+run_le 1 20
+start_data_mock
+run_le 21 30
+grep -o 'Replaying [0-9]* bytes' "$TMP/le_output"
+#o Replaying 2511 bytes
+grep -o 'Message [0-9]*$' "$TMP/data_mock_output" | sed -e 's/Message //' | tr '\n' ' ' ; echo
+#o 1 2 3 4 5 6 7 8 9 10 11 12 13 14 15 16 17 18 19 20 21 22 23 24 25 26 27 28 29 30 
+
+Testcase 'Oldest entries dropped'
+
+: >"$TMP/le_output"
+: >"$TMP/data_mock_output"
+stop_data_mock
+run_le 31 90
+start_data_mock
+run_le 91 100
+grep -o 'is full, dropped [0-9]* oldest events, [0-9]* in total' "$TMP/le_output" | tail -n 1
+#o is full, dropped 10 oldest events, 30 in total
+grep -o 'Message [0-9]*$' "$TMP/data_mock_output" | sed -e 's/Message //' | tr '\n' ' ' ; echo
+#o 61 62 63 64 65 66 67 68 69 70 71 72 73 74 75 76 77 78 79 80 81 82 83 84 85 86 87 88 89 90 91 92 93 94 95 96 97 98 99 100 
@@ -0,0 +1,55 @@
+#!/bin/bash
+
+. vars
+
+#
+# The status of transports and followed files is periodically saved in the
+# cache directory and removed when the agent stops.
+#
+
+Scenario 'Status of the agent'
+
+STATUS="$TMP/logentries/status"
+
+function status {
+	$DIR/env/bin/python -c 'import json, sys
+status = json.load(open(sys.argv[1]))
+for item in status[sys.argv[2]]:
+    print " ".join("%s=%s" % (name, item[name]) for name in sys.argv[3:])' "$STATUS" "$@" | sed -e "s#$TMP/##"
+}
+
+Testcase 'Init'
+
+$LE init --account-key=$ACCOUNT_KEY --host-key=$HOST_KEY --hostname myhost
+#e Initialized
+
+echo 'pull-server-side-config = False' >>"$CONFIG"
+echo '[Web]' >>"$CONFIG"
+echo 'token = 0b52788c-7981-4138-ac40-6720ae2d5f0c' >>"$CONFIG"
+echo "path = $TMP/example.log" >>"$CONFIG"
+touch example.log
+
+Testcase 'Saved while running'
+
+$LE monitor 2>>"$TMP/le_output" &
+LE_PID=$!
+sleep 1
+for i in $(seq 1 10 30) ; do
+	seq -f 'Message %03g' $i $((i + 9)) >>example.log
+	sleep 0.2
+done
+sleep 10
+status transports name connected in_entries in_bytes sent_bytes dropped_entries connects
+#o name=127.0.0.1:10000 connected=1 in_entries=3 in_bytes=3810 sent_bytes=3810 dropped_entries=0 connects=1
+status files path offset size lag open
+#o path=example.log offset=360 size=360 lag=0 open=1
+$DIR/env/bin/python -c 'import json, sys; print json.load(open(sys.argv[1]))["pid"] == int(sys.argv[2])' "$STATUS" $LE_PID
+#o True
+
+Testcase 'Removed on shutdown'
+
+kill $LE_PID
+wait $LE_PID
+LE_PID=''
+[ -e "$STATUS" ] || echo 'Removed'
+#o Removed
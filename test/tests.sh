@@ -55,5 +55,10 @@ for A in ${TESTS[*]} ; do
 	rm -rf -- "$TMP"
 done
 
+# Unit tests of agent internals run along with all scenarios
+if [[ $# -eq 0 ]] ; then
+	env/bin/python unit_tests.py
+fi
+
 echo 'SUCCESS'
 
@@ -0,0 +1,710 @@
+# coding: utf-8
+# vim: set ts=4 sw=4 et:
+
+"""Unit tests of agent internals. The agent as a whole is tested by the
+scenarios of tests.d run against the mocks by tests.sh, which runs these
+tests as well."""
+
+import logging
+import os
+import select
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import dnscache
+import eventloop
+import inotify
+import le
+import ratelimit
+import sendqueue
+from multiline import MultilineAssembler, LINE_SEPARATOR
+from spool import Spool
+
+
+class LogRecorder(logging.Handler):
+
+    """Records messages logged by the agent instead of printing them."""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class Transport(object):
+
+    """Collects lines sent by followers."""
+
+    def __init__(self):
+        self.lines = []
+
+    def send(self, line, flow=None):
+        self.lines.append(line)
+
+    def text(self):
+        return ''.join(self.lines)
+
+
+class TestCase(unittest.TestCase):
+
+    """Runs every test in a temporary directory with messages of the agent
+    recorded."""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        self.log = LogRecorder()
+        le.log.removeHandler(le.stream_handler)
+        le.log.addHandler(self.log)
+
+    def tearDown(self):
+        le.log.removeHandler(self.log)
+        le.log.addHandler(le.stream_handler)
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def follow(self, name, reactor, transport=None, **kwargs):
+        """Returns a follower of the file given sending to the transport."""
+        return le.Follower(os.path.abspath(name), lambda line: line, lambda line: line,
+                           transport or Transport(), reactor, **kwargs)
+
+
+class FailingWatcher(inotify.Watcher):
+
+    """Fails to set watches as if out of inotify watches."""
+
+    def add(self, path, mask, callback):
+        raise inotify.WatchError('Cannot watch %s: No space left on device' % path)
+
+
+class WatchFallbackTest(TestCase):
+
+    """Files are polled when inotify is not available or a watch cannot be
+    set."""
+
+    def check_polled(self, watcher):
+        reactor = le.FollowerReactor(watcher, None, 1)
+        name = os.path.abspath('example.log')
+        open(name, 'w').close()
+        transport = Transport()
+        self.follow(name, reactor, transport)
+        time.sleep(0.5)
+        with open(name, 'a') as f:
+            f.write('First message\n')
+        time.sleep(1.5)
+        # Rotated by renaming, lines written to both files
+        with open(name, 'a') as f:
+            f.write('Second message\n')
+        os.rename(name, name + '.1')
+        with open(name + '.1', 'a') as f:
+            f.write('Third message\n')
+        with open(name, 'w') as f:
+            f.write('Fourth message\n')
+        time.sleep(3)
+        reactor.close()
+        self.assertEqual(transport.text(),
+                         'First message\nSecond message\nThird message\nFourth message\n')
+
+    def test_inotify_not_available(self):
+        available = inotify.ctypes_available
+        inotify.ctypes_available = False
+        try:
+            self.assertIsNone(inotify.create_watcher())
+        finally:
+            inotify.ctypes_available = available
+        self.check_polled(None)
+
+    def test_watches_cannot_be_set(self):
+        self.check_polled(FailingWatcher())
+
+
+class MultilineTest(unittest.TestCase):
+
+    """Continuation lines are joined with the line starting the event."""
+
+    def feed(self, assembler, *args):
+        return assembler.feed(*args).replace(LINE_SEPARATOR, '|')
+
+    def test_lines_grouped(self):
+        assembler = MultilineAssembler('^[0-9]', 1, 64)
+        self.assertEqual(self.feed(assembler, '1 start\n  more\n  last\n2 start\n'),
+                         '1 start|  more|  last\n')
+        self.assertEqual(assembler.pending_size(), 8)
+        self.assertEqual(self.feed(assembler, '  more\n3 start\n'), '2 start|  more\n')
+        self.assertEqual(self.feed(assembler, '', True), '3 start\n')
+        self.assertEqual(assembler.pending_size(), 0)
+        self.assertIsNone(assembler.flush_delay())
+
+    def test_long_events_split(self):
+        assembler = MultilineAssembler('^[0-9]', 1, 20)
+        self.assertEqual(self.feed(assembler, '1 start\nabcdef\nghijkl\nmnopqr\n', True),
+                         '1 start|abcdef\nghijkl|mnopqr\n')
+
+    def test_marked_bytes_not_counted(self):
+        assembler = MultilineAssembler('^[0-9]', 1, 64)
+        assembler.feed('1 start\nabc..\n', False, 0, 2)
+        self.assertEqual(assembler.pending_size(), 12)
+        assembler.feed('..def\n', False, 2, 0)
+        self.assertEqual(assembler.pending_size(), 16)
+
+
+class SendQueueTest(unittest.TestCase):
+
+    """Send queues are bounded by the size of entries in bytes and by the
+    memory budget shared by all queues."""
+
+    def fill(self, queue, count, size=100):
+        return [queue.put('%03d%s\n' % (n, 'x' * (size - 4))) for n in range(count)]
+
+    def left(self, queue):
+        entries = []
+        while not queue.empty():
+            entries.append(queue.get_nowait()[:3])
+        return ' '.join(entries)
+
+    def test_oldest_entries_dropped(self):
+        queue = sendqueue.SendQueue(1000, sendqueue.MemoryBudget(10 ** 6))
+        self.fill(queue, 15)
+        self.assertEqual((queue.qsize(), queue.size(), queue.dropped_entries, queue.dropped_bytes,
+                          queue.high_water), (10, 1000, 5, 500, 1000))
+        self.assertEqual(self.left(queue), '005 006 007 008 009 010 011 012 013 014')
+
+    def test_newest_entries_dropped(self):
+        queue = sendqueue.SendQueue(1000, sendqueue.MemoryBudget(10 ** 6),
+                                    sendqueue.OVERFLOW_DROP_NEWEST)
+        self.assertEqual(self.fill(queue, 12).count(False), 2)
+        self.assertEqual(queue.dropped_entries, 2)
+        self.assertEqual(self.left(queue), '000 001 002 003 004 005 006 007 008 009')
+
+    def test_entry_larger_than_the_queue(self):
+        queue = sendqueue.SendQueue(1000, sendqueue.MemoryBudget(10 ** 6))
+        self.assertEqual(self.fill(queue, 1, 5000), [True])
+        self.assertEqual(queue.size(), 5000)
+
+    def test_sender_blocked_until_there_is_room(self):
+        queue = sendqueue.SendQueue(1000, sendqueue.MemoryBudget(10 ** 6), sendqueue.OVERFLOW_BLOCK)
+        self.fill(queue, 10)
+        sender = threading.Thread(target=queue.put, args=('new\n',))
+        sender.start()
+        time.sleep(0.3)
+        self.assertTrue(sender.is_alive())
+        self.assertEqual(queue.qsize(), 10)
+        queue.get()
+        sender.join(1)
+        self.assertFalse(sender.is_alive())
+        self.assertEqual((queue.qsize(), queue.dropped_entries), (10, 0))
+
+    def test_shared_memory_budget(self):
+        budget = sendqueue.MemoryBudget(1000)
+        first = sendqueue.SendQueue(1000, budget)
+        second = sendqueue.SendQueue(1000, budget)
+        self.fill(first, 8)
+        self.fill(second, 5)
+        self.assertEqual((budget.used, first.qsize(), second.qsize(), second.dropped_entries),
+                         (1000, 8, 2, 3))
+        self.assertEqual(self.left(second), '003 004')
+        self.left(first)
+        self.assertEqual(budget.used, 0)
+
+
+class Sink(threading.Thread):
+
+    """Accepts connections on a local port and keeps the data received over
+    each of them. Closes the first connection once it has received data if
+    close_first is set."""
+
+    def __init__(self, close_first=False):
+        threading.Thread.__init__(self)
+        self.close_first = close_first
+        self.daemon = True
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(16)
+        self.port = self.server.getsockname()[1]
+        # Data received over connections open and closed
+        self.received = {}
+        self.closed = []
+        self.start()
+
+    def run(self):
+        while True:
+            readable = select.select([self.server] + self.received.keys(), [], [])[0]
+            for conn in readable:
+                if conn is self.server:
+                    self.received[self.server.accept()[0]] = []
+                    continue
+                data = conn.recv(4096)
+                self.received[conn].append(data)
+                if self.close_first and data:
+                    self.close_first = False
+                    data = ''
+                if not data:
+                    self.closed.append(self.received.pop(conn))
+                    conn.close()
+
+    def lines(self):
+        """Returns lines received over all connections, over connections
+        closed first."""
+        return [line for data in self.closed + self.received.values()
+                for line in ''.join(data).splitlines()]
+
+
+class PoolTest(TestCase):
+
+    """Logs identified by key share a bounded number of pooled
+    connections."""
+
+    def send_pooled(self, loop=None):
+        sink = Sink()
+        pool = le.TransportPool(2, 2, loop)
+        transports = []
+        for n in range(6):
+            preamble = 'PUT /log%d HTTP/1.0\r\n\r\n' % n
+            proxy = (le.NOT_SET, le.NOT_SET, le.NOT_SET)
+            if loop:
+                transports.append(le.AsyncTransport(loop, '127.0.0.1', sink.port, False, preamble,
+                                                    False, proxy, pool))
+            else:
+                transports.append(le.Transport('127.0.0.1', sink.port, False, preamble, False, proxy,
+                                               pool))
+        for r in range(50):
+            for n, transport in enumerate(transports):
+                transport.send('log%d entry%d\n' % (n, r))
+            time.sleep(0.01)
+        started = time.time()
+        while not pool.drained() and time.time() - started < 20:
+            time.sleep(0.05)
+        self.assertTrue(pool.drained())
+        # Every log connects once, logs do not take the connection from each
+        # other for every batch
+        self.assertEqual(sum(transport.stats()['connects'] for transport in transports), 6)
+        pool.close()
+        time.sleep(0.5)
+        self.assertEqual(len([line for line in sink.lines() if line.startswith('log')]), 300)
+
+    def test_threads(self):
+        self.send_pooled()
+
+    def test_event_loop(self):
+        loop = eventloop.EventLoop()
+        eventloop.current = loop
+        thread = threading.Thread(target=loop.run)
+        thread.daemon = True
+        thread.start()
+        try:
+            self.send_pooled(loop)
+        finally:
+            loop.stop()
+            thread.join(1)
+            eventloop.current = None
+
+
+class EventLoopTest(TestCase):
+
+    """Timers, descriptors and callbacks handed over by other threads run in
+    the loop thread."""
+
+    def setUp(self):
+        TestCase.setUp(self)
+        self.loop = eventloop.EventLoop()
+        self.thread = threading.Thread(target=self.loop.run)
+        self.thread.daemon = True
+
+    def test_timers(self):
+        fired = []
+        self.loop.call_later(0.3, fired.append, 'third')
+        self.loop.call_later(0.1, fired.append, 'first')
+        self.loop.call_later(0.2, fired.append, 'second')
+        self.loop.call_later(0.2, fired.append, 'cancelled').cancel()
+        started = time.time()
+        self.loop.call_later(0.4, self.loop.stop)
+        self.loop.run()
+        self.assertEqual(fired, ['first', 'second', 'third'])
+        self.assertTrue(0.4 <= time.time() - started < 1)
+
+    def test_callbacks_from_other_threads(self):
+        self.thread.start()
+        called = threading.Event()
+        in_loop = []
+        def callback():
+            in_loop.append(self.loop.in_loop())
+            called.set()
+        self.loop.call_soon(callback)
+        self.assertTrue(called.wait(1))
+        self.assertEqual(in_loop, [True])
+        self.loop.stop()
+        self.thread.join(1)
+        self.assertFalse(self.thread.is_alive())
+
+    def test_readable_descriptors(self):
+        r, w = os.pipe()
+        read = []
+        def readable():
+            read.append(os.read(r, 100))
+            self.loop.remove_reader(r)
+            self.loop.stop()
+        self.loop.add_reader(r, readable)
+        self.thread.start()
+        os.write(w, 'data')
+        self.thread.join(1)
+        self.assertFalse(self.thread.is_alive())
+        self.assertEqual(read, ['data'])
+        os.close(r)
+        os.close(w)
+
+    def test_errors_in_callbacks(self):
+        def fail():
+            raise ValueError('boom')
+        self.loop.call_soon(fail)
+        self.loop.call_later(0.1, self.loop.stop)
+        self.loop.run()
+        self.assertEqual(self.log.messages, ['Caught unknown error boom in event loop'])
+
+    def test_run_until(self):
+        state = {'count': 0}
+        def count():
+            state['count'] += 1
+            return state['count'] == 3
+        started = time.time()
+        self.loop.run_until(count, started + 5, 0.05)
+        self.assertEqual(state['count'], 3)
+        self.assertTrue(time.time() - started < 1)
+        started = time.time()
+        self.loop.run_until(lambda: False, started + 0.2, 0.05)
+        self.assertTrue(0.2 <= time.time() - started < 1)
+
+
+class Resolver(dnscache.DnsCache):
+
+    """Resolves names to the addresses given in turn."""
+
+    def __init__(self, ttl, *answers):
+        dnscache.DnsCache.__init__(self, ttl)
+        self.answers = list(answers)
+        self.resolved = 0
+
+    def _resolve(self, name, port):
+        self.resolved += 1
+        answer = self.answers.pop(0)
+        if answer is None:
+            raise socket.gaierror(-2, 'Name or service not known')
+        return list(answer)
+
+
+class DnsCacheTest(TestCase):
+
+    """Resolved addresses are cached for a while and kept if the name cannot
+    be resolved again. Names with several addresses fail over."""
+
+    def test_cached_within_ttl(self):
+        cache = Resolver(0.5, ['10.0.0.1'], ['10.0.0.2'])
+        self.assertEqual(cache.address('example.com', 80), '10.0.0.1')
+        self.assertEqual(cache.address('example.com', 80), '10.0.0.1')
+        self.assertEqual(cache.resolved, 1)
+        time.sleep(0.6)
+        self.assertEqual(cache.address('example.com', 80), '10.0.0.2')
+        self.assertEqual(cache.resolved, 2)
+
+    def test_current_address_kept_first(self):
+        cache = Resolver(0.2, ['10.0.0.1', '10.0.0.2'], ['10.0.0.2', '10.0.0.1'])
+        self.assertEqual(cache.address('example.com', 80), '10.0.0.1')
+        time.sleep(0.3)
+        self.assertEqual(cache.address('example.com', 80), '10.0.0.1')
+
+    def test_addresses_kept_when_the_name_cannot_be_resolved(self):
+        cache = Resolver(0.2, ['10.0.0.1'], None, ['10.0.0.3'])
+        self.assertEqual(cache.address('example.com', 80), '10.0.0.1')
+        time.sleep(0.3)
+        self.assertEqual(cache.address('example.com', 80), '10.0.0.1')
+        self.assertEqual(self.log.messages, [
+            'Cannot resolve example.com, using addresses resolved before: '
+            '[Errno -2] Name or service not known'])
+        self.assertEqual(cache.address('example.com', 80), '10.0.0.1')
+        self.assertEqual(cache.resolved, 2)
+        time.sleep(0.3)
+        self.assertEqual(cache.address('example.com', 80), '10.0.0.3')
+        self.assertEqual(cache.resolved, 3)
+
+    def test_name_never_resolved(self):
+        cache = Resolver(60, None)
+        self.assertRaises(socket.error, cache.address, 'example.com', 80)
+
+    def test_failover(self):
+        cache = Resolver(60, ['10.0.0.1', '10.0.0.2', '10.0.0.3'])
+        for address, more in [('10.0.0.1', True), ('10.0.0.2', True), ('10.0.0.3', False)]:
+            self.assertEqual(cache.address('example.com', 80), address)
+            self.assertEqual(cache.failed('example.com', 80, address), more)
+        self.assertEqual(cache.address('example.com', 80), '10.0.0.1')
+        cache.failed('example.com', 80, '10.0.0.1')
+        cache.connected('example.com', 80)
+        self.assertEqual(cache.address('example.com', 80), '10.0.0.2')
+        self.assertTrue(cache.failed('example.com', 80, '10.0.0.2'))
+
+
+class FairQueueTest(unittest.TestCase):
+
+    """Logs sharing a send queue take turns in proportion to their shares,
+    logs of higher priority are served first and dropped last."""
+
+    def fill(self, queue, flow, count, size=1024):
+        for n in range(count):
+            queue.put('%s%s\n' % (flow.name, 'x' * (size - len(flow.name) - 1)), flow)
+
+    def served(self, queue, count):
+        return ''.join(queue.get_nowait()[0] for n in range(count))
+
+    def test_equal_shares(self):
+        queue = sendqueue.SendQueue(10 ** 6, sendqueue.MemoryBudget(10 ** 6))
+        busy = queue.flow('b')
+        quiet = queue.flow('q')
+        self.fill(queue, busy, 100)
+        self.fill(queue, quiet, 8)
+        self.assertEqual(self.served(queue, 16), 'bbbbqqqqbbbbqqqq')
+
+    def test_shares_in_proportion(self):
+        queue = sendqueue.SendQueue(10 ** 6, sendqueue.MemoryBudget(10 ** 6))
+        small = queue.flow('s')
+        large = queue.flow('l', 3)
+        self.fill(queue, small, 100)
+        self.fill(queue, large, 100)
+        order = self.served(queue, 80)
+        self.assertEqual((order.count('s'), order.count('l')), (20, 60))
+
+    def test_priority_served_first(self):
+        queue = sendqueue.SendQueue(10 ** 6, sendqueue.MemoryBudget(10 ** 6))
+        low = queue.flow('l')
+        high = queue.flow('h', priority=1)
+        self.fill(queue, low, 4)
+        self.fill(queue, high, 4)
+        self.assertEqual(self.served(queue, 8), 'hhhhllll')
+
+    def test_busy_log_dropped_first(self):
+        queue = sendqueue.SendQueue(20 * 1024, sendqueue.MemoryBudget(10 ** 6))
+        busy = queue.flow('b')
+        quiet = queue.flow('q')
+        self.fill(queue, quiet, 4)
+        self.fill(queue, busy, 40)
+        self.assertEqual((busy.dropped_entries, quiet.dropped_entries,
+                          len(busy.entries), len(quiet.entries)), (24, 0, 16, 4))
+
+    def test_low_priority_dropped_first(self):
+        queue = sendqueue.SendQueue(20 * 1024, sendqueue.MemoryBudget(10 ** 6))
+        low = queue.flow('l')
+        high = queue.flow('h', priority=1)
+        self.fill(queue, low, 10)
+        self.fill(queue, high, 15)
+        self.assertEqual((low.dropped_entries, high.dropped_entries,
+                          len(low.entries), len(high.entries)), (5, 0, 5, 15))
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    """Limits allow bursts of one second's worth and wait for the tokens
+    missing."""
+
+    def test_refill(self):
+        bucket = ratelimit.TokenBucket(10)
+        start = bucket.updated
+        self.assertEqual((bucket.available(), bucket.wait()), (10, 0))
+        bucket.take(25)
+        self.assertEqual((bucket.available(), bucket.wait()), (0, 1.5))
+        bucket.refill(start + 1)
+        self.assertEqual((bucket.available(), bucket.wait()), (0, 0.5))
+        bucket.refill(start + 1.5)
+        self.assertEqual((bucket.available(), bucket.wait()), (0, 0))
+        bucket.refill(start + 10)
+        self.assertEqual((bucket.available(), bucket.wait()), (10, 0))
+        # Clock set back
+        bucket.refill(start)
+        self.assertEqual((bucket.available(), bucket.wait()), (10, 0))
+
+
+class CountingTransport(object):
+
+    """Counts blocks sent by followers."""
+
+    def __init__(self):
+        self.blocks = 0
+
+    def send(self, line, flow=None):
+        self.blocks += 1
+
+
+class TurnFollower(le.Follower):
+
+    """Records the number of blocks read in every turn."""
+
+    def __init__(self, *args, **kwargs):
+        self.turns = []
+        le.Follower.__init__(self, *args, **kwargs)
+
+    def _read_blocks(self):
+        blocks = self.transport.blocks
+        more = le.Follower._read_blocks(self)
+        if self.transport.blocks > blocks:
+            self.turns.append(self.transport.blocks - blocks)
+        return more
+
+
+class LagTest(TestCase):
+
+    """Followers report how far behind their files they are; files far
+    behind are read in longer turns until they catch up."""
+
+    def write(self, name, size):
+        line = 'x' * 99 + '\n'
+        with open(name, 'a') as f:
+            f.write(line * (size / len(line)))
+
+    def test_lag_reported(self):
+        reactor = le.FollowerReactor(None, None, 1)
+        open('limited.log', 'w').close()
+        follower = self.follow('limited.log', reactor, CountingTransport(),
+                               rate_limit=ratelimit.RateLimit('limited', 100, 0))
+        time.sleep(0.5)
+        stats = follower.stats()
+        self.assertEqual((stats['offset'], stats['size'], stats['lag'], stats['lag_seconds']),
+                         (0, 0, 0, 0))
+        self.write('limited.log', 30000)
+        time.sleep(1.5)
+        stats = follower.stats()
+        self.assertLess(stats['offset'], stats['size'])
+        self.assertEqual(stats['lag'], stats['size'] - stats['offset'])
+        self.assertGreaterEqual(stats['lag_seconds'], 1)
+        time.sleep(2)
+        stats = follower.stats()
+        reactor.close()
+        self.assertEqual((stats['offset'], stats['size'], stats['lag'], stats['lag_seconds']),
+                         (30000, 30000, 0, 0))
+
+    def test_files_far_behind_catch_up_in_longer_turns(self):
+        # 129 blocks of 655 lines
+        self.write('behind.log', 8 * 1024 * 1024)
+        reactor = le.FollowerReactor(None, None, 1)
+        behind = TurnFollower(os.path.abspath('behind.log'), lambda line: line, lambda line: line,
+                              CountingTransport(), reactor, from_start=True)
+        time.sleep(2)
+        reactor.close()
+        self.assertEqual((le.MAX_BLOCKS_SERVICED, le.CATCH_UP_BLOCKS_SERVICED), (16, 64))
+        self.assertEqual(behind.turns, [64, 64, 1])
+
+
+class SpoolTest(TestCase):
+
+    """Spooled entries are read back in order and committed once
+    delivered."""
+
+    def append(self, spool, first, last):
+        for n in range(first, last + 1):
+            spool.append('%02d%s\n' % (n, 'x' * 47))
+
+    def entries(self, data):
+        return [line[:2] for line in data.splitlines()]
+
+    def test_replayed_in_order(self):
+        spool = Spool('spool', 1000, 100)
+        self.append(spool, 0, 4)
+        replayed = []
+        while True:
+            data = spool.read(120)
+            if not data:
+                break
+            replayed += self.entries(data)
+            spool.commit(len(data))
+        self.assertEqual(replayed, ['00', '01', '02', '03', '04'])
+        self.assertEqual(spool.pending(), 0)
+
+    def test_replayed_after_close(self):
+        spool = Spool('spool', 1000, 100)
+        self.append(spool, 0, 3)
+        spool.commit(len(spool.read(50)))
+        spool.read(50)
+        spool.close()
+        spool = Spool('spool', 1000, 100)
+        self.assertEqual(spool.pending(), 150)
+        self.assertEqual(self.entries(spool.read(1000)), ['01'])
+
+    def test_dropped_while_read(self):
+        spool = Spool('spool', 250, 100)
+        self.append(spool, 0, 2)
+        data = spool.read(1000)
+        self.assertEqual(self.entries(data), ['00', '01'])
+        # The segment read is dropped before the entries read are delivered
+        self.append(spool, 3, 5)
+        self.assertEqual((spool.evicted_events, spool.evicted_bytes), (2, 100))
+        spool.commit(len(data))
+        self.assertEqual(spool.pending(), 200)
+        self.assertEqual(self.entries(spool.read(1000)), ['02', '03'])
+
+
+class TransportTest(TestCase):
+
+    """Batches written to connections closed by the remote side are written
+    again over a new connection."""
+
+    def send(self, transport, *entries):
+        for entry in entries:
+            transport.send(entry)
+            time.sleep(0.1)
+
+    def sent(self, closed_after):
+        sink = Sink(True)
+        transport = le.Transport('127.0.0.1', sink.port, False, '', False,
+                                 (le.NOT_SET, le.NOT_SET, le.NOT_SET))
+        time.sleep(0.2)
+        self.send(transport, 'one\n')
+        time.sleep(closed_after)
+        self.send(transport, 'two\n', 'three\n')
+        time.sleep(0.5)
+        transport.close()
+        return sink.lines()
+
+    def test_written_again_after_write_error(self):
+        # The write of the second batch succeeds, the third fails
+        self.assertEqual(self.sent(0), ['one', 'two', 'three'])
+
+    def test_idle_connection_checked(self):
+        # The first batch may not have been delivered
+        self.assertEqual(self.sent(le.SEND_IDLE_CHECK), ['one', 'one', 'two', 'three'])
+
+
+class DirectoryIndexTest(TestCase):
+
+    """Files renamed within watched directories are found by device and inode
+    without examining entries already known."""
+
+    def test_renamed_file_found(self):
+        watcher = inotify.create_watcher()
+        index = le.DirectoryIndex(watcher)
+        for n in range(20):
+            open('%02d.log' % n, 'w').close()
+        index.subscribe(self.tmp, None, lambda mask, name: None)
+        index.names(self.tmp)
+        ids = [index.lookup(os.path.join(self.tmp, '%02d.log' % n)) for n in range(20)]
+        os.rename('05.log', '05.log.1')
+        time.sleep(0.2)
+        stats = []
+        stat = os.stat
+        os.stat = lambda path: stats.append(path) or stat(path)
+        try:
+            self.assertEqual(index.find(self.tmp, ids[5]), os.path.join(self.tmp, '05.log.1'))
+            self.assertEqual(index.find(self.tmp, ids[5]), os.path.join(self.tmp, '05.log.1'))
+            self.assertIsNone(index.find(self.tmp, (0, 0)))
+        finally:
+            os.stat = stat
+        self.assertEqual(stats, [os.path.join(self.tmp, '05.log.1')])
+        watcher.close()
+
+
+if __name__ == '__main__':
+    unittest.main()